@@ -0,0 +1,72 @@
+import os
+import json
+import threading
+
+# Drive reports an md5Checksum for every binary file, so copies of the same
+# bytes ("Resume (1).pdf", the deck in three folders) share one content key.
+# Google-native files have no checksum and are never grouped.
+
+def content_key(raw: dict | None) -> str | None:
+    md5 = (raw or {}).get("md5Checksum")
+    return f"md5:{md5}" if md5 else None
+
+def doc_content_key(doc: dict) -> str | None:
+    return content_key(doc.get("raw"))
+
+def build_content_groups(mapping: list[dict]) -> dict[str, list[dict]]:
+    """Content key -> every copy ({id, name, link}), for content stored more than once."""
+    groups = {}
+    for rec in mapping:
+        key = doc_content_key(rec)
+        if key:
+            groups.setdefault(key, []).append({"id": rec["id"], "name": rec["name"], "link": rec.get("link")})
+    return {k: v for k, v in groups.items() if len(v) > 1}
+
+
+# Persistence + per-process cache keyed by file mtime
+def content_groups_path(user_id: str) -> str:
+    return f"user_data/{user_id}/content_groups.json"
+
+def save_content_groups(groups: dict, user_id: str):
+    path = content_groups_path(user_id)
+    with open(path + ".tmp", "w") as f:
+        json.dump(groups, f)
+    os.replace(path + ".tmp", path)
+
+_cache, _cache_lock = {}, threading.Lock()
+
+def load_content_groups(user_id: str) -> dict:
+    path = content_groups_path(user_id)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    with _cache_lock:
+        hit = _cache.get(user_id)
+        if hit and hit[0] == mtime:
+            return hit[1]
+    with open(path) as f:
+        groups = json.load(f)
+    with _cache_lock:
+        _cache[user_id] = (mtime, groups)
+    return groups
+
+
+def collapse_duplicates(records: list[dict], groups: dict | None = None) -> list[dict]:
+    """
+    Keep the first (best-ranked) record per content key. With *groups*
+    the survivor gets `copies`: every location of that content.
+    """
+    out, seen = [], set()
+    for rec in records:
+        key = doc_content_key(rec)
+        if key is None:
+            out.append(rec)
+            continue
+        if key in seen:
+            continue
+        seen.add(key)
+        if groups and key in groups:
+            rec = {**rec, "copies": groups[key]}
+        out.append(rec)
+    return out
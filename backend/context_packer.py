@@ -0,0 +1,128 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# prompt budgets, in tokens of the completion model
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+HISTORY_MAX_TURNS    = 5
+TOKENIZER_ENCODING   = os.getenv("TOKENIZER_ENCODING", "o200k_base")   # gpt-4o family
+
+GAP = " … "     # between non-contiguous spans of one document
+
+# Local tokenizer: tiktoken when installed and its BPE file is available,
+# else ~4 characters per token (close enough for English prose)
+try:
+    import tiktoken
+    _enc = tiktoken.get_encoding(TOKENIZER_ENCODING)
+except Exception as e:
+    print("⚠️ tiktoken unavailable, approximating token counts:", e)
+    _enc = None
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _enc is not None:
+        return len(_enc.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_tokens(text: str, limit: int) -> str:
+    """First *limit* tokens of *text*."""
+    if limit <= 0:
+        return ""
+    if _enc is not None:
+        ids = _enc.encode(text, disallowed_special=())
+        return text if len(ids) <= limit else _enc.decode(ids[:limit]) + "…"
+    return text if len(text) <= limit * 4 else text[: limit * 4] + "…"
+
+
+def chunk_spans(n_words: int, size: int, overlap: int) -> list[tuple[int, int]]:
+    """Word ranges of the chunks `chunk_text` cuts from a text of *n_words*."""
+    step = size - overlap
+    return [(i, min(i + size, n_words)) for i in range(0, n_words, step)]
+
+def _merge(spans: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    out = []
+    for a, b in sorted(spans):
+        if out and a <= out[-1][1]:          # overlapping or adjacent
+            out[-1] = (out[-1][0], max(out[-1][1], b))
+        else:
+            out.append((a, b))
+    return out
+
+def _uncovered(span, covered):
+    """Parts of *span* not already inside the merged *covered* spans."""
+    a, b = span
+    parts = []
+    for c, d in covered:
+        if d <= a or c >= b:
+            continue
+        if c > a:
+            parts.append((a, c))
+        a = max(a, d)
+    if a < b:
+        parts.append((a, b))
+    return parts
+
+
+def pack_context(docs: list[dict], budget: int = CONTEXT_TOKEN_BUDGET) -> tuple[str, list[int]]:
+    """
+    Greedy context assembly across documents.
+
+    *docs* entries: {"name", "words", "spans", "scores"}, one score per span.
+    Spans are taken best-first over all documents. Each one is charged only
+    for the words not already selected, so overlapping or adjacent chunks
+    cost their new text once, and a document header is charged the first
+    time it appears. Spans that do not fit are skipped. Returns the context
+    text (documents by best score, spans in reading order) and the indexes
+    of the documents that made it in.
+    """
+    order = sorted(
+        ((float(s), d, j) for d, doc in enumerate(docs) for j, s in enumerate(doc["scores"])),
+        reverse=True,
+    )
+    chosen, best, used = {}, {}, 0
+    for score, d, j in order:
+        doc  = docs[d]
+        span = doc["spans"][j]
+        new  = _uncovered(span, chosen.get(d, []))
+        if not new:
+            continue
+        cost = sum(count_tokens(" ".join(doc["words"][a:b])) for a, b in new)
+        if d not in chosen:
+            cost += count_tokens(f"### {doc['name']}\n")
+        if used + cost > budget:
+            continue
+        used += cost
+        chosen[d] = _merge(chosen.get(d, []) + [span])
+        best.setdefault(d, score)
+
+    parts = []
+    for d in sorted(chosen, key=lambda d: -best[d]):
+        words = docs[d]["words"]
+        body  = GAP.join(" ".join(words[a:b]) for a, b in chosen[d])
+        parts.append(f"### {docs[d]['name']}\n{body}")
+    return "\n\n".join(parts), sorted(chosen, key=lambda d: -best[d])
+
+
+def pack_history(history: list[dict] | None, budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """
+    Newest turns first, until *budget* runs out. A turn that does not fit
+    whole keeps its question and a trimmed answer; older turns are dropped.
+    """
+    if not history:
+        return ""
+    turns, left = [], budget
+    for h in reversed(history[-HISTORY_MAX_TURNS:]):
+        q, a = f"USER: {h['q']}\n", f"ASSISTANT: {h['a']}"
+        cost = count_tokens(q) + count_tokens(a)
+        if cost <= left:
+            turns.append(q + a)
+            left -= cost
+            continue
+        room = left - count_tokens(q) - 4
+        if room > 20:
+            turns.append(q + truncate_tokens(a, room))
+        break
+    return "\n\n".join(reversed(turns))
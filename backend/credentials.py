@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import threading
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# OAuth token endpoint, point it at a local stand-in for testing
+GOOGLE_TOKEN_URL     = os.getenv("GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token")
+TOKEN_REFRESH_SKEW_S = float(os.getenv("TOKEN_REFRESH_SKEW_S", "300"))   # refresh this early
+TOKEN_DEFAULT_TTL_S  = 3600                                                # Google access tokens
+
+
+def tokens_path(user_id: str) -> str:
+    return f"user_data/{user_id}/tokens.json"
+
+def _write_atomic(path: str, data: dict):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class CredentialManager:
+    """
+    In-memory cache of each user's tokens.json with the access-token expiry.
+    Tokens are refreshed with the stored refresh_token shortly before they
+    expire. Refreshes are single-flight per user, and the result is
+    persisted atomically.
+    """
+
+    def __init__(self, token_url: str = GOOGLE_TOKEN_URL):
+        self.token_url = token_url
+        self.stats     = {"loads": 0, "refreshes": 0, "refresh_failures": 0}
+        self._cache    = {}
+        self._locks    = {}
+        self._lock     = threading.Lock()
+        self._session  = requests.Session()
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def _load(self, user_id: str) -> dict | None:
+        path = tokens_path(user_id)
+        try:
+            with open(path) as f:
+                rec = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # files written before expiries were stored: assume issued when saved
+        rec.setdefault("expires_at", os.path.getmtime(path) + TOKEN_DEFAULT_TTL_S)
+        self.stats["loads"] += 1
+        return rec
+
+    def _fresh(self, rec: dict) -> bool:
+        return rec["expires_at"] - TOKEN_REFRESH_SKEW_S > time.time()
+
+    def store(self, user_id: str, token_resp: dict, email: str | None = None):
+        """Persist a token endpoint response (login or refresh) and cache it."""
+        old = self._cache.get(user_id) or self._load(user_id) or {}
+        rec = {
+            "access_token":  token_resp["access_token"],
+            # Google only sends refresh_token on consent, keep the old one otherwise
+            "refresh_token": token_resp.get("refresh_token") or old.get("refresh_token"),
+            "email":         email or old.get("email"),
+            "expires_at":    time.time() + float(token_resp.get("expires_in", TOKEN_DEFAULT_TTL_S)),
+        }
+        os.makedirs(os.path.dirname(tokens_path(user_id)), exist_ok=True)
+        _write_atomic(tokens_path(user_id), rec)
+        self._cache[user_id] = rec
+        return rec
+
+    def _refresh(self, user_id: str, rec: dict) -> dict | None:
+        if not rec.get("refresh_token"):
+            return None
+        try:
+            r = self._session.post(self.token_url, timeout=(5, 20), data={
+                "grant_type":    "refresh_token",
+                "refresh_token": rec["refresh_token"],
+                "client_id":     os.getenv("GOOGLE_CLIENT_ID"),
+                "client_secret": os.getenv("GOOGLE_CLIENT_SECRET"),
+            })
+            payload = r.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"❌ token refresh failed for {user_id}:", e)
+            self.stats["refresh_failures"] += 1
+            return None
+        if r.status_code != 200 or "access_token" not in payload:
+            print(f"❌ token refresh rejected for {user_id}:", payload)
+            self.stats["refresh_failures"] += 1
+            return None
+        self.stats["refreshes"] += 1
+        return self.store(user_id, payload)
+
+    def get_access_token(self, user_id: str) -> str | None:
+        """A valid access token for *user_id*, or None if not authenticated."""
+        rec = self._cache.get(user_id)
+        if rec and self._fresh(rec):
+            return rec["access_token"]
+
+        with self._user_lock(user_id):
+            # another request may have loaded / refreshed while we waited
+            rec = self._cache.get(user_id) or self._load(user_id)
+            if rec is None:
+                return None
+            self._cache[user_id] = rec
+            if self._fresh(rec):
+                return rec["access_token"]
+            new = self._refresh(user_id, rec)
+            if new:
+                return new["access_token"]
+            # refresh failed: hand out the old token while it still works
+            return rec["access_token"] if rec["expires_at"] > time.time() else None
+
+    def force_refresh(self, user_id: str, stale_token: str | None = None) -> str | None:
+        """Drive said 401: refresh once, even if many requests report it at the same time."""
+        with self._user_lock(user_id):
+            rec = self._cache.get(user_id) or self._load(user_id)
+            if rec is None:
+                return None
+            if stale_token and rec["access_token"] != stale_token and self._fresh(rec):
+                return rec["access_token"]
+            new = self._refresh(user_id, rec)
+            return new["access_token"] if new else None
+
+    def forget(self, user_id: str):
+        self._cache.pop(user_id, None)
+
+
+# shared manager for the whole process
+credentials = CredentialManager()
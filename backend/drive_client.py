@@ -0,0 +1,169 @@
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Drive endpoint, point it at a local fake server for testing
+DRIVE_API_BASE = os.getenv("DRIVE_API_BASE", "https://www.googleapis.com/drive/v3").rstrip("/")
+
+# client knobs
+DRIVE_CONNECT_TIMEOUT = float(os.getenv("DRIVE_CONNECT_TIMEOUT", "5"))
+DRIVE_READ_TIMEOUT    = float(os.getenv("DRIVE_READ_TIMEOUT", "60"))
+DRIVE_MAX_RETRIES     = int(os.getenv("DRIVE_MAX_RETRIES", "5"))
+DRIVE_BACKOFF_BASE    = float(os.getenv("DRIVE_BACKOFF_BASE", "0.5"))
+DRIVE_BACKOFF_CAP     = float(os.getenv("DRIVE_BACKOFF_CAP", "30"))
+DRIVE_USER_QPS        = float(os.getenv("DRIVE_USER_QPS", "10"))
+DRIVE_USER_BURST      = float(os.getenv("DRIVE_USER_BURST", "20"))
+DRIVE_POOL_SIZE       = int(os.getenv("DRIVE_POOL_SIZE", "32"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class TokenBucket:
+    """Classic token bucket; `take` blocks until a token is free."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate   = rate
+        self.burst  = burst
+        self.tokens = burst
+        self.stamp  = time.monotonic()
+        self.lock   = threading.Lock()
+
+    def take(self) -> float:
+        """Consume one token, return the seconds spent waiting for it."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp  = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class DriveClient:
+    """
+    The one way the backend talks to Drive: pooled keep-alive sessions,
+    timeouts on every call, retries with exponential backoff + full jitter
+    on 429/5xx/quota-403, and a per-user token bucket.
+    """
+
+    def __init__(self, base: str = DRIVE_API_BASE):
+        self.base     = base
+        self.timeout  = (DRIVE_CONNECT_TIMEOUT, DRIVE_READ_TIMEOUT)
+        self.stats    = {"requests": 0, "retries": 0, "throttled": 0, "errors": 0,
+                         "limiter_waits": 0, "reauths": 0}
+        # (user_id, stale_token) -> fresh token or None, called once on a 401
+        self.on_unauthorized = None
+        self._local   = threading.local()
+        self._buckets = {}
+        self._lock    = threading.Lock()
+
+    # one pooled session per thread, requests.Session isn't thread-safe
+    def _session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=DRIVE_POOL_SIZE, pool_maxsize=DRIVE_POOL_SIZE)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            self._local.session = s
+        return s
+
+    def _bucket(self, key: str) -> TokenBucket:
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = TokenBucket(DRIVE_USER_QPS, DRIVE_USER_BURST)
+            return b
+
+    def _bump(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    @staticmethod
+    def _is_rate_limited(r: requests.Response) -> bool:
+        if r.status_code == 429:
+            return True
+        if r.status_code != 403:
+            return False
+        try:
+            errors = r.json().get("error", {}).get("errors", [])
+        except ValueError:
+            return False
+        return any(e.get("reason") in RATE_LIMIT_REASONS for e in errors)
+
+    @staticmethod
+    def _backoff(attempt: int, r: requests.Response | None) -> float:
+        if r is not None and (ra := r.headers.get("Retry-After")):
+            try:
+                return min(float(ra), DRIVE_BACKOFF_CAP)
+            except ValueError:
+                pass
+        return random.uniform(0, min(DRIVE_BACKOFF_CAP, DRIVE_BACKOFF_BASE * 2 ** attempt))
+
+    def get(self, path: str, token: str, user_id: str | None = None, **kw) -> requests.Response:
+        """
+        GET `base + path` (or an absolute URL) as the user owning *token*.
+        Returns the final response, HTTP errors included; raises the last
+        `requests.RequestException` if the connection kept failing.
+        """
+        url = path if path.startswith("http") else f"{self.base}{path}"
+        headers = {**kw.pop("headers", {}), "Authorization": f"Bearer {token}"}
+        kw.setdefault("timeout", self.timeout)
+        bucket = self._bucket(user_id or token)
+
+        attempt, reauthed = 0, False
+        while True:
+            if bucket.take() > 0:
+                self._bump("limiter_waits")
+            self._bump("requests")
+            r, err = None, None
+            try:
+                r = self._session().get(url, headers=headers, **kw)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                err = e
+
+            if r is not None and r.status_code == 401 and user_id and self.on_unauthorized and not reauthed:
+                reauthed = True
+                fresh = self.on_unauthorized(user_id, token)
+                if fresh and fresh != token:
+                    token = fresh
+                    headers["Authorization"] = f"Bearer {token}"
+                    r.close()
+                    self._bump("reauths")
+                    continue
+
+            if r is not None:
+                throttled = self._is_rate_limited(r)
+                if throttled:
+                    self._bump("throttled")
+                if not throttled and r.status_code not in RETRY_STATUS:
+                    return r
+
+            if attempt >= DRIVE_MAX_RETRIES:
+                self._bump("errors")
+                if err is not None:
+                    raise err
+                return r
+
+            delay = self._backoff(attempt, r)
+            if r is not None:
+                r.close()
+            self._bump("retries")
+            attempt += 1
+            time.sleep(delay)
+
+
+# shared client for the whole process
+drive = DriveClient()
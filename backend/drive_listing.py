@@ -0,0 +1,158 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from drive_client import drive
+
+load_dotenv()
+
+# listing knobs
+DRIVE_LIST_WORKERS     = int(os.getenv("DRIVE_LIST_WORKERS", "8"))
+DRIVE_LIST_TIME_SPLITS = [
+    y.strip() for y in os.getenv("DRIVE_LIST_TIME_SPLITS", "2016,2019,2021,2023,2025").split(",") if y.strip()
+]
+
+# mimeType groups, every file lands in exactly one (the last one catches the rest)
+MIME_GROUPS = [
+    "mimeType = 'application/vnd.google-apps.folder'",
+    "mimeType = 'application/vnd.google-apps.document'",
+    "mimeType = 'application/vnd.google-apps.spreadsheet'",
+    "mimeType = 'application/vnd.google-apps.presentation'",
+    "mimeType = 'application/pdf'",
+    "mimeType contains 'image/'",
+    "mimeType contains 'video/'",
+    "mimeType contains 'audio/'",
+    "mimeType contains 'text/'",
+    "mimeType contains 'officedocument'",
+]
+
+class ListingError(Exception):
+    """files.list failed for a partition; carries the Drive error text."""
+
+
+# Metadata file helpers
+def drive_files_paths(user_id: str) -> tuple[str, str]:
+    base = f"user_data/{user_id}"
+    return f"{base}/drive_files.json", f"{base}/drive_files.ndjson"
+
+def drive_files_exist(user_id: str) -> bool:
+    return any(os.path.exists(p) for p in drive_files_paths(user_id))
+
+def iter_drive_files(user_id: str):
+    """Yield every cached file record, whichever format was written last."""
+    json_path, ndjson_path = drive_files_paths(user_id)
+    if os.path.exists(ndjson_path):
+        with open(ndjson_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif os.path.exists(json_path):
+        with open(json_path, "r") as f:
+            yield from json.load(f)
+
+def read_drive_files(user_id: str) -> list[dict]:
+    return list(iter_drive_files(user_id))
+
+
+# Partitioning
+def _negate(clause: str) -> str:
+    if " = " in clause:
+        return clause.replace(" = ", " != ")
+    return f"not {clause}"
+
+def _time_ranges(splits: list[str]) -> list[str]:
+    if not splits:
+        return [""]
+    bounds = [f"{y}-01-01T00:00:00" for y in splits]
+    ranges = [f"modifiedTime < '{bounds[0]}'"]
+    ranges += [f"modifiedTime >= '{a}' and modifiedTime < '{b}'" for a, b in zip(bounds, bounds[1:])]
+    ranges.append(f"modifiedTime >= '{bounds[-1]}'")
+    return ranges
+
+def build_partitions(time_splits: list[str] | None = None) -> list[str]:
+    """
+    Split the whole Drive into independent `q` filters: mimeType group x
+    modifiedTime range. Together they cover every file exactly once.
+    """
+    groups = MIME_GROUPS + [" and ".join(_negate(g) for g in MIME_GROUPS)]
+    ranges = _time_ranges(DRIVE_LIST_TIME_SPLITS if time_splits is None else time_splits)
+    return [" and ".join(p for p in (g, r) if p) for g in groups for r in ranges]
+
+
+# Parallel listing
+class _NdjsonSink:
+    """Thread-safe NDJSON writer that drops ids it has already seen."""
+
+    def __init__(self, path: str):
+        self.f     = open(path, "w")
+        self.seen  = set()
+        self.dupes = 0
+        self.lock  = threading.Lock()
+
+    def write(self, files: list[dict]):
+        with self.lock:
+            for rec in files:
+                if rec["id"] in self.seen:
+                    self.dupes += 1
+                    continue
+                self.seen.add(rec["id"])
+                self.f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+
+    def close(self):
+        self.f.close()
+
+def _list_partition(q: str, user_id: str, token: str, fields: str, sink: _NdjsonSink, on_page=None):
+    page_token = None
+    while True:
+        r = drive.get("/files", token, user_id=user_id, params={
+            "q": q,
+            "pageSize": 1000,
+            "fields": f"nextPageToken,files({fields})",
+            "pageToken": page_token,
+        })
+        if r.status_code != 200:
+            raise ListingError(r.text)
+        payload = r.json()
+        files = payload.get("files", [])
+        sink.write(files)
+        if on_page:
+            on_page(len(files))
+        page_token = payload.get("nextPageToken")
+        if not page_token:
+            return
+
+def list_drive_files_parallel(user_id: str, token: str, fields: str,
+                              workers: int = DRIVE_LIST_WORKERS, on_page=None) -> int:
+    """
+    Fetch all partitions concurrently and stream them into
+    user_data/<id>/drive_files.ndjson, deduplicated by id.
+    Returns the number of unique files written.
+    Raises ListingError / requests.RequestException if any partition fails,
+    leaving the previous metadata file untouched.
+    """
+    json_path, ndjson_path = drive_files_paths(user_id)
+    os.makedirs(os.path.dirname(ndjson_path), exist_ok=True)
+    tmp_path = ndjson_path + ".tmp"
+
+    sink = _NdjsonSink(tmp_path)
+    ex   = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-list")
+    try:
+        futs = [ex.submit(_list_partition, q, user_id, token, fields, sink, on_page)
+                for q in build_partitions()]
+        for fut in futs:
+            fut.result()
+    except Exception:
+        ex.shutdown(wait=True, cancel_futures=True)
+        sink.close()
+        os.remove(tmp_path)
+        raise
+    ex.shutdown()
+    sink.close()
+
+    os.replace(tmp_path, ndjson_path)
+    if os.path.exists(json_path):
+        os.remove(json_path)
+    if sink.dupes:
+        print(f"🔁 Dropped {sink.dupes} duplicate listings for {user_id}")
+    return len(sink.seen)
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# batching knobs
+EMBED_MAX_BATCH   = int(os.getenv("EMBED_MAX_BATCH", "64"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+
+class _Pending:
+    """One caller's encode request, waiting for its rows."""
+    __slots__ = ("texts", "done", "result", "error")
+
+    def __init__(self, texts):
+        self.texts  = texts
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces encode requests from concurrent callers into one model call.
+    A single worker thread takes the first pending request, then keeps
+    collecting until `max_batch` rows are queued or `max_wait_ms` has passed,
+    runs one forward pass and hands every caller back its own rows.
+
+    Requests larger than `max_batch` (index builds, batch queries) are split
+    into `max_batch`-row slices on a bulk queue; requests that fit in one
+    slice are served first, so they wait behind at most one bulk pass.
+    """
+
+    def __init__(self, model, max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.model       = model
+        self.max_batch   = max_batch
+        self.max_wait    = max_wait_ms / 1000.0
+        self.stats       = {"batches": 0, "rows": 0, "requests": 0}
+        self._lock       = threading.Lock()
+        self._pid        = None
+        self._start()
+
+    def _start(self):
+        # threads don't survive fork (gunicorn --preload): each worker starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._cond   = threading.Condition()
+            self._small  = deque()
+            self._bulk   = deque()
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker.start()
+            self._pid    = os.getpid()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Embed *texts*, sharing the forward pass with other in-flight callers."""
+        if not texts:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype="float32")
+        if self._pid != os.getpid():
+            self._start()
+        texts = list(texts)
+        parts = [_Pending(texts[i : i + self.max_batch]) for i in range(0, len(texts), self.max_batch)]
+        with self._cond:
+            (self._small if len(parts) == 1 else self._bulk).extend(parts)
+            self._cond.notify()
+        for p in parts:
+            p.done.wait()
+            if p.error is not None:
+                raise p.error
+        return parts[0].result if len(parts) == 1 else np.concatenate([p.result for p in parts])
+
+    def _next(self) -> _Pending | None:
+        # with _cond held: single-slice requests go ahead of bulk slices
+        q = self._small or self._bulk
+        return q[0] if q else None
+
+    def _collect(self) -> list[_Pending]:
+        with self._cond:
+            while self._next() is None:
+                self._cond.wait()
+            batch = [(self._small or self._bulk).popleft()]
+            rows  = len(batch[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_batch:
+                p = self._next()
+                if p is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                    continue
+                if rows + len(p.texts) > self.max_batch:
+                    break
+                batch.append((self._small or self._bulk).popleft())
+                rows += len(p.texts)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [t for p in batch for t in p.texts]
+            try:
+                embs = self.model.encode(
+                    texts, batch_size=self.max_batch, convert_to_numpy=True
+                ).astype("float32", copy=False)
+            except Exception as e:
+                for p in batch:
+                    p.error = e
+                    p.done.set()
+                continue
+
+            self.stats["batches"]  += 1
+            self.stats["rows"]     += len(texts)
+            self.stats["requests"] += len(batch)
+
+            # hand each caller back its own slice
+            start = 0
+            for p in batch:
+                end = start + len(p.texts)
+                p.result = embs[start:end]
+                start = end
+                p.done.set()
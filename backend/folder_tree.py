@@ -0,0 +1,141 @@
+import os
+import pickle
+import threading
+import numpy as np
+
+# Folder tree built from `parents` at index time.
+# Nodes are the rows of metadata_mapping.pkl (same order as the FAISS index),
+# so node i is file mapping[i]. Adjacency is CSR: the children of i are
+# child_index[child_offsets[i]:child_offsets[i+1]]. A DFS preorder puts every
+# subtree in one contiguous slice: order[tin[i] : tin[i] + size[i]].
+
+FOLDER_TYPE = "folder"
+
+
+class FolderTree:
+    def __init__(self, ids, names, types, parent, child_offsets, child_index, order, tin, size, paths):
+        self.ids           = ids
+        self.names         = names
+        self.types         = types
+        self.parent        = parent
+        self.child_offsets = child_offsets
+        self.child_index   = child_index
+        self.order         = order
+        self.tin           = tin
+        self.size          = size
+        self.paths         = paths
+        self._pos          = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index_of(self, file_id: str) -> int | None:
+        if self._pos is None:
+            self._pos = {fid: i for i, fid in enumerate(self.ids)}
+        return self._pos.get(file_id)
+
+    def children(self, i: int) -> np.ndarray:
+        return self.child_index[self.child_offsets[i] : self.child_offsets[i + 1]]
+
+    def subtree(self, i: int) -> np.ndarray:
+        """Every descendant of node *i* (not *i* itself)."""
+        start = self.tin[i]
+        return self.order[start + 1 : start + self.size[i]]
+
+    def descendant_count(self, i: int) -> int:
+        return int(self.size[i]) - 1
+
+    def find_folders(self, name: str) -> list[int]:
+        """Folders whose name matches *name* (case-insensitive), biggest first."""
+        key = name.strip().lower() if isinstance(name, str) else ""
+        if not key:
+            return []
+        hits = [i for i, (n, t) in enumerate(zip(self.names, self.types))
+                if t == FOLDER_TYPE and (n or "").lower() == key]
+        return sorted(hits, key=lambda i: -self.size[i])
+
+
+def build_folder_tree(mapping: list[dict]) -> FolderTree:
+    n      = len(mapping)
+    ids    = [rec["id"] for rec in mapping]
+    names  = [rec.get("name") or "" for rec in mapping]
+    types  = [rec.get("type") for rec in mapping]
+    pos    = {fid: i for i, fid in enumerate(ids)}
+
+    # first known parent, -1 when the parent isn't in the listing (My Drive root, shared)
+    parent = np.full(n, -1, dtype=np.int32)
+    for i, rec in enumerate(mapping):
+        for pid in rec.get("raw", {}).get("parents") or []:
+            if pid in pos and pos[pid] != i:
+                parent[i] = pos[pid]
+                break
+
+    # CSR adjacency
+    kids = np.nonzero(parent >= 0)[0]
+    kids = kids[np.argsort(parent[kids], kind="stable")].astype(np.int32)
+    counts = np.bincount(parent[kids], minlength=n) if len(kids) else np.zeros(n, dtype=np.int64)
+    child_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=child_offsets[1:])
+
+    # iterative DFS preorder: tin, subtree size, full paths
+    order = np.empty(n, dtype=np.int32)
+    tin   = np.full(n, -1, dtype=np.int64)
+    size  = np.ones(n, dtype=np.int32)
+    paths = [""] * n
+    t = 0
+    roots = np.nonzero(parent < 0)[0].tolist()
+    for root in roots:
+        paths[root] = "/" + names[root]
+        stack = [(root, False)]
+        while stack:
+            node, leaving = stack.pop()
+            if leaving:
+                p = parent[node]
+                if p >= 0:
+                    size[p] += size[node]
+                continue
+            tin[node] = t
+            order[t] = node
+            t += 1
+            stack.append((node, True))
+            for c in kids[child_offsets[node] : child_offsets[node + 1]][::-1]:
+                if tin[c] < 0:
+                    paths[c] = paths[node] + "/" + names[c]
+                    stack.append((int(c), False))
+
+    # anything unreachable (parent cycles) becomes its own root
+    for i in np.nonzero(tin < 0)[0]:
+        tin[i], order[t], paths[i] = t, i, "/" + names[i]
+        size[i] = 1
+        t += 1
+
+    return FolderTree(ids, names, types, parent, child_offsets, kids, order, tin, size, paths)
+
+
+# Persistence + per-process cache keyed by file mtime
+def folder_tree_path(user_id: str) -> str:
+    return f"user_data/{user_id}/folder_tree.pkl"
+
+def save_folder_tree(tree: FolderTree, user_id: str):
+    path = folder_tree_path(user_id)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+_cache, _cache_lock = {}, threading.Lock()
+
+def load_folder_tree(user_id: str) -> FolderTree | None:
+    path = folder_tree_path(user_id)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _cache_lock:
+        hit = _cache.get(user_id)
+        if hit and hit[0] == mtime:
+            return hit[1]
+    with open(path, "rb") as f:
+        tree = pickle.load(f)
+    with _cache_lock:
+        _cache[user_id] = (mtime, tree)
+    return tree
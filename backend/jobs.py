@@ -0,0 +1,162 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# job knobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TTL_S   = float(os.getenv("JOB_TTL_S", "3600"))   # keep finished jobs around this long
+
+ACTIVE_STATES = {"queued", "running"}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's work function once cancellation was requested."""
+
+
+class Job:
+    """
+    One background run of load_files / index_metadata. The work function
+    reports progress through `progress()` and polls `check_cancelled()`.
+    """
+
+    def __init__(self, kind: str, user_id: str):
+        self.id          = uuid.uuid4().hex
+        self.kind        = kind
+        self.user_id     = user_id
+        self.status      = "queued"
+        self.phase       = "queued"
+        self.done        = 0
+        self.total       = None
+        self.result      = None
+        self.error       = None
+        self.created_at  = time.time()
+        self.finished_at = None
+        self._phase_t0   = time.monotonic()
+        self._cancel     = threading.Event()
+        self._lock       = threading.Lock()
+
+    def progress(self, phase: str | None = None, done: int | None = None,
+                 total: int | None = None, advance: int = 0):
+        with self._lock:
+            if phase is not None and phase != self.phase:
+                self.phase     = phase
+                self.done      = 0
+                self.total     = None
+                self._phase_t0 = time.monotonic()
+            if total is not None:
+                self.total = total
+            if done is not None:
+                self.done = done
+            self.done += advance
+        self.check_cancelled()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = max(time.monotonic() - self._phase_t0, 1e-6)
+            rate    = self.done / elapsed
+            eta     = None
+            if self.status == "running" and self.total and rate > 0:
+                eta = max(self.total - self.done, 0) / rate
+            return {
+                "job_id":           self.id,
+                "kind":             self.kind,
+                "user_id":          self.user_id,
+                "status":           self.status,
+                "phase":            self.phase,
+                "done":             self.done,
+                "total":            self.total,
+                "items_per_s":      round(rate, 2),
+                "eta_s":            round(eta, 1) if eta is not None else None,
+                "cancel_requested": self.cancelled,
+                "result":           self.result,
+                "error":            self.error,
+                "created_at":       self.created_at,
+                "finished_at":      self.finished_at,
+            }
+
+
+class JobRunner:
+    """Background worker pool; one active job per (user, kind)."""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self._pool   = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs   = {}
+        self._active = {}
+        self._lock   = threading.Lock()
+
+    def submit(self, kind: str, user_id: str, fn, *args, **kwargs) -> tuple[Job, bool]:
+        """
+        Queue `fn(*args, job=job, **kwargs)`. `fn` returns (payload, status_code).
+        Returns (job, deduped); deduped is True when an already running job
+        for the same user and kind was handed back instead.
+        """
+        with self._lock:
+            self._prune()
+            running = self._active.get((user_id, kind))
+            if running and running.status in ACTIVE_STATES:
+                return running, True
+            job = Job(kind, user_id)
+            self._jobs[job.id] = job
+            self._active[(user_id, kind)] = job
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job, False
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        job = self._jobs.get(job_id)
+        if job and job.status in ACTIVE_STATES:
+            job.cancel()
+        return job
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job.cancelled:
+            return self._finish(job, "cancelled")
+        job.status = "running"
+        try:
+            job.progress(phase="starting")
+            payload, status = fn(*args, job=job, **kwargs)
+        except JobCancelled:
+            return self._finish(job, "cancelled")
+        except Exception as e:
+            print(f"❌ job {job.kind} for {job.user_id} crashed:", e)
+            job.error = {"error": str(e)}
+            return self._finish(job, "failed")
+        if status == 200:
+            job.result = payload
+            return self._finish(job, "done")
+        job.error = payload
+        self._finish(job, "failed")
+
+    def _finish(self, job: Job, status: str):
+        job.status      = status
+        job.finished_at = time.time()
+        with self._lock:
+            if self._active.get((job.user_id, job.kind)) is job:
+                del self._active[(job.user_id, job.kind)]
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL_S
+        for jid in [j for j, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[jid]
+
+
+# shared runner for the whole process
+jobs = JobRunner()
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# cache knobs
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_PATH    = os.getenv("LLM_CACHE_PATH", "user_data/llm_cache.sqlite")
+LLM_CACHE_TTL_S   = float(os.getenv("LLM_CACHE_TTL_S", str(24 * 3600)))
+LLM_CACHE_MAX_MB  = float(os.getenv("LLM_CACHE_MAX_MB", "64"))
+EVICT_EVERY       = 64       # puts between size checks
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key      TEXT PRIMARY KEY,
+    kind     TEXT NOT NULL,
+    value    TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    created  REAL NOT NULL,
+    accessed REAL NOT NULL,
+    user_id  TEXT
+);
+CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed);
+"""
+
+
+def cache_key(model: str, prompt: str, params: dict, user_id: str | None = None) -> str:
+    key = {"model": model, "prompt": prompt, "params": params}
+    if user_id is not None:
+        key["user"] = user_id
+    blob = json.dumps(key, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done  = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LLMCache:
+    """
+    Content-addressed completion cache in SQLite, keyed by
+    sha256(model, prompt, params). Entries live for `ttl_s`. When the
+    table grows past `max_bytes`, the least recently read rows go first.
+    Identical prompts that arrive while one is in flight wait for it
+    instead of calling the API again. Empty completions (API errors)
+    are not stored. Prompts that carry a user's document text are cached
+    under their `user_id` and dropped by `forget_user`.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_s: float = LLM_CACHE_TTL_S,
+                 max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024)):
+        self.path      = path
+        self.ttl_s     = ttl_s
+        self.max_bytes = max_bytes
+        self.stats     = {}              # (kind, outcome) -> n
+        self._local    = threading.local()
+        self._lock     = threading.Lock()
+        self._flights  = {}
+        self._puts     = 0
+
+    def _db(self) -> sqlite3.Connection:
+        # one connection per thread (and per process after a fork)
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            if "user_id" not in {row[1] for row in db.execute("PRAGMA table_info(llm_cache)")}:
+                try:
+                    # cache files from before per-user rows
+                    db.execute("ALTER TABLE llm_cache ADD COLUMN user_id TEXT")
+                except sqlite3.OperationalError:
+                    pass           # another process added it first
+            db.execute("CREATE INDEX IF NOT EXISTS llm_cache_user ON llm_cache (user_id)")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _count(self, kind: str, outcome: str):
+        with self._lock:
+            self.stats[(kind, outcome)] = self.stats.get((kind, outcome), 0) + 1
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        row = self._db().execute(
+            "SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl_s:
+            self._db().execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+        self._db().execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, kind: str, value: str, user_id: str | None = None):
+        now = time.time()
+        self._db().execute(
+            "INSERT OR REPLACE INTO llm_cache (key, kind, value, size, created, accessed, user_id)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, value, len(value.encode()), now, now, user_id))
+        with self._lock:
+            self._puts += 1
+            check = self._puts % EVICT_EVERY == 0
+        if check:
+            self.evict()
+
+    def forget_user(self, user_id: str):
+        """Drop every completion cached for *user_id*."""
+        try:
+            self._db().execute("DELETE FROM llm_cache WHERE user_id = ?", (user_id,))
+        except sqlite3.Error as e:
+            print("⚠️ LLM cache purge failed:", e)
+
+    def evict(self):
+        db = self._db()
+        db.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl_s,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop least recently read rows until 90% of the budget
+        excess, cutoff = total - int(self.max_bytes * 0.9), None
+        for accessed, size in db.execute("SELECT accessed, size FROM llm_cache ORDER BY accessed"):
+            excess -= size
+            cutoff = accessed
+            if excess <= 0:
+                break
+        if cutoff is not None:
+            db.execute("DELETE FROM llm_cache WHERE accessed <= ?", (cutoff,))
+
+    def get_or_compute(self, kind: str, model: str, prompt: str, params: dict, compute,
+                       user_id: str | None = None) -> str:
+        """
+        Cached completion for the prompt, else `compute()` once across
+        concurrent callers. If the leader's `compute()` raises (a 429 from
+        the scheduler, a cancelled request), its followers start over
+        rather than share the failure. With *user_id* the entry belongs to
+        that user alone.
+        """
+        key = cache_key(model, prompt, params, user_id)
+        while True:
+            try:
+                hit = self.get(key)
+            except sqlite3.Error as e:
+                print("⚠️ LLM cache read failed:", e)
+                hit = None
+            if hit is not None:
+                self._count(kind, "hits")
+                return hit
+
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+            if leader:
+                break
+            flight.done.wait()
+            if flight.error is None:
+                self._count(kind, "coalesced")
+                return flight.value if flight.value is not None else ""
+
+        self._count(kind, "misses")
+        try:
+            flight.value = compute()
+            if flight.value:
+                try:
+                    self.put(key, kind, flight.value, user_id)
+                except sqlite3.Error as e:
+                    print("⚠️ LLM cache write failed:", e)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+# shared cache for the whole process
+llm_cache = LLMCache()
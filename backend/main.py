@@ -1,20 +1,49 @@
 #necessary imports
 from fastapi import FastAPI, Query, Request
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
-import os, requests, urllib.parse, json
+import os, requests, urllib.parse, json, time
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 import shutil
+import contextvars
 from query_handler import (
     build_query_sentence,
-    embed_query_sentence,
+    embed_texts,
+    embedder,
     tokenize_fn,
-    search_topk
+    search_topk,
+    search_topk_batch,
 )
+from concurrent.futures import ThreadPoolExecutor
 from normalizers import normalize_type
+from drive_client import drive
+from credentials import GOOGLE_TOKEN_URL, credentials
+from drive_listing import (
+    ListingError,
+    drive_files_exist,
+    drive_files_paths,
+    list_drive_files_parallel,
+    read_drive_files,
+)
 import faiss, pickle, numpy as np
-from response import generate_final_response
+from response import generate_final_response, prefetcher, speculative_prefetch, warm_related
+from jobs import jobs
+from llm_cache import llm_cache
+from folder_tree import build_folder_tree, folder_tree_path, save_folder_tree
+from content_hash import build_content_groups, save_content_groups
+from prefilter import build_filter_columns, filters_path, save_filter_columns
+from shared_index import INDEX_SERVING, current_generation, publish_index
+from scheduler import Cancelled, Overloaded, scheduler
+from tracing import (
+    end_trace,
+    inc,
+    register_collector,
+    render_prometheus,
+    server_timing,
+    stage,
+    start_trace,
+)
 
 load_dotenv()
 app = FastAPI()
@@ -31,6 +60,12 @@ SCOPE = [
     "email"
 ]
 
+# per-file fields pulled from files.list
+DRIVE_FILE_FIELDS = (
+    "id,name,mimeType,modifiedTime,parents,size,md5Checksum,"
+    "webViewLink,webContentLink,thumbnailLink"
+)
+
 # The login for the app
 @app.get("/auth/login")
 def login():
@@ -45,6 +80,9 @@ def login():
     url = f"https://accounts.google.com/o/oauth2/v2/auth?{urllib.parse.urlencode(params)}"
     return RedirectResponse(url)
 
+# add a Server-Timing header to every /query reply (or per request with "timing": true)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
 # Front-end base URL
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:8501/")
 
@@ -63,7 +101,7 @@ def callback(request: Request):
         return JSONResponse({"error": "No code found"}, status_code=400)
 
     # exchanging code and token
-    token_url = "https://oauth2.googleapis.com/token"
+    token_url = GOOGLE_TOKEN_URL
     data = {
         "code": code,
         "client_id": GOOGLE_CLIENT_ID,
@@ -71,12 +109,10 @@ def callback(request: Request):
         "redirect_uri": GOOGLE_REDIRECT_URI,
         "grant_type": "authorization_code",
     }
-    token_resp = requests.post(token_url, data=data).json()
+    token_resp = requests.post(token_url, data=data, timeout=(5, 20)).json()
     if "error" in token_resp:
         return JSONResponse(token_resp, status_code=400)
 
-    access_token  = token_resp.get("access_token")
-    refresh_token = token_resp.get("refresh_token")
     id_token_jwt  = token_resp.get("id_token")
 
     # verifying ID token, and state persist
@@ -87,16 +123,7 @@ def callback(request: Request):
         user_id    = idinfo["sub"]
         user_email = idinfo.get("email", "unknown")
 
-        os.makedirs(f"user_data/{user_id}", exist_ok=True)
-        with open(f"user_data/{user_id}/tokens.json", "w") as f:
-            json.dump(
-                {
-                    "access_token": access_token,
-                    "refresh_token": refresh_token,
-                    "email": user_email,
-                },
-                f,
-            )
+        credentials.store(user_id, token_resp, user_email)
 
     except ValueError as e:
         return JSONResponse(
@@ -110,64 +137,86 @@ def callback(request: Request):
     return RedirectResponse(url=redirect_url, status_code=302)
     
 
+# Endpoints reply with the payload, or JSONResponse for errors
+def _respond(payload: dict, status: int):
+    return payload if status == 200 else JSONResponse(payload, status_code=status)
+
 #Loading the necessary files, we skip if we already have the files
 @app.get("/drive/load_files")
-def load_drive_files(user_id: str, force: bool = Query(False, description="Reload even if metadata exists")):
+def load_drive_files(user_id: str, force: bool = Query(False, description="Reload even if metadata exists"),
+                     parallel: bool = Query(False, description="List partitions concurrently (large drives)")):
     """
     Step 1 of indexing: pull Drive file list and cache it.
     If `force=false` and drive_files.json already exists ⇒ skip.
+    With `parallel=true` the listing is split by mimeType / modifiedTime,
+    fetched concurrently and streamed to drive_files.ndjson.
     """
-    meta_path = f"user_data/{user_id}/drive_files.json"
+    return _respond(*_load_drive_files(user_id, force, parallel))
+
+def _load_drive_files(user_id: str, force: bool, parallel: bool, job=None):
+    meta_path, ndjson_path = drive_files_paths(user_id)
 
     # fast-exit
-    if os.path.exists(meta_path) and not force:
-        return {"message": "Metadata already exists – skipping. Force it to reload if you changed your files"}
+    if drive_files_exist(user_id) and not force:
+        return {"message": "Metadata already exists – skipping. Force it to reload if you changed your files"}, 200
 
     if force:
         clear_downloads(user_id)  # 🔥 Clear downloaded files on force reload
 
     # checking for tokens and access
-    tok_path = f"user_data/{user_id}/tokens.json"
-    if not os.path.exists(tok_path):
-        return JSONResponse({"error": "User not authenticated."}, status_code=401)
-    access_token = json.load(open(tok_path))["access_token"]
-    headers = {"Authorization": f"Bearer {access_token}"}
+    access_token = credentials.get_access_token(user_id)
+    if not access_token:
+        return {"error": "User not authenticated."}, 401
+
+    if job:
+        job.progress(phase="listing files")
+    on_page = (lambda n: job.progress(advance=n)) if job else None
+
+    if parallel:
+        try:
+            with stage("load.list_files"):
+                n = list_drive_files_parallel(user_id, access_token, DRIVE_FILE_FIELDS, on_page=on_page)
+        except ListingError as e:
+            return {"error": str(e)}, 400
+        except requests.RequestException as e:
+            return {"error": f"Drive unreachable: {e}"}, 502
+        return {"message": f"Saved metadata for {n} files."}, 200
 
     # pull all the files
     files, page_token = [], None
     while True:
-        r = requests.get(
-            "https://www.googleapis.com/drive/v3/files",
-            headers=headers,
-            params={
-                "pageSize": 1000,
-                "fields": (
-                "nextPageToken,"
-                "files("
-                    "id,name,mimeType,modifiedTime,parents,"
-                    "webViewLink,webContentLink,thumbnailLink"
-                ")"
-            ),
-                "pageToken": page_token,
-            },
-        )
+        try:
+            with stage("load.list_page"):
+                r = drive.get("/files", access_token, user_id=user_id, params={
+                    "pageSize": 1000,
+                    "fields": f"nextPageToken,files({DRIVE_FILE_FIELDS})",
+                    "pageToken": page_token,
+                })
+        except requests.RequestException as e:
+            return {"error": f"Drive unreachable: {e}"}, 502
         if r.status_code != 200:
-            return JSONResponse({"error": r.text}, status_code=400)
+            return {"error": r.text}, 400
         payload = r.json()
         files.extend(payload.get("files", []))
+        if on_page:
+            on_page(len(payload.get("files", [])))
         page_token = payload.get("nextPageToken")
         if not page_token:
             break
 
     os.makedirs(f"user_data/{user_id}", exist_ok=True)
     json.dump(files, open(meta_path, "w"), indent=2)
-    return {"message": f"Saved metadata for {len(files)} files."}
+    if os.path.exists(ndjson_path):
+        os.remove(ndjson_path)
+    return {"message": f"Saved metadata for {len(files)} files."}, 200
 
 def clear_downloads(user_id: str):
     downloads_path = os.path.join("user_data", user_id, "downloads")
     if os.path.exists(downloads_path):
         shutil.rmtree(downloads_path)
         print(f"🧹 Cleared old downloads for {user_id}")
+    prefetcher.forget_user(user_id)
+    llm_cache.forget_user(user_id)          # answers quote the user's documents
     os.makedirs(downloads_path, exist_ok=True)
     
 def clear_user_cache(user_id: str):
@@ -175,10 +224,24 @@ def clear_user_cache(user_id: str):
     if os.path.exists(user_dir):
         shutil.rmtree(user_dir)
         print(f"🧹 Cleared download cache for {user_id}")
+    llm_cache.forget_user(user_id)
     
 #indexing the metadata into vector + inverted
 @app.get("/drive/index_metadata")
 def index_metadata(user_id: str, force: bool = Query(False, description="Rebuild even if index exists")):
+    return _respond(*_index_metadata(user_id, force))
+
+# rows per embedding call while indexing, also the progress / cancel granularity
+INDEX_EMBED_BATCH = 1024
+
+def index_ready(user_id: str) -> bool:
+    base = f"user_data/{user_id}"
+    paths = (f"{base}/metadata.index", f"{base}/embeddings.npy", f"{base}/metadata_mapping.pkl",
+             f"{base}/inverted_index.pkl", folder_tree_path(user_id), filters_path(user_id))
+    published = INDEX_SERVING != "shared" or current_generation(user_id) > 0
+    return published and all(os.path.exists(p) for p in paths)
+
+def _index_metadata(user_id: str, force: bool, job=None):
     base = f"user_data/{user_id}"
     idx_path = f"{base}/metadata.index"
     emb_path = f"{base}/embeddings.npy"
@@ -186,16 +249,17 @@ def index_metadata(user_id: str, force: bool = Query(False, description="Rebuild
     inv_path = f"{base}/inverted_index.pkl"
 
     # fast exit
-    if not force and all(os.path.exists(p) for p in (idx_path, emb_path, map_path, inv_path)):
-        return {"message": "✅ Index already exists – skipping. Force it to reload if you changed your files"}
+    if not force and index_ready(user_id):
+        return {"message": "✅ Index already exists – skipping. Force it to reload if you changed your files"}, 200
 
     # Load the metadata
-    metadata_path = f"{base}/drive_files.json"
-    if not os.path.exists(metadata_path):
-        return JSONResponse({"error": "No metadata found. Run /drive/load_files first."}, status_code=400)
+    if not drive_files_exist(user_id):
+        return {"error": "No metadata found. Run /drive/load_files first."}, 400
 
-    with open(metadata_path, "r") as f:
-        drive_files = json.load(f)
+    if job:
+        job.progress(phase="reading metadata")
+    with stage("index.read_metadata"):
+        drive_files = read_drive_files(user_id)
 
     # building the mapping and canonical templates
     mapping, templates = [], []
@@ -214,32 +278,115 @@ def index_metadata(user_id: str, force: bool = Query(False, description="Rebuild
          })
         templates.append(build_query_sentence(name, ftype, date, list(tokens)))
 
-    # embeddin all templates
-    embs = np.stack([embed_query_sentence(t) for t in templates])
+    # embeddin all templates, in slices so jobs can report progress / cancel
+    if job:
+        job.progress(phase="embedding", total=len(templates))
+    parts = []
+    with stage("index.embed"):
+        for i in range(0, len(templates), INDEX_EMBED_BATCH):
+            batch = templates[i : i + INDEX_EMBED_BATCH]
+            parts.append(embed_texts(batch))
+            if job:
+                job.progress(advance=len(batch))
+        embs = np.concatenate(parts)
+
+    if job:
+        job.progress(phase="writing index")
 
     # saving FAISS index
     os.makedirs(base, exist_ok=True)
-    idx = faiss.IndexFlatL2(embs.shape[1])
-    idx.add(embs)
-    faiss.write_index(idx, idx_path)
+    with stage("index.faiss_build"):
+        idx = faiss.IndexFlatL2(embs.shape[1])
+        idx.add(embs)
+        faiss.write_index(idx, idx_path)
 
     # persisisting artefacts
-    np.save(emb_path, embs)
-    with open(map_path, "wb") as f:
-        pickle.dump(mapping, f)
-
-    inverted = {}
-    for i, rec in enumerate(mapping):
-        for tok in tokenize_fn(rec["name"] or ""):
-            inverted.setdefault(tok, []).append(i)
-    with open(inv_path, "wb") as f:
-        pickle.dump(inverted, f)
-
-    return {"message": f"Indexed {len(mapping)} files: built vector & inverted index."}
+    with stage("index.persist"):
+        np.save(emb_path, embs)
+        with open(map_path, "wb") as f:
+            pickle.dump(mapping, f)
+
+        inverted = {}
+        for i, rec in enumerate(mapping):
+            for tok in tokenize_fn(rec["name"] or ""):
+                inverted.setdefault(tok, []).append(i)
+        with open(inv_path, "wb") as f:
+            pickle.dump(inverted, f)
+
+    # folder tree from `parents`, serves folder listings without API calls
+    with stage("index.folder_tree"):
+        tree = build_folder_tree(mapping)
+        save_folder_tree(tree, user_id)
+
+    # columnar type / mtime / parent arrays for query prefilter masks
+    with stage("index.filters"):
+        filter_cols = build_filter_columns(mapping, tree)
+        save_filter_columns(filter_cols, user_id)
+
+    # content key -> every copy, collapses clones in answers
+    with stage("index.content_groups"):
+        groups = build_content_groups(mapping)
+        save_content_groups(groups, user_id)
+
+    # one mmapped copy for all workers, they pick up the new generation on next query
+    if INDEX_SERVING == "shared":
+        with stage("index.publish_shared"):
+            publish_index(user_id, embs, mapping, inverted, filter_cols)
+
+    dupes = sum(len(v) - 1 for v in groups.values())
+    return {"message": f"Indexed {len(mapping)} files: built vector & inverted index "
+                       f"({dupes} duplicate copies across {len(groups)} contents)."}, 200
+
+# cheap, idempotent: lets the UI skip steps that are already done
+@app.get("/drive/status")
+def drive_status(user_id: str):
+    return {"metadata": drive_files_exist(user_id), "indexed": index_ready(user_id)}
+
+# Background jobs: submit returns a job id, the UI polls /jobs/{id}
+@app.post("/jobs/load_files")
+def submit_load_files(user_id: str, force: bool = Query(False), parallel: bool = Query(False)):
+    job, deduped = jobs.submit("load_files", user_id, _load_drive_files, user_id, force, parallel)
+    return {**job.snapshot(), "deduped": deduped}
+
+@app.post("/jobs/index_metadata")
+def submit_index_metadata(user_id: str, force: bool = Query(False)):
+    job, deduped = jobs.submit("index_metadata", user_id, _index_metadata, user_id, force)
+    return {**job.snapshot(), "deduped": deduped}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        return JSONResponse({"error": "Unknown job."}, status_code=404)
+    return job.snapshot()
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if not job:
+        return JSONResponse({"error": "Unknown job."}, status_code=404)
+    return job.snapshot()
 
 #Handle the query
 @app.post("/query")
-async def query_endpoint(payload: dict):
+def query_endpoint(payload: dict):
+    token = start_trace()
+    try:
+        with stage("query.total"):
+            resp = _answer_query(payload)
+    finally:
+        trace = end_trace(token)
+
+    status = resp.status_code if isinstance(resp, JSONResponse) else 200
+    inc("queries_total", status=status)
+    if not (SERVER_TIMING or payload.get("timing")) or not trace:
+        return resp
+    if not isinstance(resp, JSONResponse):
+        resp = JSONResponse(resp)
+    resp.headers["Server-Timing"] = server_timing(trace)
+    return resp
+
+def _answer_query(payload: dict):
     user_id  = payload.get("user_id")
     qtxt     = payload.get("query")
     history  = payload.get("history", [])
@@ -247,16 +394,116 @@ async def query_endpoint(payload: dict):
     if not user_id or not qtxt:
         return JSONResponse({"error":"user_id and query required"}, status_code=400)
 
-    # search
-    results = search_topk(user_id, qtxt, top_k=5)
-
-    tok_path = f"user_data/{user_id}/tokens.json"
-    if not os.path.exists(tok_path):
+    access_token = credentials.get_access_token(user_id)
+    if not access_token:
         return JSONResponse({"error":"User not authenticated."}, status_code=401)
-    access_token = json.load(open(tok_path))["access_token"]
-    
-    # Final response generation
-    return generate_final_response(qtxt, user_id, results, access_token, history)
+
+    # stages below queue fairly per user; a newer query from the same user cancels this one
+    sched = scheduler.begin(user_id)
+    try:
+        # start fetching likely hits while the LLM parses the query (same slots as inline fetches)
+        speculative_prefetch(user_id, qtxt, access_token)
+
+        # search
+        results = search_topk(user_id, qtxt, top_k=5)
+
+        # Final response generation
+        resp = generate_final_response(qtxt, user_id, results, access_token, history)
+        warm_related(user_id, resp["sources"], access_token)
+    except Overloaded as e:
+        return JSONResponse({"error": f"Busy ({e.stage} queue full), try again shortly."},
+                            status_code=429, headers={"Retry-After": "1"})
+    except Cancelled:
+        return JSONResponse({"error": "Superseded by a newer query."}, status_code=409)
+    finally:
+        scheduler.end(sched)
+    return resp
+
+# Bulk queries (evaluation sets, "find files matching X" jobs)
+BATCH_MAX_QUERIES    = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+BATCH_ANSWER_WORKERS = int(os.getenv("BATCH_ANSWER_WORKERS", "4"))
+BATCH_MAX_TOP_K      = int(os.getenv("BATCH_MAX_TOP_K", "100"))
+BATCH_HIT_FIELDS     = ("id", "name", "type", "date", "link", "_distance")
+
+@app.post("/query/batch")
+def query_batch(payload: dict):
+    """
+    {"user_id", "queries": [...], "top_k": 5, "answer": false}
+    Ranked hits per query; with answer=true each query also gets the
+    usual answer + sources. Reports throughput for the whole batch.
+    """
+    user_id = payload.get("user_id")
+    queries = payload.get("queries") or []
+    top_k   = payload.get("top_k", 5)
+    answer  = bool(payload.get("answer", False))
+
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= BATCH_MAX_TOP_K:
+        return JSONResponse({"error": f"top_k must be an integer from 1 to {BATCH_MAX_TOP_K}."}, status_code=400)
+    if not user_id or not isinstance(queries, list) or not all(isinstance(q, str) and q for q in queries):
+        return JSONResponse({"error": "user_id and a list of non-empty queries required"}, status_code=400)
+    if len(queries) > BATCH_MAX_QUERIES:
+        return JSONResponse({"error": f"At most {BATCH_MAX_QUERIES} queries per batch."}, status_code=400)
+
+    access_token = None
+    if answer:
+        access_token = credentials.get_access_token(user_id)
+        if not access_token:
+            return JSONResponse({"error": "User not authenticated."}, status_code=401)
+
+    t0 = time.perf_counter()
+    # queued like /query, but a batch is not superseded by the user's next query
+    sched = scheduler.begin(user_id, supersede=False)
+    try:
+        hits = search_topk_batch(user_id, queries, top_k=top_k) if queries else []
+        search_s = time.perf_counter() - t0
+
+        results = [{"query": q, "hits": [{k: h[k] for k in BATCH_HIT_FIELDS if k in h} for h in hs]}
+                   for q, hs in zip(queries, hits)]
+        if answer:
+            def one(i):
+                return generate_final_response(queries[i], user_id, hits[i], access_token)
+            with ThreadPoolExecutor(max_workers=BATCH_ANSWER_WORKERS) as ex:
+                # each worker runs under this request's ticket
+                futs = [ex.submit(contextvars.copy_context().run, one, i) for i in range(len(queries))]
+                try:
+                    for r, fut in zip(results, futs):
+                        resp = fut.result()
+                        r["answer"], r["sources"] = resp["answer"], resp["sources"]
+                except BaseException:
+                    # one answer was turned away: don't start the rest
+                    for fut in futs:
+                        fut.cancel()
+                    raise
+    except Overloaded as e:
+        return JSONResponse({"error": f"Busy ({e.stage} queue full), try again shortly."},
+                            status_code=429, headers={"Retry-After": "1"})
+    finally:
+        scheduler.end(sched)
+
+    elapsed = time.perf_counter() - t0
+    inc("batch_queries_total", len(queries))
+    return {
+        "results":        results,
+        "count":          len(queries),
+        "search_s":       round(search_s, 4),
+        "elapsed_s":      round(elapsed, 4),
+        "queries_per_s":  round(len(queries) / elapsed, 2) if elapsed else None,
+    }
+
+# Prometheus scrape endpoint
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+register_collector(lambda: {(f"drive_{k}_total", ()): v for k, v in drive.stats.items()})
+register_collector(lambda: {(f"embedding_{k}_total", ()): v for k, v in embedder.stats.items()})
+register_collector(lambda: {(f"credential_{k}_total", ()): v for k, v in credentials.stats.items()})
+register_collector(lambda: {(f"prefetch_{k}_total", ()): v for k, v in prefetcher.stats.items()})
+register_collector(lambda: {(f"llm_cache_{o}_total", (("kind", k),)): v for (k, o), v in llm_cache.stats.items()})
+register_collector(scheduler.snapshot)
+
+# a 401 from Drive triggers one single-flight token refresh, then a retry
+drive.on_unauthorized = credentials.force_refresh
 
 #-------------------------------------TESTING-------------------------------------------
 # def test_embed_sentences(user_id: str, num_samples: int = 5):
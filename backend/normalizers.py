@@ -1,3 +1,6 @@
+import re
+from datetime import datetime, timedelta, timezone
+
 TYPE_CANONICAL_MAP = {
     # Google Docs equivalents
     "word": "google_doc",
@@ -39,6 +42,51 @@ TYPE_CANONICAL_MAP = {
     "folder": "folder"
 }
 
+# canonical query type -> file types stored by normalize_type
+TYPE_FAMILIES = {
+    "google_doc":   {"google_doc", "docx", "text"},
+    "spreadsheet":  {"google_sheet", "xlsx", "csv"},
+    "presentation": {"google_slide", "pptx"},
+}
+
+def type_family(canonical: str) -> set[str]:
+    return TYPE_FAMILIES.get(canonical, {canonical})
+
+MONTHS = {m: i + 1 for i, m in enumerate(
+    ["january", "february", "march", "april", "may", "june", "july",
+     "august", "september", "october", "november", "december"])}
+
+def parse_date_range(text: str) -> tuple[int, int] | None:
+    """
+    Turn an extracted date ("2023", "March 2024", "2024-03", "2024-03-15")
+    into a [start, end) range of UTC epoch seconds. None if unparseable.
+    """
+    if not text:
+        return None
+    t = str(text).strip().lower()
+    year  = re.search(r"\b(19|20)\d{2}\b", t)
+    if not year:
+        return None
+    y = int(year.group(0))
+    if m := re.search(r"\b(19|20)\d{2}-(\d{1,2})(?:-(\d{1,2}))?\b", t):
+        month, day = int(m.group(2)), int(m.group(3)) if m.group(3) else None
+    else:
+        month = next((n for name, n in MONTHS.items() if re.search(rf"\b({name}|{name[:3]})\b", t)), None)
+        day = None
+    try:
+        if day:
+            start = datetime(y, month, day, tzinfo=timezone.utc)
+            end   = start + timedelta(days=1)
+        elif month:
+            start = datetime(y, month, 1, tzinfo=timezone.utc)
+            end   = datetime(y + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        else:
+            start = datetime(y, 1, 1, tzinfo=timezone.utc)
+            end   = datetime(y + 1, 1, 1, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return int(start.timestamp()), int(end.timestamp())
+
 def normalize_extracted_type(user_type: str) -> str:
     if not user_type:
         return None
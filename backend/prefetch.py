@@ -0,0 +1,159 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from content_hash import doc_content_key
+from scheduler import scheduler
+
+load_dotenv()
+
+# prefetch knobs
+PREFETCH_ENABLED   = os.getenv("PREFETCH", "1") == "1"
+PREFETCH_WORKERS   = int(os.getenv("PREFETCH_WORKERS", "4"))
+PREFETCH_PER_USER  = int(os.getenv("PREFETCH_PER_USER", "4"))     # in-flight prefetches per user
+PREFETCH_CACHE_MB  = float(os.getenv("PREFETCH_CACHE_MB", "64"))   # extracted text kept in memory
+
+
+class Prefetcher:
+    """
+    Extracted-text cache in front of download + extract, plus background
+    warming.
+
+    `fetch_fn(doc, user_id, token, prefix)` returns the text or None.
+    Entries are keyed by (user, file id, modifiedTime), so an edited file
+    misses; files with an md5 are keyed by content, so copies share one
+    fetch. `prefetch` starts fetches in the background, capped per user.
+    `get` serves the answer path: a cached text, a join on the in-flight
+    fetch, or an inline fetch. Background fetches run under the scheduler
+    ticket of the request that started them, so they queue for download
+    and extract slots like inline ones.
+
+    Counters:
+      issued   prefetches started
+      hits     requests served by a finished prefetch
+      joined   requests that waited on a running prefetch
+      misses   requests fetched inline
+      reused   requests served by an earlier request's fetch
+      wasted   prefetched texts evicted without being used
+      skipped  prefetches dropped by the per-user budget
+    """
+
+    def __init__(self, fetch_fn, workers: int = PREFETCH_WORKERS, per_user: int = PREFETCH_PER_USER,
+                 cache_bytes: int = int(PREFETCH_CACHE_MB * 1024 * 1024)):
+        self.fetch_fn    = fetch_fn
+        self.per_user    = per_user
+        self.cache_bytes = cache_bytes
+        self.stats       = {"issued": 0, "hits": 0, "joined": 0, "misses": 0,
+                            "reused": 0, "wasted": 0, "skipped": 0}
+        self._pool       = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock       = threading.Lock()
+        self._cache      = OrderedDict()     # key -> text
+        self._size       = 0
+        self._unused     = set()             # prefetched, not read yet
+        self._inflight   = {}                # key -> Future
+        self._active     = {}                # user_id -> running prefetches
+
+    @staticmethod
+    def key(user_id: str, doc: dict) -> tuple:
+        if content := doc_content_key(doc):
+            return user_id, content
+        return user_id, doc["id"], doc.get("raw", {}).get("modifiedTime") or doc.get("date")
+
+    # cache
+    def _put(self, key, text: str, prefetched: bool):
+        if key in self._cache:
+            return
+        self._cache[key] = text
+        self._size += len(text)
+        if prefetched:
+            self._unused.add(key)
+        while self._size > self.cache_bytes and len(self._cache) > 1:
+            old, val = self._cache.popitem(last=False)
+            self._size -= len(val)
+            if old in self._unused:
+                self._unused.discard(old)
+                self.stats["wasted"] += 1
+
+    # background side
+    def prefetch(self, user_id: str, docs: list[dict], token: str) -> int:
+        """Start fetching *docs* that are neither cached nor running; returns how many started."""
+        if not PREFETCH_ENABLED:
+            return 0
+        started, ticket = 0, scheduler.current()
+        for doc in docs:
+            key = self.key(user_id, doc)
+            with self._lock:
+                if key in self._cache or key in self._inflight:
+                    continue
+                if self._active.get(user_id, 0) >= self.per_user:
+                    self.stats["skipped"] += 1
+                    continue
+                self._active[user_id] = self._active.get(user_id, 0) + 1
+                self.stats["issued"] += 1
+                fut = self._pool.submit(self._run, key, doc, user_id, token, ticket)
+                self._inflight[key] = fut
+            started += 1
+        return started
+
+    def _run(self, key, doc, user_id, token, ticket):
+        try:
+            with scheduler.bind(ticket):
+                text = self.fetch_fn(doc, user_id, token, "prefetch")
+        except Exception as e:
+            print(f"⚠️ prefetch of {doc.get('name')} failed:", e)
+            text = None
+        finally:
+            with self._lock:
+                self._active[user_id] -= 1
+        with self._lock:
+            self._inflight.pop(key, None)
+            if text:
+                self._put(key, text, prefetched=True)
+        return text
+
+    def speculate(self, user_id: str, find_fn, token: str):
+        """Run a cheap candidate search in the background and prefetch what it names."""
+        if PREFETCH_ENABLED:
+            self._pool.submit(self._speculate, user_id, find_fn, token, scheduler.current())
+
+    def _speculate(self, user_id, find_fn, token, ticket):
+        with scheduler.bind(ticket):
+            self.prefetch(user_id, find_fn(), token)
+
+    # answer side
+    def get(self, user_id: str, doc: dict, token: str) -> str | None:
+        key = self.key(user_id, doc)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                if key in self._unused:
+                    self._unused.discard(key)
+                    self.stats["hits"] += 1
+                else:
+                    self.stats["reused"] += 1
+                return self._cache[key]
+            fut = self._inflight.get(key)
+
+        if fut is not None:
+            text = fut.result()
+            with self._lock:
+                self._unused.discard(key)
+                self.stats["joined"] += 1
+            if text is not None:
+                return text
+
+        with self._lock:
+            self.stats["misses"] += 1
+        text = self.fetch_fn(doc, user_id, token, "query")
+        if text:
+            with self._lock:
+                self._put(key, text, prefetched=False)
+        return text
+
+    def forget_user(self, user_id: str):
+        with self._lock:
+            for key in [k for k in self._cache if k[0] == user_id]:
+                self._size -= len(self._cache.pop(key))
+                self._unused.discard(key)
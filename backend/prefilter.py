@@ -0,0 +1,108 @@
+import os
+import threading
+import numpy as np
+from normalizers import parse_date_range, type_family
+from shared_index import INDEX_SERVING, get_shared_index
+
+# Columnar filter data stored next to the index, one row per mapping entry:
+#   types  uint8   code into `vocab` (normalize_type values)
+#   mtime  int64   modifiedTime as UTC epoch seconds (NaT → int64 min)
+#   parent int32   folder-tree parent row, -1 for roots
+
+
+def filters_path(user_id: str) -> str:
+    return f"user_data/{user_id}/filters.npz"
+
+def build_filter_columns(mapping: list[dict], tree) -> dict:
+    vocab = sorted({rec["type"] or "" for rec in mapping})
+    code  = {t: i for i, t in enumerate(vocab)}
+    stamps = [(rec["raw"].get("modifiedTime") or "")[:19] or "NaT" for rec in mapping]
+    return {
+        "vocab":  np.array(vocab, dtype=str),
+        "types":  np.array([code[rec["type"] or ""] for rec in mapping], dtype=np.uint8 if len(vocab) < 256 else np.uint16),
+        "mtime":  np.array(stamps, dtype="datetime64[s]").astype(np.int64),
+        "parent": tree.parent.astype(np.int32),
+    }
+
+def save_filter_columns(cols: dict, user_id: str):
+    path = filters_path(user_id)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **cols)
+    os.replace(path + ".tmp", path)
+
+_cache, _cache_lock = {}, threading.Lock()
+
+def load_filter_columns(user_id: str) -> dict | None:
+    if INDEX_SERVING == "shared":
+        # same generation as the vector index, so row numbers line up
+        index = get_shared_index(user_id)
+        return index.filters if index else None
+    path = filters_path(user_id)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _cache_lock:
+        hit = _cache.get(user_id)
+        if hit and hit[0] == mtime:
+            return hit[1]
+    with np.load(path) as z:
+        cols = {k: z[k] for k in z.files}
+    cols["vocab"] = [str(v) for v in cols["vocab"]]
+    with _cache_lock:
+        _cache[user_id] = (mtime, cols)
+    return cols
+
+
+# Query filters → bitmask
+def _type_mask(cols, ftype):
+    wanted = [i for i, t in enumerate(cols["vocab"]) if t in type_family(ftype)]
+    return np.isin(cols["types"], wanted)
+
+def _date_mask(cols, date):
+    rng = parse_date_range(date)
+    if not rng:
+        return None
+    return (cols["mtime"] >= rng[0]) & (cols["mtime"] < rng[1])
+
+def _folder_mask(tree, folder):
+    nodes = tree.find_folders(folder)
+    if not nodes:
+        key = folder.strip().lower()
+        nodes = [i for i, (n, t) in enumerate(zip(tree.names, tree.types))
+                 if t == "folder" and key in (n or "").lower()]
+    if not nodes:
+        return None
+    mask = np.zeros(len(tree), dtype=bool)
+    for i in nodes:
+        mask[i] = True             # keep the folder itself, "show folder X" still finds it
+        mask[tree.subtree(i)] = True
+    return mask
+
+def build_mask(cols, tree, ftype=None, date=None, folder=None) -> np.ndarray | None:
+    """
+    AND together the type / date / folder filters that were extracted.
+    A filter that would leave nothing is dropped (the LLM guessed wrong);
+    returns None when no filter narrows the search.
+    """
+    if cols is None:
+        return None
+    parts = []
+    if ftype:
+        parts.append(_type_mask(cols, ftype))
+    # date / folder come straight from the LLM's JSON: anything but a string is ignored
+    if date and isinstance(date, str):
+        parts.append(_date_mask(cols, date))
+    if folder and isinstance(folder, str) and tree is not None and len(tree) == len(cols["types"]):
+        parts.append(_folder_mask(tree, folder))
+
+    mask = None
+    for m in parts:
+        if m is None:
+            continue
+        nxt = m if mask is None else mask & m
+        if nxt.any():
+            mask = nxt
+    if mask is None or mask.all():
+        return None
+    return mask
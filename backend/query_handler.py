@@ -1,34 +1,63 @@
 import os
 import json
 import re
+import contextvars
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
 from openai import OpenAI
-from search_metadata import search_similar_metadata
+from search_metadata import search_similar_metadata, search_similar_metadata_batch
 from normalizers import normalize_extracted_type
+from embedding_service import EmbeddingBatcher
+from llm_cache import LLM_CACHE_ENABLED, llm_cache
+from scheduler import scheduler
+from tracing import stage
+from prefilter import build_mask, load_filter_columns
+from folder_tree import load_folder_tree
 
 load_dotenv()
 
 # OpenAI setup
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+LLM_MODEL = "gpt-4o-mini"
+
+# batch parsing: queries per LLM prompt, prompts in flight at once
+BATCH_PARSE_GROUP       = int(os.getenv("BATCH_PARSE_GROUP", "16"))
+BATCH_LLM_CONCURRENCY   = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
 
 # embedding model
 embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
 
+# shared batcher, coalesces encode calls from concurrent requests
+embedder = EmbeddingBatcher(embedding_model)
+
 #query skeleton established
-def query_openai(prompt: str, max_tokens: int = 150) -> str:
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=max_tokens,
-            temperature=0.2,
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception as e:
-        print("OpenAI error:", e)
-        return ""
+def query_openai(prompt: str, max_tokens: int = 150, kind: str = "other", user_id: str | None = None) -> str:
+    """
+    `kind` labels the prompt (metadata, keywords, answer, ...) in cache metrics.
+    Pass `user_id` when the prompt holds that user's documents: the cached
+    completion is then theirs only and cleared with their data.
+    """
+    params = {"max_tokens": max_tokens, "temperature": 0.2}
+
+    def call():
+        # cache hits and coalesced callers never take an llm slot
+        with scheduler.slot("llm"):
+            try:
+                resp = client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    **params,
+                )
+                return resp.choices[0].message.content.strip()
+            except Exception as e:
+                print("OpenAI error:", e)
+                return ""
+
+    if not LLM_CACHE_ENABLED:
+        return call()
+    return llm_cache.get_or_compute(kind, LLM_MODEL, prompt, params, call, user_id=user_id)
 
 #query classification for later prompting, defunct logic
 # def classify_query(query: str) -> str:
@@ -55,13 +84,14 @@ def extract_metadata(query: str) -> dict:
     - File or folder name (if any)
     - File type (like PDF, pptx (from presentation), spreadsheet (xlsx), image)
     - Date or time reference (month, year, etc.)
+    - Folder the files should be inside (only if the query names one)
 
-    Respond in JSON format with keys: name, type, date.
+    Respond in JSON format with keys: name, type, date, folder.
     Use null if a value is not found.
 
     Query: "{query}"
     """
-    res = query_openai(prompt, max_tokens=100)
+    res = query_openai(prompt, max_tokens=100, kind="metadata")
     # print("🧪 Metadata Response:", res)
     matches = re.findall(r'\{[^{}]+\}', res)
     for match in reversed(matches):
@@ -69,7 +99,7 @@ def extract_metadata(query: str) -> dict:
             return json.loads(match)
         except json.JSONDecodeError:
             continue
-    return {"name": None, "type": None, "date": None}
+    return {"name": None, "type": None, "date": None, "folder": None}
 
 #extracting relavant keywords
 def extract_words(query: str) -> list[str]:
@@ -85,7 +115,7 @@ def extract_words(query: str) -> list[str]:
 
     Respond in this format: ["", "", ""]
     """
-    res = query_openai(prompt, max_tokens=100)
+    res = query_openai(prompt, max_tokens=100, kind="keywords")
     # print("🧪 Keywords Response:", res)
     matches = re.findall(r'\[[^\[\]]+\]', res)
     for match in matches:
@@ -97,6 +127,47 @@ def extract_words(query: str) -> list[str]:
             continue
     return []
 
+#metadata + keywords for many queries in one prompt
+def _parse_group(queries: list[str]) -> list[tuple[dict, list[str]]]:
+    numbered = "\n".join(f'{i + 1}. "{q}"' for i, q in enumerate(queries))
+    prompt = f"""
+    For each numbered user query below extract:
+    - name: file or folder name (if any)
+    - type: file type (like PDF, pptx (from presentation), spreadsheet (xlsx), image)
+    - date: date or time reference (month, year, etc.)
+    - folder: folder the files should be inside (only if the query names one)
+    - keywords: the most meaningful keywords for document retrieval; keep quoted text,
+      file / folder / project names and capitalized words; no stopwords, generic terms
+      (like "file", "folder", "document"), months or years.
+
+    Respond with only a JSON array holding one object per query, in order, with keys
+    name, type, date, folder, keywords. Use null if a value is not found.
+
+    Queries:
+    {numbered}
+    """
+    res = query_openai(prompt, max_tokens=80 * len(queries), kind="batch_parse")
+    m = re.search(r"\[.*\]", res, re.S)
+    try:
+        parsed = json.loads(m.group(0)) if m else None
+    except json.JSONDecodeError:
+        parsed = None
+    if not isinstance(parsed, list) or len(parsed) != len(queries) or not all(isinstance(p, dict) for p in parsed):
+        # the model lost count: per-query prompts for this group
+        return [(extract_metadata(q), extract_words(q)) for q in queries]
+    out = []
+    for p in parsed:
+        kws = p.pop("keywords", None) or []
+        out.append((p, [k.strip() for k in kws if isinstance(k, str)]))
+    return out
+
+def parse_queries_batch(queries: list[str]) -> list[tuple[dict, list[str]]]:
+    groups = [queries[i : i + BATCH_PARSE_GROUP] for i in range(0, len(queries), BATCH_PARSE_GROUP)]
+    with ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY) as ex:
+        # the caller's scheduler ticket follows each prompt into the pool
+        futs = [ex.submit(contextvars.copy_context().run, _parse_group, g) for g in groups]
+        return [r for fut in futs for r in fut.result()]
+
 #tokenizing file names
 def tokenize_fn(fn: str) -> set[str]:
     base = fn.rsplit('.', 1)[0]
@@ -120,9 +191,20 @@ def build_query_sentence(name, ftype, date, words):
 #embedding the query sentence
 def embed_query_sentence(sentence: str) -> np.ndarray:
     # print(f'SENTENCE BEFORE EMBEDDING: {sentence}')
-    emb = embedding_model.encode(sentence)
-    return np.array(emb, dtype="float32")
+    with scheduler.slot("embed"):
+        return embedder.encode([sentence])[0]
+
+#embedding many texts at once, rows line up with *texts*
+def embed_texts(texts: list[str]) -> np.ndarray:
+    with scheduler.slot("embed"):
+        return embedder.encode(texts)
+
 
+# Cheap first pass for prefetching: no LLM, just the query's filename-style tokens
+def first_pass_search(user_id: str, query: str, top_k: int = 3):
+    words = sorted(tokenize_fn(query))
+    q_emb = embed_query_sentence(build_query_sentence(None, None, None, words))
+    return search_similar_metadata(user_id, q_emb, words, top_k, threshold=0.5)
 
 # Main vector search function
 def search_topk(user_id: str, query: str, top_k: int = 5):
@@ -131,17 +213,45 @@ def search_topk(user_id: str, query: str, top_k: int = 5):
     vector-search, return top-k metadata records.
     """
     # LLM extracts metadata & keywords
-    meta      = extract_metadata(query)
-    keywords  = extract_words(query)
+    with stage("query.extract_metadata"):
+        meta      = extract_metadata(query)
+    with stage("query.extract_words"):
+        keywords  = extract_words(query)
 
     # Build canonical sentence & embed
-    sentence  = build_query_sentence(
-        meta.get("name"), normalize_extracted_type(meta.get("type")),
-        meta.get("date"), keywords)
-    q_emb     = embed_query_sentence(sentence)
+    ftype     = normalize_extracted_type(meta.get("type"))
+    sentence  = build_query_sentence(meta.get("name"), ftype, meta.get("date"), keywords)
+    with stage("query.embed"):
+        q_emb     = embed_query_sentence(sentence)
+
+    # Type / date / folder filters → bitmask over index rows
+    with stage("query.prefilter"):
+        mask = build_mask(load_filter_columns(user_id), load_folder_tree(user_id),
+                          ftype, meta.get("date"), meta.get("folder"))
 
     # Vector + keyword search
-    return search_similar_metadata(user_id, q_emb, keywords, top_k, threshold=0.5)
+    with stage("query.vector_search"):
+        return search_similar_metadata(user_id, q_emb, keywords, top_k, threshold=0.5, mask=mask)
+
+# Bulk version of search_topk: batched parse, one encode call, one index search
+def search_topk_batch(user_id: str, queries: list[str], top_k: int = 5) -> list[list[dict]]:
+    with stage("batch.parse"):
+        parsed = parse_queries_batch(queries)
+
+    ftypes    = [normalize_extracted_type(meta.get("type")) for meta, _ in parsed]
+    sentences = [build_query_sentence(meta.get("name"), ft, meta.get("date"), kws)
+                 for (meta, kws), ft in zip(parsed, ftypes)]
+    with stage("batch.embed"):
+        q_embs = embed_texts(sentences)
+
+    with stage("batch.prefilter"):
+        cols, tree = load_filter_columns(user_id), load_folder_tree(user_id)
+        masks = [build_mask(cols, tree, ft, meta.get("date"), meta.get("folder"))
+                 for (meta, _), ft in zip(parsed, ftypes)]
+
+    with stage("batch.vector_search"):
+        return search_similar_metadata_batch(user_id, q_embs, [kws for _, kws in parsed],
+                                             top_k, threshold=0.5, masks=masks)
 
 #--------------------------------------TESTING-----------------------------------
 
@@ -2,27 +2,46 @@ import os
 import json
 import re
 import requests
+import threading
 import numpy as np
 import fitz
 import pandas as pd
 from pptx import Presentation
 from io import BytesIO
+from collections import OrderedDict
+from datetime import datetime
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from docx import Document  # python-docx
 
 # external helpers
+from drive_client import drive
+from tracing import inc, stage
+from folder_tree import load_folder_tree
+from normalizers import normalize_type
+from context_packer import chunk_spans, pack_context, pack_history
+from prefetch import Prefetcher
+from content_hash import collapse_duplicates, load_content_groups
+from scheduler import scheduler
+from search_metadata import open_index
+from prefilter import load_filter_columns
 from query_handler import (
-    embed_query_sentence,  # returns a 768-d numpy vector
-    embedding_model,       # SentenceTransformer already loaded
+    embed_texts,           # batched encode through the shared batcher
+    first_pass_search,
     query_openai,
     search_topk,
 )
 
-#  MIME → export map (Google-native ↦ local format)
-EXPORT_MIME = {
-    "google_doc": "text/plain",           # Docs → TXT
-    "spreadsheet": "text/csv",            # Sheets → CSV
-    "presentation": "application/pdf",    # Slides → PDF
+#  Export plans: Google-native type ↦ (export MIME, cache ext, extractor type),
+#  the smallest format that still carries the text
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_PLANS = {
+    "google_doc":   ("text/plain", "txt", "text"),     # Docs → TXT
+    "google_slide": ("text/plain", "txt", "text"),     # Slides → TXT (no PDF parse)
+    "google_sheet": ("text/csv", "csv", "csv"),        # Sheets → CSV, first tab only
 }
+SHEETS_EXPORT_ALL = (XLSX_MIME, "xlsx", "xlsx")        # every tab, one request
+SHEETS_API_BASE = os.getenv("SHEETS_API_BASE", "https://sheets.googleapis.com/v4").rstrip("/")
 
 #  Logical type sets
 TEXT_TYPES  = {
@@ -31,74 +50,337 @@ TEXT_TYPES  = {
 }
 MEDIA_TYPES = {"image", "video", "audio"}
 
+# chunk window in words; the packer merges overlapping picks back together
+CHUNK_SIZE, CHUNK_OVERLAP = 500, 100
+
+# Per-type download budgets (bytes, checked against Drive's `size`).
+# csv / text over budget are read as a Range head; other types are skipped.
+# DOWNLOAD_BUDGETS_MB="pdf=100,csv=4" overrides single types.
+MB = 1024 * 1024
+BYTE_BUDGETS = {"pdf": 50 * MB, "docx": 20 * MB, "pptx": 50 * MB, "xlsx": 20 * MB,
+                "csv": 2 * MB, "text": 2 * MB}
+
+def parse_budgets(spec: str) -> dict:
+    """"pdf=100,csv=4" -> {type: bytes}; malformed items are skipped with a warning."""
+    out = {}
+    for item in filter(None, (i.strip() for i in spec.split(","))):
+        ftype, _, mb = item.partition("=")
+        try:
+            size = float(mb)
+        except ValueError:
+            size = -1
+        if not ftype.strip() or not 0 < size < float("inf"):
+            print(f"⚠️ DOWNLOAD_BUDGETS_MB: ignoring {item!r}, expected type=<megabytes>")
+            continue
+        out[ftype.strip()] = int(size * MB)
+    return out
+
+BYTE_BUDGETS.update(parse_budgets(os.getenv("DOWNLOAD_BUDGETS_MB", "")))
+RANGE_TYPES    = {"csv", "text"}
+DOWNLOAD_CHUNK = 1 * MB          # stream chunk and write buffer
+
+# Files up to this size are extracted straight from memory; the download
+# cache copy is written in the background
+INMEMORY_MAX_BYTES = int(float(os.getenv("INMEMORY_MAX_MB", "16")) * MB)
+_persist_pool      = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
+
+# chunk vectors kept per extracted content (prefetch key), reused across queries
+CHUNK_VEC_CACHE_MB = float(os.getenv("CHUNK_VEC_CACHE_MB", "32"))
+
+# siblings of each cited doc warmed after an answer
+PREFETCH_SIBLINGS = int(os.getenv("PREFETCH_SIBLINGS", "2"))
+
+# Folder listings come from the local tree; FOLDER_LIVE_CHECK=1 also asks Drive
+FOLDER_LISTING_LIMIT = int(os.getenv("FOLDER_LISTING_LIMIT", "50"))
+FOLDER_LIVE_CHECK    = os.getenv("FOLDER_LIVE_CHECK", "0") == "1"
+
 #  Utilities
 def is_text_type(ftype: str) -> bool:
     return ftype in TEXT_TYPES
 
+def fmt_size(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+def file_size(doc: dict) -> int | None:
+    try:
+        return int(doc.get("raw", {}).get("size"))
+    except (TypeError, ValueError):
+        return None          # Google-native files have no size
+
+def oversized(doc: dict) -> str | None:
+    """Why *doc* is too big to read (None if it can be read whole or as a head)."""
+    budget, size = BYTE_BUDGETS.get(doc["type"]), file_size(doc)
+    if budget is None or size is None or size <= budget or doc["type"] in RANGE_TYPES:
+        return None
+    return f"{fmt_size(size)}, over the {fmt_size(budget)} limit for {doc['type']} files"
+
+def fetchable(doc: dict) -> bool:
+    return is_text_type(doc.get("type")) and not oversized(doc)
+
 def icon_for(ftype: str) -> str:
     return {
         "pdf": "📄", "google_doc": "📄", "text": "📄", "docx": "📄",
-        "spreadsheet": "📊", "presentation": "📽️",
+        "spreadsheet": "📊", "google_sheet": "📊", "xlsx": "📊", "csv": "📊",
+        "presentation": "📽️", "google_slide": "📽️", "pptx": "📽️",
         "image": "🖼️", "video": "🎞️", "audio": "🎧",
         "folder": "📁",
     }.get(ftype, "📦")
 
 #  Simple chunk-ranker (semantic similarity)
-def rank_chunks(query: str, chunks: list[str], top_k: int = 5) -> list[str]:
-    """
-    Embed *query* and *chunks*, return the top-k most similar chunks.
-    """
-    if not chunks:
-        return []
-    q_vec  = embed_query_sentence(query)                     # (768,)
-    c_vecs = embedding_model.encode(chunks, convert_to_numpy=True)
-    sims   = np.dot(c_vecs, q_vec) / (
+def _cosine(q_vec, c_vecs):
+    return np.dot(c_vecs, q_vec) / (
         (np.linalg.norm(c_vecs, axis=1) + 1e-8) * np.linalg.norm(q_vec)
     )
-    idx = sims.argsort()[::-1][:top_k]
-    return [chunks[i] for i in idx]
+
+_chunk_vecs, _chunk_vecs_lock = OrderedDict(), threading.Lock()
+_chunk_vecs_bytes = 0
+
+def _remember_chunk_vecs(key, vecs: np.ndarray):
+    global _chunk_vecs_bytes
+    if key is None:
+        return
+    with _chunk_vecs_lock:
+        if key in _chunk_vecs:
+            return
+        _chunk_vecs[key] = vecs
+        _chunk_vecs_bytes += vecs.nbytes
+        while _chunk_vecs_bytes > CHUNK_VEC_CACHE_MB * MB and len(_chunk_vecs) > 1:
+            _chunk_vecs_bytes -= _chunk_vecs.popitem(last=False)[1].nbytes
+
+def score_chunks(query: str, extracted: list[dict]) -> list[np.ndarray]:
+    """
+    Similarity of every chunk of every extracted doc. Chunk vectors are
+    cached under the entry's `key`; the query and uncached chunks go in
+    one encode call.
+    """
+    if not any(e["chunks"] for e in extracted):
+        return [np.zeros(0) for _ in extracted]
+    vecs, todo = [None] * len(extracted), []
+    with _chunk_vecs_lock:
+        for n, e in enumerate(extracted):
+            hit = _chunk_vecs.get(e.get("key"))
+            if hit is not None and len(hit) == len(e["chunks"]):
+                _chunk_vecs.move_to_end(e["key"])
+                vecs[n] = hit
+            else:
+                todo.append(n)
+    inc("chunk_vec_cache_total", len(extracted) - len(todo), outcome="hit")
+    inc("chunk_vec_cache_total", len(todo), outcome="miss")
+
+    fresh = embed_texts([query] + [c for n in todo for c in extracted[n]["chunks"]])
+    start = 1
+    for n in todo:
+        m = len(extracted[n]["chunks"])
+        vecs[n] = fresh[start : start + m]
+        start += m
+        _remember_chunk_vecs(extracted[n].get("key"), vecs[n])
+    return [_cosine(fresh[0], v) if len(v) else np.zeros(0) for v in vecs]
+
+# Download cache: files carry Drive's modifiedTime as their mtime, so a
+# copy is reused only while the Drive file is unchanged
+def modified_epoch(doc: dict) -> float | None:
+    stamp = doc.get("raw", {}).get("modifiedTime")
+    try:
+        return datetime.fromisoformat(stamp.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+def _cached(path: str, modified: float | None) -> bool:
+    try:
+        return modified is not None and abs(os.path.getmtime(path) - modified) < 1e-3
+    except OSError:
+        return False
+
+def _persist(path: str, data: bytes, modified: float | None):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        if modified is not None:
+            os.utime(tmp, (modified, modified))
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"⚠️ could not cache {path}:", e)
+
+def src_size(src) -> int:
+    return src.getbuffer().nbytes if isinstance(src, BytesIO) else os.path.getsize(src)
 
 # Download + export
-def download_file(file_id: str, user_id: str, token: str) -> str | None:
-    url  = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
-    hdr  = {"Authorization": f"Bearer {token}"}
-    r    = requests.get(url, headers=hdr, stream=True)
+_sheet_counts = {}     # (file_id, modified) -> number of tabs
+
+def sheet_count(file_id: str, user_id: str, token: str, modified: float | None = None) -> int | None:
+    """Tabs in a Google Sheet via the Sheets API (None if it can't be read)."""
+    key = (file_id, modified)
+    if key in _sheet_counts:
+        return _sheet_counts[key]
+    try:
+        r = drive.get(f"{SHEETS_API_BASE}/spreadsheets/{file_id}", token, user_id=user_id,
+                      params={"fields": "sheets.properties.sheetId"})
+    except requests.RequestException as e:
+        print("⚠️ sheet lookup failed:", e)
+        return None
     if r.status_code != 200:
+        print("⚠️ sheet lookup failed:", r.text)
+        return None
+    if len(_sheet_counts) > 4096:
+        _sheet_counts.clear()
+    n = _sheet_counts[key] = len(r.json().get("sheets", []))
+    return n
+
+def plan_export(doc, uid, token) -> tuple | None:
+    """(mime, ext, extractor type) for a Google-native doc, None for other files."""
+    kind = normalize_type(doc.get("raw", {}).get("mimeType", ""))
+    plan = EXPORT_PLANS.get(kind)
+    if kind == "google_sheet":
+        # CSV export only carries the first tab; unknown counts export everything
+        n = sheet_count(doc["id"], uid, token, modified_epoch(doc))
+        if n is None or n > 1:
+            plan = SHEETS_EXPORT_ALL
+    return plan
+
+def download_file(file_id: str, user_id: str, token: str, max_bytes: int | None = None,
+                  head: bool = False, size: int | None = None, modified: float | None = None,
+                  md5: str | None = None, kind: str = "other"):
+    """
+    Stream in DOWNLOAD_CHUNK blocks. Past *max_bytes* the download is
+    abandoned, or with `head=True` only the first *max_bytes* are asked
+    for (HTTP Range) and kept, cut back to the last full line.
+
+    Heads and files whose *size* is under INMEMORY_MAX_BYTES come back
+    as a BytesIO (the cache copy is written in the background); others
+    are written to disk and returned as a path. With *md5* the cache copy
+    is stored by content: any copy of the same bytes reuses it. *kind*
+    (the doc type) labels the byte counters.
+    """
+    path = f"user_data/{user_id}/downloads/" + (f"md5-{md5}" if md5 and not head else file_id)
+    if _cached(path, modified) or (md5 and not head and os.path.exists(path)):
+        inc("downloads_total", source="cache")
+        inc("cache_read_bytes_total", os.path.getsize(path), type=kind)
+        return path
+
+    headers = {"Range": f"bytes=0-{max_bytes - 1}"} if head and max_bytes else {}
+    try:
+        r = drive.get(f"/files/{file_id}", token, user_id=user_id,
+                      params={"alt": "media"}, headers=headers, stream=True)
+    except requests.RequestException as e:
+        print("❌ download failed:", e)
+        return None
+    if r.status_code not in (200, 206):
         print("❌ download failed:", r.text)
         return None
-    path = f"user_data/{user_id}/downloads/{file_id}"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "wb") as f:
-        for chunk in r.iter_content(8192):
-            f.write(chunk)
+    in_memory = head or (size is not None and size <= INMEMORY_MAX_BYTES)
+    # copies of one content share *path*: each download streams to its own temp file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    if not in_memory:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    parts, received, written, over, cut = [], 0, 0, False, False
+    try:
+        with r, (nullcontext() if in_memory else open(tmp, "wb", buffering=DOWNLOAD_CHUNK)) as f:
+            write = parts.append if in_memory else f.write
+            for chunk in r.iter_content(DOWNLOAD_CHUNK):
+                received += len(chunk)
+                if max_bytes and written + len(chunk) > max_bytes:
+                    if not head:
+                        over = True
+                        break
+                    chunk, cut = chunk[: max_bytes - written], True
+                write(chunk)
+                written += len(chunk)
+                if cut:
+                    break
+    except requests.RequestException as e:
+        # connection dropped or timed out mid-stream
+        if not in_memory and os.path.exists(tmp):
+            os.remove(tmp)
+        print("❌ download failed:", e)
+        return None
+    finally:
+        # bytes off the network, kept or not
+        inc("fetched_bytes_total", received, type=kind, via="download")
+    # 206 with a larger total: the server honoured the Range, we hold a head
+    total = r.headers.get("Content-Range", "").rpartition("/")[2]
+    cut = cut or (r.status_code == 206 and total.isdigit() and int(total) > written)
+    if over:
+        if not in_memory:
+            os.remove(tmp)
+        print(f"⚠️ download of {file_id} passed {fmt_size(max_bytes)}, skipped")
+        return None
+
+    if in_memory:
+        data = b"".join(parts)
+        if cut and b"\n" in data:
+            data = data[: data.rfind(b"\n") + 1]
+        _persist_pool.submit(_persist, path, data, modified)
+        inc("downloads_total", source="memory")
+        return BytesIO(data)
+    if cut:
+        _trim_to_last_line(tmp)
+    if modified is not None:
+        os.utime(tmp, (modified, modified))
+    os.replace(tmp, path)
+    inc("downloads_total", source="disk")
     return path
 
-def export_google_file(file_id: str, logical_type: str, user_id: str, token: str) -> str | None:
-    mime = EXPORT_MIME.get(logical_type)
-    if not mime:
+def _trim_to_last_line(path: str):
+    with open(path, "rb+") as f:
+        f.seek(max(0, os.path.getsize(path) - DOWNLOAD_CHUNK))
+        tail = f.read()
+        nl = tail.rfind(b"\n")
+        if nl >= 0:
+            f.truncate(os.path.getsize(path) - len(tail) + nl + 1)
+
+def _download_doc(doc, uid, token):
+    """download_file with the doc's byte budget, size and cache stamp."""
+    budget = BYTE_BUDGETS.get(doc["type"])
+    return download_file(doc["id"], uid, token, max_bytes=budget, head=doc["type"] in RANGE_TYPES,
+                         size=file_size(doc), modified=modified_epoch(doc),
+                         md5=doc.get("raw", {}).get("md5Checksum"), kind=doc["type"])
+
+def export_google_file(file_id: str, mime: str, ext: str, user_id: str, token: str,
+                       modified: float | None = None, kind: str = "other"):
+    """Export bodies are already in memory: extract from there, cache in the background."""
+    path = f"user_data/{user_id}/downloads/{file_id}.{ext}"
+    if _cached(path, modified):
+        inc("downloads_total", source="cache")
+        inc("cache_read_bytes_total", os.path.getsize(path), type=kind)
+        return path
+    try:
+        r = drive.get(f"/files/{file_id}/export", token, user_id=user_id,
+                      params={"mimeType": mime})
+    except requests.RequestException as e:
+        print("❌ export failed:", e)
         return None
-    url  = f"https://www.googleapis.com/drive/v3/files/{file_id}/export"
-    hdr  = {"Authorization": f"Bearer {token}"}
-    r    = requests.get(url, headers=hdr, params={"mimeType": mime})
     if r.status_code != 200:
         print("❌ export failed:", r.text)
         return None
-    ext_map = {"text/plain": "txt", "text/csv": "csv"}
-    ext = ext_map.get(mime, "pdf" if "pdf" in mime else "xlsx")
-    path = f"user_data/{user_id}/downloads/{file_id}.{ext}"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "wb") as f:
-        f.write(r.content)
-    return path
-
-# Extractors for each type
-def extract_text_from_pdf(path: str) -> str:
-    doc = fitz.open(path)
+    _persist_pool.submit(_persist, path, r.content, modified)
+    inc("downloads_total", source="memory")
+    inc("exports_total", format=ext)
+    inc("fetched_bytes_total", len(r.content), type=kind, via="export")
+    return BytesIO(r.content)
+
+# Extractors for each type, `src` is a path or an in-memory BytesIO
+def _rewind(src):
+    if isinstance(src, BytesIO):
+        src.seek(0)
+    return src
+
+def extract_text_from_pdf(src) -> str:
+    doc = fitz.open(src) if isinstance(src, str) else fitz.open(stream=_rewind(src), filetype="pdf")
     return "\n".join(p.get_text() for p in doc)
 
-def extract_text_from_docx(path: str) -> str:
+def extract_text_from_plain(src) -> str:
+    if isinstance(src, str):
+        return open(src, "r", encoding="utf-8").read()
+    return src.getvalue().decode("utf-8", errors="replace")
+
+def extract_text_from_docx(src) -> str:
     try:
-        doc = Document(path)
+        doc = Document(_rewind(src))
         parts = [p.text for p in doc.paragraphs]
         for table in doc.tables:
             for row in table.rows:
@@ -107,23 +389,25 @@ def extract_text_from_docx(path: str) -> str:
     except Exception as e:
         return f"(⚠️ DOCX read error: {e})"
 
-def extract_text_from_csv(path: str) -> str:
+def extract_text_from_csv(src) -> str:
     try:
-        df = pd.read_csv(path, nrows=20)
+        df = pd.read_csv(_rewind(src), nrows=20)
         return df.to_string(index=False)
     except Exception as e:
         return f"(⚠️ CSV read error: {e})"
 
-def extract_text_from_excel(path: str) -> str:
+def extract_text_from_excel(src) -> str:
     try:
-        df = pd.read_excel(path, engine="openpyxl", nrows=20)
-        return df.to_string(index=False)
+        sheets = pd.read_excel(_rewind(src), engine="openpyxl", nrows=20, sheet_name=None)
+        if len(sheets) == 1:
+            return next(iter(sheets.values())).to_string(index=False)
+        return "\n\n".join(f"## {name}\n{df.to_string(index=False)}" for name, df in sheets.items())
     except Exception as e:
         return f"(⚠️ Excel read error: {e})"
 
-def extract_text_from_pptx(path: str) -> str:
+def extract_text_from_pptx(src) -> str:
     try:
-        prs = Presentation(path)
+        prs = Presentation(_rewind(src))
         return "\n".join(
             shape.text for slide in prs.slides
             for shape in slide.shapes if hasattr(shape, "text")
@@ -132,23 +416,23 @@ def extract_text_from_pptx(path: str) -> str:
         return f"(⚠️ PPTX read error: {e})"
 
 # Type-aware processing
-def process_file(path: str, logical_type: str) -> str:
+def process_file(src, logical_type: str) -> str:
     if logical_type == "pdf":
-        return extract_text_from_pdf(path)
+        return extract_text_from_pdf(src)
     if logical_type in {"text", "google_doc"}:
-        return open(path, "r", encoding="utf-8").read()
+        return extract_text_from_plain(src)
     if logical_type == "docx":
-        return extract_text_from_docx(path)
+        return extract_text_from_docx(src)
     if logical_type in {"spreadsheet", "xlsx"}:
-        return extract_text_from_excel(path)
+        return extract_text_from_excel(src)
     if logical_type == "csv":
-        return extract_text_from_csv(path)
+        return extract_text_from_csv(src)
     if logical_type in {"pptx", "presentation"}:
-        return extract_text_from_pptx(path)
+        return extract_text_from_pptx(src)
     return "⚠️ Unsupported file type"
 
 # Chunkers
-def chunk_text(txt: str, size: int = 500, overlap: int = 100):
+def chunk_text(txt: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP):
     words, out, i = txt.split(), [], 0
     while i < len(words):
         out.append(" ".join(words[i : i + size]))
@@ -156,76 +440,175 @@ def chunk_text(txt: str, size: int = 500, overlap: int = 100):
     return out
 
 # Download and extract logic
-def _handle_google_doc(doc, uid, token):
-    exported = export_google_file(doc["id"], "google_doc", uid, token)
-    if exported:
-        return exported, "text"
-    return _handle_uploaded_docx(doc, uid, token)
+def _handle_google_native(doc, uid, token):
+    plan = plan_export(doc, uid, token)
+    if not plan:
+        return None, None
+    mime, ext, ltype = plan
+    src = export_google_file(doc["id"], mime, ext, uid, token, modified_epoch(doc), kind=doc["type"])
+    return (src, ltype) if src else (None, None)
 
 def _handle_uploaded_docx(doc, uid, token):
-    p = download_file(doc["id"], uid, token)
+    p = _download_doc(doc, uid, token)
     return (p, "docx") if p else (None, None)
 
-def _handle_google_sheet(doc, uid, token):
-    mime = doc["raw"]["mimeType"]
-    if mime.startswith("application/vnd.google-apps."):
-        csv = export_google_file(doc["id"], "spreadsheet", uid, token)
-        return (csv, "csv") if csv else (None, None)
-    xlsx = download_file(doc["id"], uid, token)
+def _handle_uploaded_sheet(doc, uid, token):
+    xlsx = _download_doc(doc, uid, token)
     return (xlsx, "xlsx") if xlsx else (None, None)
 
-def download_and_extract_top_files(docs, uid, token):
-    out = []
-    for d in docs:
-        path, ltype = None, None
-        if d["type"] == "google_doc":
-            path, ltype = _handle_google_doc(d, uid, token)
-        elif d["type"] in {"google_sheet", "spreadsheet", "xlsx"}:
-            path, ltype = _handle_google_sheet(d, uid, token)
+def fetch_doc_text(d, uid, token, prefix="query"):
+    """Download / export *d* and extract its text, None if that fails."""
+    src, ltype = None, None
+    with scheduler.slot("download"), stage(f"{prefix}.download"):
+        if d.get("raw", {}).get("mimeType", "").startswith("application/vnd.google-apps."):
+            src, ltype = _handle_google_native(d, uid, token)
+        elif d["type"] in {"spreadsheet", "xlsx"}:
+            src, ltype = _handle_uploaded_sheet(d, uid, token)
         elif d["type"] == "docx":
-            path, ltype = _handle_uploaded_docx(d, uid, token)
+            src, ltype = _handle_uploaded_docx(d, uid, token)
         else:
             if is_text_type(d["type"]):
-                path = download_file(d["id"], uid, token)
+                src = _download_doc(d, uid, token)
                 ltype = d["type"]
 
-        if not path:
+    if src is None:
+        return None
+    # per-format parse time; bytes are counted where they are fetched
+    with scheduler.slot("extract"), stage(f"{prefix}.extract"), stage(f"extract.{ltype}"):
+        text = process_file(src, ltype)
+    size = file_size(d)
+    if d["type"] in RANGE_TYPES and size and size > src_size(src):
+        # tell the model it is reading a head, not the whole file
+        text = f"[Only the first {fmt_size(src_size(src))} of {fmt_size(size)} were read]\n{text}"
+    return text
+
+# extracted-text cache + background warming in front of fetch_doc_text
+prefetcher = Prefetcher(fetch_doc_text)
+
+def download_and_extract_top_files(docs, uid, token, skipped=None):
+    """Text + chunks per readable doc; too-big docs go to *skipped* as (doc, reason)."""
+    out = []
+    for d in docs:
+        if reason := oversized(d):
+            if skipped is not None:
+                skipped.append((d, reason))
             continue
-        text = process_file(path, ltype)
-        if text.strip():
-            out.append({"doc": d, "chunks": chunk_text(text)})
+        text = prefetcher.get(uid, d, token)
+        if text and text.strip():
+            out.append({"doc": d, "text": text, "chunks": chunk_text(text),
+                        "key": prefetcher.key(uid, d)})
     return out
 
+# Prefetch triggers
+def speculative_prefetch(uid, query, token):
+    """While the LLM parses the query, fetch what a local-only search guesses."""
+    prefetcher.speculate(
+        uid, lambda: [d for d in first_pass_search(uid, query) if fetchable(d)], token
+    )
+
+def _related_docs(uid, sources):
+    tree, index, cols = load_folder_tree(uid), open_index(uid), load_filter_columns(uid)
+    if tree is None or index is None or cols is None or not len(tree) == index.ntotal == len(cols["mtime"]):
+        return []
+    out, seen = [], set()
+    for s in sources:
+        node = tree.index_of(s["id"])
+        if node is None:
+            continue
+        seen.add(node)
+        parent = int(tree.parent[node])
+        if parent < 0:
+            continue
+        # newest text siblings first, from the columns; records only for the ones tried
+        kids = [c for c in tree.children(parent) if c not in seen and is_text_type(tree.types[c])]
+        kids = np.asarray(kids, dtype=np.int64)
+        taken = 0
+        for c in kids[np.argsort(-cols["mtime"][kids], kind="stable")]:
+            rec = index.record(int(c))
+            if not fetchable(rec):
+                continue
+            seen.add(int(c))
+            out.append(rec)
+            taken += 1
+            if taken == PREFETCH_SIBLINGS:
+                break
+    return out
+
+def warm_related(uid, sources, token):
+    """After an answer, warm the folder siblings of the cited docs."""
+    cited = [s for s in sources if fetchable(s)]
+    if cited:
+        prefetcher.speculate(uid, lambda: _related_docs(uid, cited), token)
+
 # Rag helper
-def generate_response_with_context(query, context_chunks, history=None):
+def generate_response_with_context(query, context_chunks, history=None, user_id=None):
     hist = ""
     if history:
-        hist = "\n\n### Conversation so far ###\n" + "\n\n".join(
-            f"USER: {h['q']}\nASSISTANT: {h['a']}" for h in history[-5:]
-        )
+        # newest turns first, trimmed to HISTORY_TOKEN_BUDGET
+        hist = "\n\n### Conversation so far ###\n" + pack_history(history)
     context = "\n---\n".join(context_chunks)
     prompt = (
         "You are a helpful assistant. Answer the query using ONLY the context below."
         f"{hist}\n\n### Context ###\n{context}\n\n### Query ###\n{query}\n\n### Answer ###"
     )
-    return query_openai(prompt, max_tokens=300)
+    return query_openai(prompt, max_tokens=300, kind="answer", user_id=user_id)
 
 # Folder helper
-def list_folder_children(fid, token, limit=10):
-    q   = f"'{fid}' in parents and trashed=false"
-    hdr = {"Authorization": f"Bearer {token}"}
-    r   = requests.get(
-        "https://www.googleapis.com/drive/v3/files",
-        headers=hdr,
-        params={"q": q, "pageSize": limit, "fields": "files(id,name,mimeType,webViewLink)"},
-    )
+def list_folder_children(fid, token, limit=10, user_id=None):
+    q = f"'{fid}' in parents and trashed=false"
+    try:
+        r = drive.get(
+            "/files", token, user_id=user_id,
+            params={"q": q, "pageSize": limit, "fields": "files(id,name,mimeType,webViewLink)"},
+        )
+    except requests.RequestException as e:
+        print("❌ folder listing failed:", e)
+        return []
     if r.status_code != 200:
         return []
     return [
-        {"name": f["name"], "type": f["mimeType"], "link": f.get("webViewLink")}
+        {"id": f["id"], "name": f["name"], "type": normalize_type(f["mimeType"]), "link": f.get("webViewLink")}
         for f in r.json().get("files", [])
     ]
 
+def folder_listing_from_tree(tree, node: int, limit: int = FOLDER_LISTING_LIMIT) -> list[dict]:
+    """Direct children of *node* from the local tree, folders first."""
+    kids = sorted(tree.children(node), key=lambda c: (tree.types[c] != "folder", tree.names[c].lower()))
+    return [
+        {"id": tree.ids[c], "name": tree.names[c], "type": tree.types[c],
+         "descendants": tree.descendant_count(c) if tree.types[c] == "folder" else None}
+        for c in kids[:limit]
+    ]
+
+def _folder_answer(first, tree, access_token, user_id):
+    node = tree.index_of(first["id"]) if tree else None
+    if node is None:
+        # no local tree yet (old index) → ask Drive
+        kids = list_folder_children(first["id"], access_token, FOLDER_LISTING_LIMIT, user_id=user_id)
+        listing = "\n".join(f"{icon_for(c['type'])} {c['name']}" for c in kids) or "*(folder is empty)*"
+        return f"📁 Folder **{first['name']}** contents:\n\n{listing}"
+
+    kids  = folder_listing_from_tree(tree, node)
+    total = len(tree.children(node))
+    note  = ""
+    if FOLDER_LIVE_CHECK:
+        live = list_folder_children(first["id"], access_token, 1000, user_id=user_id)
+        if {c["id"] for c in live} != {tree.ids[c] for c in tree.children(node)}:
+            kids, total = live[:FOLDER_LISTING_LIMIT], len(live)
+            note = "\n\n*(Listing refreshed from Drive – reload your files to update the index.)*"
+
+    lines = []
+    for c in kids:
+        line = f"{icon_for(c['type'])} {c['name']}"
+        if c.get("descendants"):
+            line += f" ({c['descendants']} items)"
+        lines.append(line)
+    if total > len(kids):
+        lines.append(f"… and {total - len(kids)} more")
+    listing = "\n".join(lines) or "*(folder is empty)*"
+    header  = f"📁 Folder **{first['name']}** (`{tree.paths[node]}`, {tree.descendant_count(node)} items in total) contents:"
+    return f"{header}\n\n{listing}{note}"
+
 # Final response logic
 def generate_final_response(
     user_query: str,
@@ -240,21 +623,29 @@ def generate_final_response(
             "sources": [],
         }
 
+    # copies of one content become a single source listing every location
+    results = collapse_duplicates(results, load_content_groups(user_id))
     first = results[0]
+    tree  = None
 
     def enrich(doc):
+        nonlocal tree
         raw = doc.get("raw", {})
+        x = dict(doc)
         if thumb := raw.get("thumbnailLink"):
-            x = dict(doc)
             x["thumb"] = thumb
-            return x
-        return doc
+        if copies := doc.get("copies"):
+            tree = tree or load_folder_tree(user_id)
+            nodes = [tree.index_of(c["id"]) if tree else None for c in copies]
+            x["copies"] = [{**c, "path": tree.paths[n] if n is not None else None}
+                           for c, n in zip(copies, nodes)]
+        return x
 
     # Folder
     if first["type"] == "folder":
-        kids    = list_folder_children(first["id"], access_token, 15)
-        listing = "\n".join(f"{icon_for(c['type'])} {c['name']}" for c in kids) or "*(folder is empty)*"
-        return {"answer": f"📁 Folder **{first['name']}** contents:\n\n{listing}", "sources": [enrich(first)]}
+        with stage("query.folder_listing"):
+            answer = _folder_answer(first, load_folder_tree(user_id), access_token, user_id)
+        return {"answer": answer, "sources": [enrich(first)]}
 
     # Media
     if first["type"] in MEDIA_TYPES:
@@ -265,26 +656,34 @@ def generate_final_response(
     text_docs  = [d for d in results if is_text_type(d["type"])]
     other_docs = [d for d in results if not is_text_type(d["type"])]
 
-    extracted = download_and_extract_top_files(text_docs, user_id, access_token)
-
-    context_parts = []
-    for e in extracted:
-        best = rank_chunks(user_query, e["chunks"], top_k=5)
-        if best:
-            header = f"### {e['doc']['name']}"
-            context_parts.append(header + "\n" + "\n".join(best))
-
-    if context_parts:
-        context_chunks = "\n\n".join(context_parts)
-        answer = generate_response_with_context(user_query, [context_chunks], history)
+    skipped   = []
+    extracted = download_and_extract_top_files(text_docs, user_id, access_token, skipped)
+
+    # best chunks across all docs, merged and packed to CONTEXT_TOKEN_BUDGET
+    with stage("query.rank_chunks"):
+        scores = score_chunks(user_query, extracted)
+        packed = []
+        for e, sims in zip(extracted, scores):
+            words = e["text"].split()
+            packed.append({"name": e["doc"]["name"], "words": words, "scores": sims,
+                           "spans": chunk_spans(len(words), CHUNK_SIZE, CHUNK_OVERLAP)})
+        context_chunks, _ = pack_context(packed)
+
+    if context_chunks:
+        with stage("query.completion"):
+            answer = generate_response_with_context(user_query, [context_chunks], history, user_id)
         if other_docs:
             extra = ", ".join(d["name"] for d in other_docs[:3])
             answer += f"\n\n(Also matched media files: {extra})"
     else:
         names  = "\n".join(f"- {d['name']}" for d in results[:3])
         answer = f"I found these files:\n{names}\n\nLet me know which one to explore."
+    if skipped:
+        notes  = "\n".join(f"- **{d['name']}** ({reason})" for d, reason in skipped)
+        answer += f"\n\n⚠️ Not read because they are too large – open them in Drive:\n{notes}"
 
-    sources = [enrich(e["doc"]) for e in extracted] + [enrich(d) for d in other_docs]
+    sources = ([enrich(e["doc"]) for e in extracted] + [enrich(d) for d, _ in skipped]
+               + [enrich(d) for d in other_docs])
     return {"answer": answer, "sources": sources}
 
 # -------------------------------------------------------TESTING--------------------------------------
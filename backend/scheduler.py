@@ -0,0 +1,255 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from tracing import inc, observe
+
+load_dotenv()
+
+# scheduler knobs
+SCHED_ENABLED      = os.getenv("SCHED", "1") == "1"
+SCHED_SLOTS        = {                     # concurrent calls per stage, all users
+    "download": int(os.getenv("SCHED_DOWNLOAD_SLOTS", "8")),
+    "extract":  int(os.getenv("SCHED_EXTRACT_SLOTS", str(os.cpu_count() or 2))),
+    "embed":    int(os.getenv("SCHED_EMBED_SLOTS", "4")),
+    "llm":      int(os.getenv("SCHED_LLM_SLOTS", "8")),
+}
+SCHED_PER_USER     = int(os.getenv("SCHED_PER_USER", "2"))        # per stage
+SCHED_MAX_QUEUE    = int(os.getenv("SCHED_MAX_QUEUE", "64"))      # waiters per stage, then 429
+SCHED_MAX_WAIT_S   = float(os.getenv("SCHED_MAX_WAIT_S", "30"))
+SCHED_CANCEL_STALE = os.getenv("SCHED_CANCEL_STALE", "1") == "1"
+
+
+def parse_weights(spec: str) -> dict:
+    """"alice=2,bot=0.5" -> {user: weight}; malformed items are skipped with a warning."""
+    out = {}
+    for item in filter(None, (i.strip() for i in spec.split(","))):
+        user, _, w = item.partition("=")
+        try:
+            weight = float(w)
+        except ValueError:
+            weight = -1
+        if not user.strip() or not 0 < weight < float("inf"):
+            print(f"⚠️ SCHED_WEIGHTS: ignoring {item!r}, expected user=<positive weight>")
+            continue
+        out[user.strip()] = weight
+    return out
+
+# SCHED_WEIGHTS="alice=2,bot=0.5": share of each stage relative to weight 1
+SCHED_WEIGHTS = parse_weights(os.getenv("SCHED_WEIGHTS", ""))
+
+
+class Overloaded(Exception):
+    """A stage queue is full (or the wait timed out): answer 429."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"{stage} queue is full")
+        self.stage = stage
+
+
+class Cancelled(Exception):
+    """The request was superseded by a newer query from the same user."""
+
+
+class Ticket:
+    __slots__ = ("user_id", "weight", "cancelled")
+
+    def __init__(self, user_id: str):
+        self.user_id   = user_id
+        self.weight    = SCHED_WEIGHTS.get(user_id, 1.0)
+        self.cancelled = False
+
+
+class _Waiter:
+    __slots__ = ("ticket", "seq", "granted")
+
+    def __init__(self, ticket: Ticket, seq: int):
+        self.ticket, self.seq, self.granted = ticket, seq, False
+
+
+class _Stage:
+    """
+    Slots of one stage, handed out by start-time fair queueing: each user
+    has a virtual time that advances by 1/weight per granted slot, and the
+    waiter with the lowest start tag goes next. Users at SCHED_PER_USER
+    running calls are passed over.
+    """
+
+    def __init__(self, name: str, slots: int):
+        self.name    = name
+        self.slots   = slots
+        self.running = 0
+        self.by_user = {}      # user -> running calls
+        self.vtime   = {}      # user -> virtual finish time
+        self.clock   = 0.0     # start tag of the last grant
+        self.waiting = []
+        self.seq     = 0
+        self.cond    = threading.Condition()
+
+    def _tag(self, user_id: str) -> float:
+        return max(self.vtime.get(user_id, 0.0), self.clock)
+
+    def _dispatch(self):
+        # with cond held: grant free slots to the fairest eligible waiters
+        while self.running < self.slots:
+            ready = [w for w in self.waiting if self.by_user.get(w.ticket.user_id, 0) < SCHED_PER_USER]
+            if not ready:
+                return
+            w = min(ready, key=lambda w: (self._tag(w.ticket.user_id), w.seq))
+            uid = w.ticket.user_id
+            self.clock = self._tag(uid)
+            self.vtime[uid] = self.clock + 1.0 / w.ticket.weight
+            self.waiting.remove(w)
+            self.running += 1
+            self.by_user[uid] = self.by_user.get(uid, 0) + 1
+            w.granted = True
+            self.cond.notify_all()
+        if len(self.vtime) > 4096:
+            # users behind the clock restart from it anyway
+            self.vtime = {u: v for u, v in self.vtime.items() if v > self.clock}
+
+    def acquire(self, ticket: Ticket):
+        with self.cond:
+            if len(self.waiting) >= SCHED_MAX_QUEUE:
+                inc("sched_rejected_total", stage=self.name)
+                raise Overloaded(self.name)
+            self.seq += 1
+            w = _Waiter(ticket, self.seq)
+            self.waiting.append(w)
+            self._dispatch()
+            deadline = time.monotonic() + SCHED_MAX_WAIT_S
+            while not w.granted:
+                left = deadline - time.monotonic()
+                if ticket.cancelled or left <= 0:
+                    self.waiting.remove(w)
+                    if ticket.cancelled:
+                        inc("sched_cancelled_total", stage=self.name)
+                        raise Cancelled()
+                    inc("sched_rejected_total", stage=self.name)
+                    raise Overloaded(self.name)
+                self.cond.wait(left)
+
+    def release(self, ticket: Ticket):
+        with self.cond:
+            self.running -= 1
+            n = self.by_user[ticket.user_id] - 1
+            if n:
+                self.by_user[ticket.user_id] = n
+            else:
+                del self.by_user[ticket.user_id]
+            self._dispatch()
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify_all()
+
+
+class _NullSlot:
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullSlot()
+
+# the query a thread is working for; unset for background work (jobs, prefetch)
+_ticket = contextvars.ContextVar("sched_ticket", default=None)
+
+
+class Scheduler:
+    """
+    Admission control for the expensive /query stages (download, extract,
+    embed, llm). Each stage has a global slot count, a per-user cap and a
+    bounded wait queue; a full queue raises Overloaded straight away.
+    `begin(user_id)` marks the calling request; with SCHED_CANCEL_STALE
+    the user's older requests still running are cancelled and raise
+    Cancelled at their next stage. Work handed to other threads keeps the
+    request's slots through `bind(current())` or contextvars.copy_context().
+    """
+
+    def __init__(self, slots: dict = SCHED_SLOTS):
+        self.stages  = {name: _Stage(name, n) for name, n in slots.items()}
+        self._lock   = threading.Lock()
+        self._active = {}                  # user_id -> live tickets
+
+    def begin(self, user_id: str, supersede: bool = True):
+        """
+        Start scheduling this request; returns a token for `end`.
+        `supersede=False` (batch requests) neither cancels the user's other
+        requests nor can be cancelled by them.
+        """
+        ticket = Ticket(user_id)
+        if not supersede:
+            return _ticket.set(ticket)
+        with self._lock:
+            live = self._active.setdefault(user_id, [])
+            stale = list(live) if SCHED_CANCEL_STALE else []
+            if stale:
+                live.clear()
+            live.append(ticket)
+        for old in stale:
+            old.cancelled = True
+        if stale:
+            for s in self.stages.values():
+                s.wake()
+        return _ticket.set(ticket)
+
+    def end(self, token):
+        ticket = _ticket.get()
+        _ticket.reset(token)
+        if ticket is None:
+            return
+        with self._lock:
+            live = self._active.get(ticket.user_id, [])
+            if ticket in live:
+                live.remove(ticket)
+            if not live:
+                self._active.pop(ticket.user_id, None)
+
+    def current(self) -> Ticket | None:
+        """The calling thread's ticket, to hand to `bind` in a worker thread."""
+        return _ticket.get()
+
+    @contextmanager
+    def bind(self, ticket: Ticket | None):
+        """Run the block under *ticket* (None: unscheduled background work)."""
+        token = _ticket.set(ticket)
+        try:
+            yield
+        finally:
+            _ticket.reset(token)
+
+    @contextmanager
+    def _slot(self, stage: _Stage, ticket: Ticket):
+        t0 = time.perf_counter()
+        stage.acquire(ticket)
+        observe(f"sched.{stage.name}.wait", time.perf_counter() - t0)
+        try:
+            yield
+        finally:
+            stage.release(ticket)
+
+    def slot(self, name: str):
+        """`with scheduler.slot("llm"): ...`, a no-op outside a scheduled request."""
+        ticket = _ticket.get()
+        if not SCHED_ENABLED or ticket is None:
+            return _NULL
+        if ticket.cancelled:
+            inc("sched_cancelled_total", stage=name)
+            raise Cancelled()
+        return self._slot(self.stages[name], ticket)
+
+    def snapshot(self) -> dict:
+        """{(metric, labels tuple): value} for tracing.register_collector."""
+        out = {}
+        for name, s in self.stages.items():
+            out[("sched_queued", (("stage", name),))]  = len(s.waiting)
+            out[("sched_running", (("stage", name),))] = s.running
+        return out
+
+
+# one scheduler per process
+scheduler = Scheduler()
@@ -1,52 +1,190 @@
 import os
 import faiss
 import pickle
+import threading
 import numpy as np
+from collections import OrderedDict
+
+from shared_index import INDEX_SERVING, get_shared_index
+from content_hash import doc_content_key
+
+# batch search: fetch this many times top_k from the full index, then post-filter
+BATCH_OVERFETCH = int(os.getenv("BATCH_OVERFETCH", "4"))
+# rows searched per top_k slot, so copies of one file don't crowd out the rest
+DEDUPE_OVERFETCH = int(os.getenv("DEDUPE_OVERFETCH", "2"))
+# loaded per-user indexes kept per process, least recently used dropped first
+LOCAL_INDEX_CACHE = int(os.getenv("LOCAL_INDEX_CACHE", "8"))
+
+
+class LocalIndex:
+    """The per-worker pickle / faiss artefacts behind the same calls as SharedIndex."""
+
+    def __init__(self, idx, mapping, inverted, all_embs):
+        self.idx, self.mapping, self.inverted, self.all_embs = idx, mapping, inverted, all_embs
+
+    @classmethod
+    def load(cls, user_id):
+        """Cached per process, reloaded when any artefact's mtime changes."""
+        base = f"user_data/{user_id}"
+        paths = (f"{base}/metadata.index", f"{base}/metadata_mapping.pkl",
+                 f"{base}/inverted_index.pkl", f"{base}/embeddings.npy")
+        try:
+            stamp = tuple(os.path.getmtime(p) for p in paths)
+        except OSError:
+            return None
+        with _local_lock:
+            hit = _local_cache.get(user_id)
+            if hit and hit[0] == stamp:
+                _local_cache.move_to_end(user_id)
+                return hit[1]
+        idx_path, map_path, inv_path, emb_path = paths
+        index = cls(faiss.read_index(idx_path), pickle.load(open(map_path, 'rb')),
+                    pickle.load(open(inv_path, 'rb')), np.load(emb_path))
+        with _local_lock:
+            _local_cache[user_id] = (stamp, index)
+            _local_cache.move_to_end(user_id)
+            while len(_local_cache) > LOCAL_INDEX_CACHE:
+                _local_cache.popitem(last=False)
+        return index
+
+    @property
+    def ntotal(self):
+        return self.idx.ntotal
+
+    def record(self, i):
+        return self.mapping[i].copy()
+
+    def postings(self, token):
+        return self.inverted.get(token, [])
+
+    def search(self, qv, k, ids=None):
+        qv = qv.reshape(1, -1)
+        if ids is None:
+            D, I = self.idx.search(qv, k)
+            return [(i, d) for i, d in zip(I[0], D[0]) if i >= 0]
+        if len(ids) > k:
+            # only the selected rows are scored, no copy of the embeddings
+            sel  = faiss.IDSelectorBatch(np.asarray(ids, dtype="int64"))
+            D, I = self.idx.search(qv, k, params=faiss.SearchParameters(sel=sel))
+            return [(i, d) for i, d in zip(I[0], D[0]) if i >= 0]
+        sub_embs = self.all_embs[ids]
+        sub_idx  = faiss.IndexFlatL2(sub_embs.shape[1])
+        sub_idx.add(sub_embs)
+        D, I = sub_idx.search(qv, min(len(ids), k))
+        return [(ids[i], d) for i, d in zip(I[0], D[0])]
+
+    def search_batch(self, Q, k):
+        """(nq, d) queries against the whole index in one call."""
+        D, I = self.idx.search(np.ascontiguousarray(Q, dtype=np.float32), k)
+        return [[(i, d) for i, d in zip(I[r], D[r]) if i >= 0] for r in range(len(Q))]
+
+_local_cache, _local_lock = OrderedDict(), threading.Lock()
+
+
+def open_index(user_id):
+    """Shared mmap generation when INDEX_SERVING=shared, else the local files."""
+    if INDEX_SERVING == "shared":
+        return get_shared_index(user_id)
+    return LocalIndex.load(user_id)
+
 
 #Search similaity with metadata
 def search_similar_metadata(user_id, q_emb, query_keywords, top_k=5,
-                            threshold=0.5, fallback_threshold=0.7):
-    base = f"user_data/{user_id}"
-    idx_path = f"{base}/metadata.index"
-    map_path = f"{base}/metadata_mapping.pkl"
-    inv_path = f"{base}/inverted_index.pkl"
-    emb_path = f"{base}/embeddings.npy"
-
-    if not all(os.path.exists(p) for p in (idx_path, map_path, inv_path, emb_path)):
+                            threshold=0.5, fallback_threshold=0.7, mask=None):
+    """
+    `mask` (bool array over index rows, from prefilter.build_mask) restricts
+    the vector search to rows matching the extracted type / date / folder.
+    """
+    index = open_index(user_id)
+    if index is None:
         print(" One or more required index files are missing.")
         return []
 
-    # Load artefacts
-    idx      = faiss.read_index(idx_path)
-    mapping  = pickle.load(open(map_path, 'rb'))
-    inverted = pickle.load(open(inv_path, 'rb'))
-    all_embs = np.load(emb_path)
-
     # Keyword filtering
     cand_idxs = set()
     for kw in query_keywords:
-        cand_idxs |= set(inverted.get(kw, []))
-    use_full = not cand_idxs     #if true, we search whole index
-
-    # Vector search
-    qv = q_emb.reshape(1, -1)
-    if use_full:
-        D, I = idx.search(qv, top_k)
-        hits = list(zip(I[0], D[0]))
+        cand_idxs |= set(index.postings(kw))
+
+    # Structured prefilter, keyword hits outside the mask are dropped
+    masked = mask is not None and len(mask) == index.ntotal
+    if masked:
+        cand_idxs = {i for i in cand_idxs if mask[i]}
+
+    # Vector search, whole index / masked rows / keyword candidates
+    qv = np.asarray(q_emb, dtype=np.float32)
+    k  = top_k * DEDUPE_OVERFETCH
+    if cand_idxs:
+        hits = index.search(qv, k, ids=sorted(cand_idxs))
+    elif masked:
+        hits = index.search(qv, k, ids=np.flatnonzero(mask))
     else:
-        sub_idxs = list(cand_idxs)
-        sub_embs = all_embs[sub_idxs]
-        sub_idx  = faiss.IndexFlatL2(sub_embs.shape[1])
-        sub_idx.add(sub_embs)
-        D, I = sub_idx.search(qv, min(len(sub_idxs), top_k))
-        hits = [(sub_idxs[i], d) for i, d in zip(I[0], D[0])]
+        hits = index.search(qv, k)
+
+    return _apply_threshold(index, hits, threshold, fallback_threshold, top_k)
+
+
+# Many queries, one index load and one full-index search
+def search_similar_metadata_batch(user_id, q_embs, keywords_list, top_k=5,
+                                  threshold=0.5, fallback_threshold=0.7, masks=None):
+    """
+    Same results per query as search_similar_metadata. Queries that need
+    the whole index (no keyword candidates) share a single batched search
+    of BATCH_OVERFETCH × top_k rows. Masked queries are post-filtered from
+    that and only re-searched alone when too few rows survive.
+    """
+    index = open_index(user_id)
+    if index is None:
+        print(" One or more required index files are missing.")
+        return [[] for _ in keywords_list]
+    masks = masks or [None] * len(keywords_list)
+
+    plans = []
+    for kws, mask in zip(keywords_list, masks):
+        cand = set()
+        for kw in kws:
+            cand |= set(index.postings(kw))
+        masked = mask is not None and len(mask) == index.ntotal
+        if masked:
+            cand = {i for i in cand if mask[i]}
+        plans.append((sorted(cand), mask if masked else None))
+
+    Q = np.asarray(q_embs, dtype=np.float32)
+    k = top_k * DEDUPE_OVERFETCH
+    full = [r for r, (cand, _) in enumerate(plans) if not cand]
+    shared = {}
+    if full:
+        kf = k if all(plans[r][1] is None for r in full) else k * BATCH_OVERFETCH
+        for r, hits in zip(full, index.search_batch(Q[full], min(kf, index.ntotal))):
+            shared[r] = hits
+
+    out = []
+    for r, (cand, mask) in enumerate(plans):
+        if cand:
+            hits = index.search(Q[r], k, ids=cand)
+        elif mask is None:
+            hits = shared[r][:k]
+        else:
+            hits = [(i, d) for i, d in shared[r] if mask[i]][:k]
+            if len(hits) < k:
+                hits = index.search(Q[r], k, ids=np.flatnonzero(mask))
+        out.append(_apply_threshold(index, hits, threshold, fallback_threshold, top_k))
+    return out
+
 
-    # Treshold application, 0.5 used
+def _apply_threshold(index, hits, threshold, fallback_threshold, top_k=None):
+    # Treshold application, 0.5 used; copies of one content keep the closest row
     hits.sort(key=lambda x: x[1])
-    results = []
+    results, seen = [], set()
     for i, dist in hits:
+        if top_k is not None and len(results) >= top_k:
+            break
         if dist <= threshold:
-            rec = mapping[i].copy()
+            rec = index.record(i)
+            key = doc_content_key(rec)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
             rec["_distance"] = float(dist)
             results.append(rec)
 
@@ -54,7 +192,7 @@ def search_similar_metadata(user_id, q_emb, query_keywords, top_k=5,
     if not results and hits:
         i_best, dist_best = hits[0]
         if dist_best <= fallback_threshold:
-            rec = mapping[i_best].copy()
+            rec = index.record(i_best)
             rec["_distance"] = float(dist_best)
             results.append(rec)     # else: leave results empty
 
@@ -0,0 +1,183 @@
+import os
+import json
+import mmap
+import fcntl
+import shutil
+import threading
+import numpy as np
+from bisect import bisect_left
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# INDEX_SERVING=shared: every worker maps one read-only copy of the index
+INDEX_SERVING = os.getenv("INDEX_SERVING", "local")
+KEEP_GENERATIONS = 2      # current + previous, so workers mid-swap keep a valid map
+
+# Layout of user_data/<id>/shared/:
+#   CURRENT                 generation number of the live artefacts
+#   gen-<n>/embeddings.npy  float32 (n, d), mmapped
+#   gen-<n>/norms.npy       float32 squared row norms for exact L2
+#   gen-<n>/mapping.ndjson  one metadata record per line
+#   gen-<n>/mapping_offsets.npy, inv_tokens.json, inv_offsets.npy, inv_postings.npy
+#   gen-<n>/filter_*.npy, filter_vocab.json   prefilter columns
+
+
+def shared_dir(user_id: str) -> str:
+    return f"user_data/{user_id}/shared"
+
+def current_generation(user_id: str) -> int:
+    try:
+        with open(f"{shared_dir(user_id)}/CURRENT") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+# Writer side, called by index_metadata
+def publish_index(user_id: str, embs: np.ndarray, mapping: list[dict],
+                  inverted: dict, filter_cols: dict | None = None) -> int:
+    """
+    Write a new generation next to the live one, then flip CURRENT.
+    Publishes for one user are serialised across processes by a lock
+    file: two workers rebuilding at once must not both pick gen-N and
+    rewrite arrays that readers already have mapped.
+    """
+    base = shared_dir(user_id)
+    os.makedirs(base, exist_ok=True)
+    with open(f"{base}/.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _publish_locked(base, user_id, embs, mapping, inverted, filter_cols)
+
+def _publish_locked(base, user_id, embs, mapping, inverted, filter_cols) -> int:
+    gen  = current_generation(user_id) + 1
+    out  = f"{base}/gen-{gen}"
+    os.makedirs(out, exist_ok=True)
+
+    embs = np.ascontiguousarray(embs, dtype=np.float32)
+    np.save(f"{out}/embeddings.npy", embs)
+    np.save(f"{out}/norms.npy", np.einsum("ij,ij->i", embs, embs))
+
+    offsets = np.zeros(len(mapping) + 1, dtype=np.int64)
+    with open(f"{out}/mapping.ndjson", "wb") as f:
+        for i, rec in enumerate(mapping):
+            line = (json.dumps(rec, separators=(",", ":")) + "\n").encode()
+            f.write(line)
+            offsets[i + 1] = offsets[i] + len(line)
+    np.save(f"{out}/mapping_offsets.npy", offsets)
+
+    tokens = sorted(inverted)
+    inv_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    for i, tok in enumerate(tokens):
+        inv_offsets[i + 1] = inv_offsets[i] + len(inverted[tok])
+    postings = np.fromiter((p for tok in tokens for p in inverted[tok]), dtype=np.int32, count=int(inv_offsets[-1]))
+    with open(f"{out}/inv_tokens.json", "w") as f:
+        json.dump(tokens, f)
+    np.save(f"{out}/inv_offsets.npy", inv_offsets)
+    np.save(f"{out}/inv_postings.npy", postings)
+
+    if filter_cols is not None:
+        for key in ("types", "mtime", "parent"):
+            np.save(f"{out}/filter_{key}.npy", filter_cols[key])
+        with open(f"{out}/filter_vocab.json", "w") as f:
+            json.dump([str(v) for v in filter_cols["vocab"]], f)
+
+    tmp = f"{base}/CURRENT.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(gen))
+    os.replace(tmp, f"{base}/CURRENT")
+
+    # old generations: already-mapped files stay readable after unlink
+    for name in os.listdir(base):
+        if name.startswith("gen-") and int(name[4:]) <= gen - KEEP_GENERATIONS:
+            shutil.rmtree(f"{base}/{name}", ignore_errors=True)
+    return gen
+
+
+# Reader side, one instance per process and generation
+class SharedIndex:
+    def __init__(self, path: str, gen: int):
+        self.gen      = gen
+        self.embs     = np.load(f"{path}/embeddings.npy", mmap_mode="r")
+        self.norms    = np.load(f"{path}/norms.npy", mmap_mode="r")
+        self.offsets  = np.load(f"{path}/mapping_offsets.npy", mmap_mode="r")
+        self.postings_arr = np.load(f"{path}/inv_postings.npy", mmap_mode="r")
+        self.inv_offsets  = np.load(f"{path}/inv_offsets.npy", mmap_mode="r")
+        with open(f"{path}/inv_tokens.json") as f:
+            self.tokens = json.load(f)
+        with open(f"{path}/mapping.ndjson", "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+        self.filters = None
+        if os.path.exists(f"{path}/filter_types.npy"):
+            with open(f"{path}/filter_vocab.json") as f:
+                vocab = json.load(f)
+            self.filters = {
+                "vocab":  vocab,
+                "types":  np.load(f"{path}/filter_types.npy", mmap_mode="r"),
+                "mtime":  np.load(f"{path}/filter_mtime.npy", mmap_mode="r"),
+                "parent": np.load(f"{path}/filter_parent.npy", mmap_mode="r"),
+            }
+
+    @property
+    def ntotal(self) -> int:
+        return self.embs.shape[0]
+
+    def record(self, i: int) -> dict:
+        return json.loads(self._map[self.offsets[i] : self.offsets[i + 1]])
+
+    def postings(self, token: str) -> list[int]:
+        j = bisect_left(self.tokens, token)
+        if j == len(self.tokens) or self.tokens[j] != token:
+            return []
+        return self.postings_arr[self.inv_offsets[j] : self.inv_offsets[j + 1]].tolist()
+
+    def search(self, qv: np.ndarray, k: int, ids: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """Exact squared-L2 top-k (same scores as IndexFlatL2), optionally over *ids* only."""
+        q = np.asarray(qv, dtype=np.float32).reshape(-1)
+        if ids is None:
+            d = self.norms - 2 * (self.embs @ q) + q @ q
+            rows = None
+        else:
+            rows = np.asarray(ids, dtype=np.int64)
+            d = self.norms[rows] - 2 * (self.embs[rows] @ q) + q @ q
+        k = min(k, len(d))
+        if k <= 0:
+            return []
+        top = np.argpartition(d, k - 1)[:k]
+        top = top[np.argsort(d[top])]
+        idxs = top if rows is None else rows[top]
+        return [(int(i), float(max(d[t], 0.0))) for i, t in zip(idxs, top)]
+
+    def search_batch(self, Q: np.ndarray, k: int, max_cells: int = 1 << 25) -> list[list[tuple[int, float]]]:
+        """Whole-index top-k for each row of *Q*; query rows are blocked so (nq × n) stays bounded."""
+        Q = np.asarray(Q, dtype=np.float32)
+        k = min(k, self.ntotal)
+        if k <= 0:
+            return [[] for _ in Q]
+        out, step = [], max(1, max_cells // max(self.ntotal, 1))
+        for s in range(0, len(Q), step):
+            q = Q[s : s + step]
+            d = self.norms[None, :] - 2 * (q @ self.embs.T) + np.einsum("ij,ij->i", q, q)[:, None]
+            top = np.argpartition(d, k - 1, axis=1)[:, :k]
+            for r in range(len(q)):
+                t = top[r][np.argsort(d[r, top[r]])]
+                out.append([(int(i), float(max(d[r, i], 0.0))) for i in t])
+        return out
+
+
+_cache, _cache_lock = {}, threading.Lock()
+
+def get_shared_index(user_id: str) -> SharedIndex | None:
+    """This process's view of the live generation; reopens after a rebuild."""
+    gen = current_generation(user_id)
+    if not gen:
+        return None
+    hit = _cache.get(user_id)
+    if hit and hit.gen == gen:
+        return hit
+    with _cache_lock:
+        hit = _cache.get(user_id)
+        if not hit or hit.gen != gen:
+            hit = _cache[user_id] = SharedIndex(f"{shared_dir(user_id)}/gen-{gen}", gen)
+    return hit
@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# TRACING=0 turns every stage() into a shared no-op context
+TRACING_ENABLED = os.getenv("TRACING", "1") != "0"
+METRIC_PREFIX   = "drive_copilot"
+
+# latency buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock       = threading.Lock()
+_histograms = {}     # stage -> [bucket counts..., +Inf count, sum]
+_counters   = {}     # (name, labels tuple) -> value
+_collectors = []     # callables returning {(name, labels tuple): value}
+
+# per-request stage timings, feeds the Server-Timing header
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def observe(stage: str, seconds: float):
+    with _lock:
+        h = _histograms.get(stage)
+        if h is None:
+            h = _histograms[stage] = [0] * (len(BUCKETS) + 2)
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                h[i] += 1
+                break
+        else:
+            h[len(BUCKETS)] += 1
+        h[-1] += seconds
+    trace = _current.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+def inc(name: str, value: float = 1, **labels):
+    if not TRACING_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def register_collector(fn):
+    """`fn()` -> {(name, labels tuple): value}, read at scrape time."""
+    _collectors.append(fn)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullStage()
+
+@contextmanager
+def _timed(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0)
+
+def stage(name: str):
+    """`with stage("query.embed"): ...` records the block's wall time."""
+    if not TRACING_ENABLED:
+        return _NULL
+    return _timed(name)
+
+
+# Per-request traces
+def start_trace():
+    """Begin collecting stage timings for this request; returns a reset token."""
+    if not TRACING_ENABLED:
+        return None
+    return _current.set([])
+
+def end_trace(token) -> list[tuple[str, float]]:
+    if token is None:
+        return []
+    trace = _current.get() or []
+    _current.reset(token)
+    return trace
+
+def server_timing(trace: list[tuple[str, float]]) -> str:
+    totals = {}
+    for name, secs in trace:
+        totals[name] = totals.get(name, 0.0) + secs
+    return ", ".join(f"{n.replace('.', '_')};dur={s * 1000:.1f}" for n, s in totals.items())
+
+
+# Prometheus text exposition
+def _fmt_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+def render_prometheus() -> str:
+    out = []
+    with _lock:
+        hists    = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    for fn in _collectors:
+        try:
+            counters.update(fn())
+        except Exception as e:
+            print("⚠️ metrics collector failed:", e)
+
+    hname = f"{METRIC_PREFIX}_stage_seconds"
+    out.append(f"# HELP {hname} Wall time spent per pipeline stage.")
+    out.append(f"# TYPE {hname} histogram")
+    for stage_name, h in sorted(hists.items()):
+        cum = 0
+        for b, n in zip(BUCKETS, h):
+            cum += n
+            out.append(f'{hname}_bucket{{stage="{stage_name}",le="{b}"}} {cum}')
+        cum += h[len(BUCKETS)]
+        out.append(f'{hname}_bucket{{stage="{stage_name}",le="+Inf"}} {cum}')
+        out.append(f'{hname}_sum{{stage="{stage_name}"}} {h[-1]:.6f}')
+        out.append(f'{hname}_count{{stage="{stage_name}"}} {cum}')
+
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        full = f"{METRIC_PREFIX}_{name}"
+        if full not in seen:
+            out.append(f"# TYPE {full} counter")
+            seen.add(full)
+        out.append(f"{full}{_fmt_labels(labels)} {value}")
+    return "\n".join(out) + "\n"
@@ -0,0 +1,288 @@
+"""
+Local stand-in for the Drive v3 REST API, serving a synthetic corpus.
+
+Supports `files.list` (pageSize / pageToken and the `q` clauses the backend
+sends), `alt=media` downloads with Range, and `files.export`. It can inject
+429s and latency. It also serves an OAuth stand-in at POST /token
+(grant_type=refresh_token) and Sheets `spreadsheets.get` (tab list only).
+Point the backend at it with DRIVE_API_BASE=<server.url>/drive/v3,
+SHEETS_API_BASE=<server.url>/v4 and GOOGLE_TOKEN_URL=<server.url>/token.
+"""
+import json
+import re
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from synth_drive import content_for, public_record, sheet_titles
+
+_CLAUSE = re.compile(
+    r"^(?P<neg>not\s+)?(?P<field>mimeType|modifiedTime|name)\s*"
+    r"(?P<op>contains|!=|>=|<=|=|<|>)\s*'(?P<val>[^']*)'$"
+)
+_PARENTS = re.compile(r"^'(?P<val>[^']*)'\s+in\s+parents$")
+_RANGE   = re.compile(r"bytes=(\d*)-(\d*)")
+
+_OPS = {
+    "=":  lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<":  lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">":  lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "contains": lambda a, b: b.lower() in a.lower(),
+}
+
+
+def compile_q(q: str):
+    """Turn a Drive `q` string (clauses joined by ' and ') into a predicate."""
+    preds = []
+    for clause in (c.strip() for c in q.split(" and ") if c.strip()):
+        if clause.replace(" ", "") == "trashed=false":
+            continue
+        if m := _PARENTS.match(clause):
+            preds.append(lambda r, v=m["val"]: v in r.get("parents", []))
+            continue
+        m = _CLAUSE.match(clause)
+        if not m:
+            raise ValueError(f"unsupported q clause: {clause}")
+        op, field, val, neg = _OPS[m["op"]], m["field"], m["val"], bool(m["neg"])
+        preds.append(lambda r, op=op, f=field, v=val, n=neg: op(r.get(f, ""), v) != n)
+    return lambda r: all(p(r) for p in preds)
+
+
+class FakeDrive:
+    """
+    Threaded HTTP server over an in-memory list of records.
+    error_rate: share of requests answered with 429 (Retry-After: 0).
+    latency_ms: added to every request.
+    strict_auth: only accept bearer tokens in `valid_tokens` or issued by
+    /token; the rest get 401, like an expired Google token.
+    fail_next() scripts the next GET answers (5xx, quota 403, Retry-After).
+    honour_range=False answers Range requests with 200 and the whole body.
+    drop_media_after: media downloads announce the full length but close
+    the connection after this many bytes.
+    """
+
+    def __init__(self, files: list[dict], port: int = 0, error_rate: float = 0.0,
+                 latency_ms: float = 0.0, seed: int = 0, strict_auth: bool = False,
+                 valid_tokens=(), token_ttl_s: int = 3600, honour_range: bool = True,
+                 drop_media_after: int | None = None):
+        self.files        = files
+        self.by_id        = {f["id"]: f for f in files}
+        self.error_rate   = error_rate
+        self.latency_s    = latency_ms / 1000.0
+        self.strict_auth  = strict_auth
+        self.valid_tokens = set(valid_tokens)
+        self.token_ttl_s  = token_ttl_s
+        self.honour_range = honour_range
+        self.drop_media_after = drop_media_after
+        self.stats        = {"requests": 0, "injected_429": 0, "bytes_sent": 0, "range_requests": 0,
+                             "token_refreshes": 0, "rejected_auth": 0}
+        self._rng         = random.Random(seed)
+        self._lock        = threading.Lock()
+        self._q_cache     = {}
+        self._content     = OrderedDict()    # small LRU of rendered bodies
+        self._scripted    = deque()          # (status, reason, retry_after) for the next GETs
+        self._server      = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread      = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeDrive":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail_next(self, status: int, times: int = 1, reason: str = "backendError",
+                  retry_after: str | None = None):
+        """Answer the next *times* GETs with *status* (and a Drive error *reason*)."""
+        with self._lock:
+            self._scripted.extend([(status, reason, retry_after)] * times)
+
+    # helpers used by the handler
+    def _filtered(self, q: str) -> list[dict]:
+        with self._lock:
+            hit = self._q_cache.get(q)
+        if hit is None:
+            pred = compile_q(q) if q else (lambda r: True)
+            hit = [r for r in self.files if pred(r)]
+            with self._lock:
+                self._q_cache[q] = hit
+        return hit
+
+    def _body(self, rec: dict, mime: str | None) -> bytes:
+        key = (rec.get("_seed", rec["id"]), mime or rec["mimeType"])
+        with self._lock:
+            if key in self._content:
+                self._content.move_to_end(key)
+                return self._content[key]
+        body = content_for(rec, mime)
+        with self._lock:
+            self._content[key] = body
+            while len(self._content) > 512:
+                self._content.popitem(last=False)
+        return body
+
+    def _should_throttle(self) -> bool:
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.stats["injected_429"] += 1
+                return True
+        return False
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, ctype: str = "application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+                with fake._lock:
+                    fake.stats["bytes_sent"] += len(body)
+
+            def _json(self, status: int, obj):
+                self._send(status, json.dumps(obj).encode())
+
+            def _error(self, status: int, msg: str, reason: str = "notFound"):
+                self._json(status, {"error": {"code": status, "message": msg,
+                                              "errors": [{"reason": reason, "message": msg}]}})
+
+            def do_GET(self):
+                if fake.latency_s:
+                    time.sleep(fake.latency_s)
+                with fake._lock:
+                    scripted = fake._scripted.popleft() if fake._scripted else None
+                    if scripted:
+                        fake.stats["requests"] += 1
+                if scripted:
+                    status, reason, retry_after = scripted
+                    body = json.dumps({"error": {"code": status, "message": reason,
+                                                 "errors": [{"reason": reason, "message": reason}]}}).encode()
+                    return self._send(status, body, headers={"Retry-After": retry_after} if retry_after else None)
+                if fake._should_throttle():
+                    self.send_response(429)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                auth = self.headers.get("Authorization", "")
+                if not auth.startswith("Bearer ") or (fake.strict_auth and auth[7:] not in fake.valid_tokens):
+                    with fake._lock:
+                        fake.stats["rejected_auth"] += 1
+                    return self._error(401, "Invalid Credentials", "authError")
+
+                url  = urlparse(self.path)
+                args = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                parts = url.path.rstrip("/").split("/")   # ['', 'drive', 'v3', 'files', id?, 'export'?]
+                if parts[1:3] == ["v4", "spreadsheets"] and len(parts) == 4:
+                    return self._sheets(parts[3])
+                if parts[1:4] != ["drive", "v3", "files"]:
+                    return self._error(404, "Not found")
+                if len(parts) == 4:
+                    return self._list(args)
+                rec = fake.by_id.get(parts[4])
+                if rec is None:
+                    return self._error(404, f"File not found: {parts[4]}")
+                if len(parts) == 6 and parts[5] == "export":
+                    return self._export(rec, args.get("mimeType", ""))
+                if args.get("alt") == "media":
+                    return self._media(rec)
+                return self._json(200, public_record(rec))
+
+            def do_POST(self):
+                if urlparse(self.path).path != "/token":
+                    return self._error(404, "Not found")
+                length = int(self.headers.get("Content-Length") or 0)
+                form = {k: v[-1] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                if form.get("grant_type") != "refresh_token" or not form.get("refresh_token"):
+                    return self._json(400, {"error": "invalid_grant"})
+                if fake.latency_s:
+                    time.sleep(fake.latency_s)
+                with fake._lock:
+                    fake.stats["token_refreshes"] += 1
+                    token = f"fake-access-{fake.stats['token_refreshes']}"
+                    fake.valid_tokens.add(token)
+                self._json(200, {"access_token": token, "expires_in": fake.token_ttl_s,
+                                 "token_type": "Bearer", "scope": "https://www.googleapis.com/auth/drive.readonly"})
+
+            def _list(self, args):
+                try:
+                    files = fake._filtered(args.get("q", ""))
+                except ValueError as e:
+                    return self._error(400, str(e), "invalidParameter")
+                size  = min(int(args.get("pageSize", 100)), 1000)
+                start = int(args.get("pageToken") or 0)
+                page  = [public_record(r) for r in files[start : start + size]]
+                out   = {"files": page}
+                if start + size < len(files):
+                    out["nextPageToken"] = str(start + size)
+                self._json(200, out)
+
+            def _sheets(self, fid):
+                rec = fake.by_id.get(fid)
+                if rec is None or rec["mimeType"] != "application/vnd.google-apps.spreadsheet":
+                    return self._error(404, f"Requested entity was not found: {fid}")
+                self._json(200, {"spreadsheetId": fid, "sheets": [
+                    {"properties": {"sheetId": i, "title": t}} for i, t in enumerate(sheet_titles(rec))]})
+
+            def _media(self, rec):
+                if rec["mimeType"].startswith("application/vnd.google-apps."):
+                    return self._error(403, "Only files with binary content can be downloaded.",
+                                       "fileNotDownloadable")
+                body = fake._body(rec, None)
+                if fake.drop_media_after is not None:
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body[: fake.drop_media_after])
+                    self.close_connection = True
+                    return
+                rng  = self.headers.get("Range")
+                m    = _RANGE.match(rng or "")
+                if not m or not fake.honour_range:
+                    return self._send(200, body, rec["mimeType"], {"Accept-Ranges": "bytes"})
+                with fake._lock:
+                    fake.stats["range_requests"] += 1
+                first = int(m[1]) if m[1] else max(len(body) - int(m[2] or 0), 0)
+                last  = min(int(m[2]), len(body) - 1) if m[1] and m[2] else len(body) - 1
+                if first >= len(body):
+                    return self._send(416, b"", headers={"Content-Range": f"bytes */{len(body)}"})
+                self._send(206, body[first : last + 1], rec["mimeType"], {
+                    "Content-Range": f"bytes {first}-{last}/{len(body)}",
+                    "Accept-Ranges": "bytes",
+                })
+
+            def _export(self, rec, mime):
+                if not rec["mimeType"].startswith("application/vnd.google-apps."):
+                    return self._error(403, "Export only supports Docs Editors files.",
+                                       "fileNotExportable")
+                try:
+                    body = fake._body(rec, mime)
+                except Exception as e:
+                    return self._error(400, f"Export to {mime} failed: {e}", "badRequest")
+                self._send(200, body, mime)
+
+        return Handler
@@ -0,0 +1,286 @@
+"""
+Offline benchmark: synthetic Drive + fake Drive server + stubbed LLM.
+
+For every corpus size it runs a fresh subprocess that
+  1. generates the corpus and serves it from a local FakeDrive,
+  2. times /drive/load_files and /drive/index_metadata,
+  3. fires a /query workload at the given concurrency,
+and records index-build time, peak RSS and query p50/p95/p99 + throughput.
+
+    python bench/run_bench.py --sizes 1000,10000 --queries 200 --concurrency 4 --out bench_results.json
+
+No Google account or OpenAI key is needed; the sentence-transformer model
+is still loaded for real so embedding cost is measured.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+BENCH_DIR   = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(os.path.dirname(BENCH_DIR), "backend")
+USER_ID     = "bench-user"
+
+
+# Deterministic stand-in for the OpenAI client
+class StubLLM:
+    """
+    Mimics `client.chat.completions.create`. Answers depend only on the
+    prompt, so runs are repeatable; `latency_ms` simulates network time.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_s = latency_ms / 1000.0
+        self.calls     = 0
+        self._lock     = threading.Lock()
+        self.chat      = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, max_tokens=150, temperature=0.0, **kw):
+        with self._lock:
+            self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        prompt = messages[-1]["content"]
+        m = re.search(r'Query: "(.*)"', prompt)
+        query = m.group(1) if m else ""
+
+        if "For each numbered user query" in prompt:
+            queries = re.findall(r'^\s*\d+\. "(.*)"$', prompt, re.M)
+            text = json.dumps([{**self._meta(q), "keywords": self._words(q)} for q in queries])
+        elif "Extract metadata" in prompt:
+            text = json.dumps(self._meta(query))
+        elif "meaningful keywords" in prompt:
+            text = json.dumps(self._words(query))
+        else:
+            text = f"Stub answer based on {len(prompt)} prompt characters."
+        msg = SimpleNamespace(content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)])
+
+    @staticmethod
+    def _words(query):
+        return [w for w in re.findall(r"[A-Za-z0-9]+", query) if len(w) > 3][:5]
+
+    @staticmethod
+    def _meta(query):
+        words = [w for w in re.findall(r"[A-Za-z0-9]+", query) if len(w) > 3]
+        kind = next((t for t in ("pdf", "spreadsheet", "presentation", "image", "folder")
+                     if t in query.lower()), None)
+        year = re.search(r"\b(20\d\d)\b", query)
+        return {"name": " ".join(words[:3]) or None, "type": kind,
+                "date": year.group(1) if year else None}
+
+
+def _percentile(xs: list[float], p: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    k = (len(xs) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+def _peak_rss_mb() -> float:
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return kb / 1024 if sys.platform != "darwin" else kb / 1024 / 1024
+
+def _make_queries(files: list[dict], n: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    docs    = [f for f in files if not f["mimeType"].startswith(("image/", "video/", "audio/"))]
+    folders = [f for f in files if f["mimeType"].endswith(".folder")]
+    out = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.6 and docs:
+            name = rng.choice(docs)["name"].rsplit(".", 1)[0]
+            out.append(rng.choice(["Summarize \"{}\"", "What does {} say about the budget?",
+                                   "Find the pdf {}", "Open {}"]).format(name))
+        elif r < 0.8 and folders:
+            out.append(f"Show me the folder {rng.choice(folders)['name']}")
+        else:
+            out.append(f"Any spreadsheet from {rng.randint(2015, 2025)} about {rng.choice(['budget', 'invoice', 'roadmap'])}?")
+    return out
+
+
+# One corpus size, run inside its own process
+def run_single(args) -> dict:
+    sys.path.insert(0, BENCH_DIR)
+    from synth_drive import generate_files
+    from fake_drive import FakeDrive
+
+    t0 = time.perf_counter()
+    files = generate_files(args.files, seed=args.seed)
+    gen_s = time.perf_counter() - t0
+
+    server = FakeDrive(files, error_rate=args.error_rate, latency_ms=args.drive_latency_ms).start()
+    workdir = tempfile.mkdtemp(prefix="drive-bench-")
+    os.chdir(workdir)
+    os.makedirs(f"user_data/{USER_ID}", exist_ok=True)
+    with open(f"user_data/{USER_ID}/tokens.json", "w") as f:
+        json.dump({"access_token": "bench-token", "refresh_token": "bench-refresh",
+                   "email": "bench@example.com", "expires_at": time.time() + 86400}, f)
+
+    # environment must be in place before the backend modules import
+    os.environ["DRIVE_API_BASE"] = f"{server.url}/drive/v3"
+    os.environ["SHEETS_API_BASE"] = f"{server.url}/v4"
+    os.environ["GOOGLE_TOKEN_URL"] = f"{server.url}/token"
+    os.environ.setdefault("OPENAI_API_KEY", "bench-stub")
+    # bench queries from one user are independent, not a user retyping
+    os.environ.setdefault("SCHED_CANCEL_STALE", "0")
+    sys.path.insert(0, BACKEND_DIR)
+    import query_handler
+    import main
+    from fastapi.testclient import TestClient
+
+    llm = StubLLM(args.llm_latency_ms)
+    query_handler.client = llm
+    client = TestClient(main.app)
+    rss_boot = _peak_rss_mb()
+
+    t0 = time.perf_counter()
+    r = client.get("/drive/load_files", params={"user_id": USER_ID, "force": True, "parallel": args.parallel})
+    load_s = time.perf_counter() - t0
+    assert r.status_code == 200, r.text
+
+    t0 = time.perf_counter()
+    r = client.get("/drive/index_metadata", params={"user_id": USER_ID, "force": True})
+    index_s = time.perf_counter() - t0
+    assert r.status_code == 200, r.text
+    rss_index = _peak_rss_mb()
+
+    queries = _make_queries(files, args.queries, args.seed)
+    lat, errors = [], 0
+    lock = threading.Lock()
+
+    def one(q):
+        nonlocal errors
+        t = time.perf_counter()
+        resp = client.post("/query", json={"user_id": USER_ID, "query": q})
+        dt = time.perf_counter() - t
+        with lock:
+            lat.append(dt)
+            if resp.status_code != 200:
+                errors += 1
+
+    # warm-up so the first model call isn't in the tail
+    one(queries[0])
+    lat.clear()
+    errors = 0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        list(ex.map(one, queries))
+    wall = time.perf_counter() - t0
+
+    # the same queries through /query/batch (ranked hits only)
+    calls0 = llm.calls
+    t0 = time.perf_counter()
+    r = client.post("/query/batch", json={"user_id": USER_ID, "queries": queries})
+    batch_s = time.perf_counter() - t0
+    assert r.status_code == 200, r.text
+    server.stop()
+
+    ms = [x * 1000 for x in lat]
+    return {
+        "files":          args.files,
+        "generate_s":     round(gen_s, 3),
+        "load_files_s":   round(load_s, 3),
+        "index_build_s":  round(index_s, 3),
+        "index_files_per_s": round(args.files / index_s, 1) if index_s else None,
+        "peak_rss_mb":    {"after_boot": round(rss_boot, 1), "after_index": round(rss_index, 1),
+                           "after_queries": round(_peak_rss_mb(), 1)},
+        "query": {
+            "count":          len(ms),
+            "concurrency":    args.concurrency,
+            "errors":         errors,
+            "p50_ms":         round(_percentile(ms, 50), 2),
+            "p95_ms":         round(_percentile(ms, 95), 2),
+            "p99_ms":         round(_percentile(ms, 99), 2),
+            "mean_ms":        round(sum(ms) / len(ms), 2) if ms else 0.0,
+            "throughput_qps": round(len(ms) / wall, 2) if wall else 0.0,
+        },
+        "batch": {
+            "count":          len(queries),
+            "elapsed_s":      round(batch_s, 3),
+            "throughput_qps": round(len(queries) / batch_s, 2) if batch_s else 0.0,
+            "llm_calls":      llm.calls - calls0,
+        },
+        "llm_calls":      calls0,
+        "fake_drive":     dict(server.stats),
+        "prefetch":       dict(main.prefetcher.stats),
+    }
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline Drive Copilot benchmark")
+    ap.add_argument("--sizes", default="1000,10000", help="comma separated corpus sizes (up to 1000000)")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--parallel", action="store_true", help="use the parallel Drive listing")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of fake Drive calls answered 429")
+    ap.add_argument("--drive-latency-ms", type=float, default=0.0)
+    ap.add_argument("--llm-latency-ms", type=float, default=0.0)
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--files", type=int, help=argparse.SUPPRESS)   # internal: single run
+    args = ap.parse_args()
+
+    if args.files:
+        print(json.dumps(run_single(args)))
+        return
+
+    runs = []
+    for n in (int(s) for s in args.sizes.split(",") if s.strip()):
+        cmd = [sys.executable, os.path.abspath(__file__), "--files", str(n),
+               "--queries", str(args.queries), "--concurrency", str(args.concurrency),
+               "--seed", str(args.seed), "--error-rate", str(args.error_rate),
+               "--drive-latency-ms", str(args.drive_latency_ms),
+               "--llm-latency-ms", str(args.llm_latency_ms)]
+        if args.parallel:
+            cmd.append("--parallel")
+        print(f"▶ {n} files …", flush=True)
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            runs.append({"files": n, "error": proc.stderr.strip().splitlines()[-1:]})
+            continue
+        run = json.loads(proc.stdout.strip().splitlines()[-1])
+        q = run["query"]
+        print(f"  index {run['index_build_s']}s · RSS {run['peak_rss_mb']['after_queries']} MB · "
+              f"p50 {q['p50_ms']} ms · p95 {q['p95_ms']} ms · p99 {q['p99_ms']} ms · {q['throughput_qps']} q/s · "
+              f"batch {run['batch']['throughput_qps']} q/s")
+        runs.append(run)
+
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_rev":   _git_rev(),
+            "python":    platform.python_version(),
+            "platform":  platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args":      {k: v for k, v in vars(args).items() if k != "files"},
+        },
+        "runs": runs,
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
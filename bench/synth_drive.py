@@ -0,0 +1,205 @@
+"""
+Synthetic Google Drive corpora for benchmarking.
+
+`generate_files(n)` returns Drive `files.list` records (id, name, mimeType,
+modifiedTime, parents, links, size, md5Checksum) laid out in a folder tree.
+`content_for(rec, mime)` renders deterministic file bytes (PDF, DOCX, CSV,
+XLSX, PPTX, text) so the fake server can serve downloads and exports.
+
+    python bench/synth_drive.py --files 100000 --out drive_files.json
+"""
+import argparse
+import hashlib
+import io
+import json
+import random
+from datetime import datetime, timedelta
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+# (mimeType, extension, weight)
+MIME_MIX = [
+    ("application/vnd.google-apps.document",      "",     12),
+    ("application/vnd.google-apps.spreadsheet",   "",     6),
+    ("application/vnd.google-apps.presentation",  "",     4),
+    ("application/pdf",                           "pdf",  14),
+    ("application/vnd.openxmlformats-officedocument.wordprocessingml.document", "docx", 6),
+    ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",       "xlsx", 3),
+    ("application/vnd.openxmlformats-officedocument.presentationml.presentation", "pptx", 2),
+    ("text/csv",                                  "csv",  4),
+    ("text/plain",                                "txt",  4),
+    ("image/jpeg",                                "jpg",  25),
+    ("image/png",                                 "png",  8),
+    ("video/mp4",                                 "mp4",  3),
+    ("audio/mpeg",                                "mp3",  1),
+    ("application/zip",                           "zip",  2),
+]
+FOLDER_SHARE = 0.05     # share of records that are folders
+CLONE_SHARE  = 0.04     # share of binary files that are copies of another file
+
+PROJECTS = ["Apollo", "Ophthmate", "Falcon", "Nimbus", "Orion", "Helix", "Quartz", "Zephyr",
+            "Atlas", "Beacon", "Cedar", "Delta", "Ember", "Fjord", "Granite", "Harbor"]
+DOC_KINDS = ["Report", "Proposal", "Notes", "Budget", "Roadmap", "Invoice", "Summary", "Plan",
+             "Minutes", "Review", "Timeline", "Specs", "Research", "Draft", "Analysis", "Resume"]
+PEOPLE = ["Soham Agarwal", "Priya Shah", "Alex Kim", "Maria Lopez", "Chen Wei", "Omar Haddad",
+          "Lena Fischer", "Kofi Mensah"]
+FOLDER_NAMES = ["Projects", "Finance", "Personal", "Archive", "Shared", "Clients", "School",
+                "Photos", "Taxes", "Research", "Design", "Travel", "Work", "Receipts"]
+WORDS = ("retina screening model accuracy budget revenue forecast quarterly customer onboarding "
+         "diabetic patients clinic rollout hiring roadmap milestone design review latency cost "
+         "survey results india deployment training dataset annotation pipeline contract invoice "
+         "payment schedule travel itinerary meeting agenda decision action owner deadline").split()
+
+BASE_TIME = datetime(2014, 1, 1)
+SPAN_DAYS = 12 * 365
+
+
+def _rng_for(key: str) -> random.Random:
+    return random.Random(int(hashlib.md5(key.encode()).hexdigest()[:16], 16))
+
+def _file_name(rng: random.Random, ext: str, mime: str) -> str:
+    if mime.startswith("image/"):
+        base = rng.choice([f"IMG_{rng.randint(1000, 9999)}", f"Screenshot {rng.randint(2015, 2025)}-0{rng.randint(1, 9)}",
+                           f"{rng.choice(PROJECTS)} photo {rng.randint(1, 99)}"])
+    elif mime.startswith(("video/", "audio/")):
+        base = f"{rng.choice(PROJECTS)} {rng.choice(['demo', 'recording', 'call', 'party'])} {rng.randint(1, 40)}"
+    elif rng.random() < 0.1:
+        base = f"Resume - {rng.choice(PEOPLE)}"
+    else:
+        base = f"{rng.choice(PROJECTS)} {rng.choice(DOC_KINDS)} {rng.randint(2015, 2025)}"
+        if rng.random() < 0.3:
+            base += f" v{rng.randint(1, 5)}"
+    return f"{base}.{ext}" if ext else base
+
+def generate_files(n: int, seed: int = 7) -> list[dict]:
+    """n Drive records: ~5% folders forming a tree under 'root', rest files."""
+    rng     = random.Random(seed)
+    mimes   = [m for m, _, _ in MIME_MIX]
+    exts    = {m: e for m, e, _ in MIME_MIX}
+    weights = [w for _, _, w in MIME_MIX]
+    folders = ["root"]
+    binaries = []
+    out = []
+
+    for i in range(n):
+        fid = f"f{i:07d}"
+        modified = BASE_TIME + timedelta(days=rng.random() * SPAN_DAYS)
+        parent = folders[min(int(rng.paretovariate(1.2)) - 1, len(folders) - 1)] if rng.random() < 0.5 \
+            else rng.choice(folders)
+        rec = {
+            "id":           fid,
+            "mimeType":     None,
+            "modifiedTime": modified.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "parents":      [parent],
+            "webViewLink":  f"https://drive.google.com/file/d/{fid}/view",
+        }
+        if i < 3 or rng.random() < FOLDER_SHARE:
+            rec["mimeType"] = FOLDER_MIME
+            rec["name"] = f"{rng.choice(FOLDER_NAMES)} {rng.choice(PROJECTS)}" if rng.random() < 0.7 \
+                else rng.choice(FOLDER_NAMES)
+            rec["webViewLink"] = f"https://drive.google.com/drive/folders/{fid}"
+            folders.append(fid)
+            out.append(rec)
+            continue
+
+        mime = rng.choices(mimes, weights)[0]
+        rec["mimeType"] = mime
+        rec["name"] = _file_name(rng, exts[mime], mime)
+        rec["_seed"] = fid
+        if not mime.startswith("application/vnd.google-apps."):
+            # copies keep the content (and md5) of an earlier file under a new name / folder
+            if binaries and rng.random() < CLONE_SHARE:
+                src = rng.choice(binaries)
+                rec["mimeType"], rec["_seed"] = src["mimeType"], src["_seed"]
+                rec["name"] = src["name"].rsplit(".", 1)[0] + f" ({rng.randint(1, 3)})." + src["name"].rsplit(".", 1)[-1]
+            rec["size"] = str(int(rng.lognormvariate(11.5, 1.6)))
+            if rec["_seed"] != fid:
+                rec["size"] = src["size"]
+            rec["md5Checksum"] = hashlib.md5(rec["_seed"].encode()).hexdigest()
+            binaries.append(rec)
+        if mime.startswith(("image/", "video/")):
+            rec["thumbnailLink"] = f"https://lh3.googleusercontent.com/d/{fid}=s220"
+        out.append(rec)
+    return out
+
+def public_record(rec: dict) -> dict:
+    """Drop the generator's private keys before handing a record out."""
+    return {k: v for k, v in rec.items() if not k.startswith("_")}
+
+
+# Content rendering
+def _paragraphs(rng: random.Random, n: int) -> list[str]:
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + "."
+            for _ in range(n)]
+
+def _table(rng: random.Random, rows: int = 40):
+    import pandas as pd
+    return pd.DataFrame({
+        "date":    [f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" for _ in range(rows)],
+        "item":    [rng.choice(WORDS) for _ in range(rows)],
+        "owner":   [rng.choice(PEOPLE) for _ in range(rows)],
+        "amount":  [round(rng.uniform(10, 5000), 2) for _ in range(rows)],
+    })
+
+def sheet_titles(rec: dict) -> list[str]:
+    """Tabs of a spreadsheet record; about half the Google Sheets have one."""
+    if rec["mimeType"] == "application/vnd.google-apps.spreadsheet" and _rng_for(rec["id"] + "/tabs").random() < 0.5:
+        return ["Sheet1"]
+    return ["Summary", "Details"]
+
+def content_for(rec: dict, mime: str | None = None) -> bytes:
+    """Deterministic bytes for *rec* rendered as *mime* (defaults to its own type)."""
+    mime = mime or rec["mimeType"]
+    rng  = _rng_for(rec.get("_seed", rec["id"]))
+    title = rec["name"].rsplit(".", 1)[0]
+
+    if mime in ("text/plain", "application/vnd.google-apps.document"):
+        return (title + "\n\n" + "\n\n".join(_paragraphs(rng, 12))).encode()
+    if mime == "text/csv":
+        return _table(rng).to_csv(index=False).encode()
+    if mime == "application/pdf":
+        import fitz
+        doc = fitz.open()
+        for para in [title] + _paragraphs(rng, 10):
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), para, fontsize=11)
+        return doc.tobytes()
+    if mime.endswith("wordprocessingml.document"):
+        from docx import Document
+        d = Document()
+        d.add_heading(title, 1)
+        for para in _paragraphs(rng, 10):
+            d.add_paragraph(para)
+        buf = io.BytesIO()
+        d.save(buf)
+        return buf.getvalue()
+    if mime.endswith("spreadsheetml.sheet"):
+        import pandas as pd
+        buf = io.BytesIO()
+        with pd.ExcelWriter(buf, engine="openpyxl") as xw:
+            for name in sheet_titles(rec):
+                _table(rng).to_excel(xw, sheet_name=name, index=False)
+        return buf.getvalue()
+    if mime.endswith("presentationml.presentation"):
+        from pptx import Presentation
+        prs = Presentation()
+        for para in _paragraphs(rng, 6):
+            slide = prs.slides.add_slide(prs.slide_layouts[1])
+            slide.shapes.title.text = title
+            slide.placeholders[1].text = para
+        buf = io.BytesIO()
+        prs.save(buf)
+        return buf.getvalue()
+    # media / archives: opaque bytes
+    return rng.randbytes(4096)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Write a synthetic drive_files.json")
+    ap.add_argument("--files", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", default="drive_files.json")
+    args = ap.parse_args()
+    with open(args.out, "w") as f:
+        json.dump([public_record(r) for r in generate_files(args.files, args.seed)], f, separators=(",", ":"))
+    print(f"Wrote {args.files} records to {args.out}")
@@ -1,18 +1,50 @@
 import streamlit as st
 import requests, webbrowser, os
 import streamlit.components.v1 as components
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 #url
 BACKEND = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+# (connect, read) seconds; a query can wait on downloads + the LLM
+TIMEOUT       = (3.05, 30)
+QUERY_TIMEOUT = (3.05, 180)
+HISTORY_SHOWN = 6              # latest turns drawn in full, older ones collapsed
+
 st.set_page_config(page_title="Drive Copilot", layout="centered")
-st.title("🤖 Google Drive Copilot")
+st.title("🤖 Google Drive Copilot")
+
+# one pooled session per server process, shared across reruns and users
+@st.cache_resource
+def http() -> requests.Session:
+    s = requests.Session()
+    # only idempotent calls are retried, a POST /query is never sent twice
+    retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods={"GET"})
+    s.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+    s.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+    return s
+
+def api_get(path, **params):
+    return http().get(f"{BACKEND}{path}", params=params, timeout=TIMEOUT)
+
+def api_post(path, timeout=TIMEOUT, **kw):
+    return http().post(f"{BACKEND}{path}", timeout=timeout, **kw)
+
+# idempotent reads: cached briefly, cleared when a job changes the answer
+@st.cache_data(ttl=30, show_spinner=False)
+def drive_status(user_id):
+    try:
+        r = api_get("/drive/status", user_id=user_id)
+        return r.json() if r.status_code == 200 else {}
+    except requests.RequestException:
+        return {}
 
 # session state management
 if "user_id"   not in st.session_state: st.session_state.user_id   = None
 if "meta_ok"   not in st.session_state: st.session_state.meta_ok   = False
 if "index_ok"  not in st.session_state: st.session_state.index_ok  = False
-if "history"   not in st.session_state: st.session_state.history   = []  # list[dict(q,a)]
+if "history"   not in st.session_state: st.session_state.history   = []  # list[dict(q,a,sources)]
 
 # capturing user credentials
 params = st.query_params
@@ -30,55 +62,167 @@ if not st.session_state.user_id:
         st.info("A browser tab opened. Complete consent; you’ll return here automatically.")
     st.stop()
 
+# skip steps the backend has already done for this user (not while re-indexing)
+if not st.session_state.index_ok and not st.session_state.get("reindex"):
+    status = drive_status(st.session_state.user_id)
+    st.session_state.meta_ok  = st.session_state.meta_ok or status.get("metadata", False)
+    st.session_state.index_ok = status.get("indexed", False) and st.session_state.meta_ok
+
 # sidebar logic
 with st.sidebar:
     st.write(f"Logged in as the user: {st.session_state.user_id}")
+    if st.button("🔄 Reload / re-index files"):
+        st.session_state.meta_ok = st.session_state.index_ok = False
+        st.session_state.reindex = True
+        drive_status.clear()
+        st.rerun()
     if st.button("🚪 Logout"):
+        drive_status.clear()
         for k in list(st.session_state.keys()):
             del st.session_state[k]
         st.rerun()
 
+# Background job helpers: submit, then poll /jobs/{id} from a fragment
+JOB_DONE = {"done", "failed", "cancelled"}
+
+def job_label(job):
+    label = f"{job['phase']} – {job['done']}" + (f"/{job['total']}" if job.get("total") else "")
+    if job.get("items_per_s"):
+        label += f" · {job['items_per_s']:.0f}/s"
+    if job.get("eta_s") is not None:
+        label += f" · ETA {job['eta_s']:.0f}s"
+    return label
+
+def submit_job(kind, **params):
+    try:
+        r = api_post(f"/jobs/{kind}", params={"user_id": st.session_state.user_id, **params})
+        st.session_state[f"{kind}_job"] = r.json()["job_id"]
+    except (requests.RequestException, ValueError, KeyError) as e:
+        st.session_state[f"{kind}_result"] = {"status": "failed", "error": f"Could not start job: {e}"}
+    st.rerun()
+
+@st.fragment(run_every=1)
+def job_progress(kind):
+    """Re-runs on its own every second; only the whole page reruns when the job ends."""
+    job_id = st.session_state.get(f"{kind}_job")
+    if not job_id:
+        return
+    try:
+        r = api_get(f"/jobs/{job_id}")
+        job = r.json() if r.status_code == 200 else {"status": "failed", "error": r.json()}
+    except (requests.RequestException, ValueError) as e:
+        st.caption(f"⏳ waiting for backend… ({e.__class__.__name__})")
+        return
+    if job["status"] in JOB_DONE:
+        del st.session_state[f"{kind}_job"]
+        st.session_state[f"{kind}_result"] = job
+        drive_status.clear()
+        st.rerun()
+    frac = min(job["done"] / job["total"], 1.0) if job.get("total") else 0.0
+    st.progress(frac, text=job_label(job))
+    if st.button("✖ Cancel", key=f"cancel_{kind}"):
+        api_post(f"/jobs/{job_id}/cancel")
+
 # Metadata + indexing logic
 if not st.session_state.index_ok:
     st.subheader("Load your Drive files")
     st.markdown("Use the options below to load and index your Drive files. Force reload if new files were added.")
+    reindex = st.session_state.get("reindex", False)
 
     # Metadata logic
-    meta_ct = st.container()
     if not st.session_state.meta_ok:
-        force_meta = meta_ct.checkbox("Force reload in case you added files", key="force_meta")
-        if meta_ct.button("⬇️ Load Drive file metadata", key="load_meta_btn"):
-            meta_ct.empty()  # hide UI during long call
-            r = requests.get(f"{BACKEND}/drive/load_files",
-                             params={"user_id": st.session_state.user_id, "force": force_meta})
-            if r.status_code == 200:
-                st.session_state.meta_ok = True
-                st.success(r.json().get("message", "Metadata loaded."))
-            else:
-                st.error(r.json()); st.stop()
+        job = st.session_state.pop("load_files_result", None)
+        if job and job["status"] == "done":
+            st.session_state.meta_ok = True
+            st.success(job["result"].get("message", "Metadata loaded."))
+        elif "load_files_job" in st.session_state:
+            job_progress("load_files")
+        else:
+            if job and job["status"] == "cancelled":
+                st.info("Metadata load cancelled.")
+            elif job:
+                st.error(job["error"])
+            force_meta = st.checkbox("Force reload in case you added files", value=reindex, key="force_meta")
+            parallel   = st.checkbox("Large drive: list in parallel", key="parallel_meta")
+            if st.button("⬇️ Load Drive file metadata", key="load_meta_btn"):
+                submit_job("load_files", force=force_meta, parallel=parallel)
 
     # Indexing logic
     if st.session_state.meta_ok and not st.session_state.index_ok:
-        idx_ct = st.container()
-        force_idx = idx_ct.checkbox("force re-index in case you added files", key="force_idx")
-        if idx_ct.button("⚙️ Build / Verify index", key="build_idx_btn"):
-            idx_ct.empty()
-            r = requests.get(f"{BACKEND}/drive/index_metadata",
-                             params={"user_id": st.session_state.user_id, "force": force_idx})
-            if r.status_code == 200 and any(k in r.json().get("message", "") for k in ("Indexed", "already exists")):
-                st.session_state.index_ok = True
-                st.success(r.json()["message"])
-            else:
-                st.error(r.json()); st.stop()
+        job = st.session_state.pop("index_metadata_result", None)
+        msg = ((job or {}).get("result") or {}).get("message", "")
+        if job and job["status"] == "done" and any(k in msg for k in ("Indexed", "already exists")):
+            st.session_state.index_ok = True
+            st.session_state.pop("reindex", None)
+            st.success(msg)
+        elif "index_metadata_job" in st.session_state:
+            job_progress("index_metadata")
+        else:
+            if job and job["status"] == "cancelled":
+                st.info("Indexing cancelled.")
+            elif job:
+                st.error(job.get("error") or job)
+            force_idx = st.checkbox("force re-index in case you added files", value=reindex, key="force_idx")
+            if st.button("⚙️ Build / Verify index", key="build_idx_btn"):
+                submit_job("index_metadata", force=force_idx)
 
 # chat ui logic
+ICON = {
+    "pdf": "📄", "google_doc": "📄", "text": "📄", "docx": "📄",
+    "spreadsheet": "📊", "google_sheet": "📊", "xlsx": "📊", "csv": "📊",
+    "presentation": "📽️", "google_slide": "📽️", "pptx": "📽️",
+    "image": "🖼️", "video": "🎞️", "audio": "🎧",
+    "folder": "📁"
+}
+
+def render_sources(sources, previews):
+    """Link list; media iframes only for the newest answer (`previews`)."""
+    if not sources:
+        return
+    st.markdown("**Sources**")
+    for s in sources:
+        ico   = ICON.get(s["type"], "📦")
+        link  = s.get("link")
+
+        if previews and s["type"] in ("image", "video"):
+            # Build the common iframe URL
+            preview_url = f"https://drive.google.com/file/d/{s['id']}/preview"
+            # Add autoplay only for videos
+            allow_attr = " allow=\"autoplay\"" if s["type"] == "video" else ""
+            # Define your dimensions (tweak as needed)
+            width, height = 640, 360
+            iframe = f"""
+            <iframe src="{preview_url}"
+                    width="{width}" height="{height}"{allow_attr}
+                    frameborder="0"></iframe>"""
+            # Streamlit will render it
+            components.html(iframe, height=height + 20)
+        else:
+            st.markdown(f"- {ico} [{s['name']}]({link})" if link else f"- {ico} {s['name']}")
+        if copies := s.get("copies"):
+            # identical copies elsewhere in the drive
+            where = ", ".join(f"[{c.get('path') or c['name']}]({c['link']})" if c.get("link")
+                              else (c.get("path") or c["name"]) for c in copies)
+            st.caption(f"{len(copies)} identical copies: {where}")
+
+def render_turn(h, previews=False):
+    with st.chat_message("user"):      st.markdown(h["q"])
+    with st.chat_message("assistant"):
+        st.markdown(h["a"])
+        render_sources(h.get("sources", []), previews)
+
 if st.session_state.index_ok:
     st.subheader("💬 Chat with your Drive")
 
-    # Show history
-    for h in st.session_state.history:
-        with st.chat_message("user"):      st.markdown(h["q"])
-        with st.chat_message("assistant"): st.markdown(h["a"])
+    # Show history: older turns collapsed, so a rerun draws a handful of messages
+    history = st.session_state.history
+    older, recent = history[:-HISTORY_SHOWN], history[-HISTORY_SHOWN:]
+    if older:
+        with st.expander(f"Earlier messages ({len(older)})"):
+            for h in older:
+                st.markdown(f"**You:** {h['q']}\n\n{h['a']}")
+    for i, h in enumerate(recent):
+        render_turn(h, previews=(i == len(recent) - 1))
 
     # Input
     user_q = st.chat_input("Ask about your files or folders…")
@@ -90,47 +234,28 @@ if st.session_state.index_ok:
             payload = {
                 "user_id": st.session_state.user_id,
                 "query":   user_q,
-                "history": st.session_state.history[-5:],
+                "history": [{"q": h["q"], "a": h["a"]} for h in history[-5:]],
             }
-            r = requests.post(f"{BACKEND}/query", json=payload)
+            try:
+                r = api_post("/query", timeout=QUERY_TIMEOUT, json=payload)
+            except requests.RequestException as e:
+                r = None
+                answer_box.error(f"Backend unreachable: {e}")
 
-        if r.status_code == 200 and "answer" in r.json():
+        if r is not None and r.status_code == 200 and "answer" in r.json():
             data    = r.json()
             answer  = data["answer"]
             sources = data.get("sources", [])
-            
-            ICON = {
-                "pdf": "📄", "google_doc": "📄", "text": "📄",
-                "spreadsheet": "📊", "presentation": "📽️",
-                "image": "🖼️", "video": "🎞️", "audio": "🎧",
-                "folder": "📁"
-            }
-            
+
             with answer_box.container():
-                st.markdown(answer)
-                if sources:
-                    st.markdown("**Sources**")
-                    for s in sources:
-                        ico   = ICON.get(s["type"], "📦")
-                        link  = s.get("link")
-                        thumb = s.get("thumb")
-
-                        if s["type"] in ("image", "video"):
-                            # Build the common iframe URL
-                            preview_url = f"https://drive.google.com/file/d/{s['id']}/preview"
-                            # Add autoplay only for videos
-                            allow_attr = " allow=\"autoplay\"" if s["type"] == "video" else ""
-                            # Define your dimensions (tweak as needed)
-                            width, height = 640, 360
-                            iframe = f"""
-                            <iframe src="{preview_url}"
-                                    width="{width}" height="{height}"{allow_attr}
-                                    frameborder="0"></iframe>"""
-                            # Streamlit will render it
-                            components.html(iframe, height=height + 20)
-                        else:
-                            st.markdown(f"- {ico} [{s['name']}]({link})" if link else f"- {ico} {s['name']}")
-
-            st.session_state.history.append({"q": user_q, "a": answer})
-        else:
+                with st.chat_message("assistant"):
+                    st.markdown(answer)
+                    render_sources(sources, previews=True)
+
+            st.session_state.history.append({"q": user_q, "a": answer, "sources": sources})
+        elif r is not None and r.status_code == 429:
+            answer_box.warning("⏳ The assistant is busy right now – please ask again in a moment.")
+        elif r is not None and r.status_code == 409:
+            pass                     # superseded by a newer question from this session
+        elif r is not None:
             answer_box.error(f"Backend error {r.status_code}: {r.text}")
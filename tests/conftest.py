@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# backend modules import each other by bare name, the fake Drive lives in bench/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "backend"), os.path.join(ROOT, "bench")]
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture
+def fake_drive():
+    """A FakeDrive serving two small text files, stopped after the test."""
+    from fake_drive import FakeDrive
+    files = [
+        {"id": "csv1", "name": "table.csv", "mimeType": "text/csv",
+         "modifiedTime": "2024-01-01T00:00:00.000Z", "parents": ["root"]},
+        {"id": "txt1", "name": "notes.txt", "mimeType": "text/plain",
+         "modifiedTime": "2024-01-01T00:00:00.000Z", "parents": ["root"]},
+    ]
+    server = FakeDrive(files).start()
+    yield server
+    server.stop()
@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from credentials import CredentialManager, tokens_path
+from drive_client import DriveClient
+
+
+@pytest.fixture
+def tokens(tmp_path, monkeypatch):
+    """Write user u's tokens.json in a scratch cwd."""
+    monkeypatch.chdir(tmp_path)
+
+    def write(access_token, expires_in, refresh_token="refresh-u"):
+        os.makedirs(os.path.dirname(tokens_path("u")), exist_ok=True)
+        with open(tokens_path("u"), "w") as f:
+            json.dump({"access_token": access_token, "refresh_token": refresh_token,
+                       "expires_at": time.time() + expires_in}, f)
+    return write
+
+
+def test_fresh_token_is_served_from_cache(tokens, fake_drive):
+    tokens("valid", 3600)
+    cm = CredentialManager(token_url=f"{fake_drive.url}/token")
+    assert cm.get_access_token("u") == "valid"
+    assert cm.get_access_token("u") == "valid"
+    assert cm.stats["loads"] == 1 and fake_drive.stats["token_refreshes"] == 0
+
+
+def test_token_near_expiry_is_refreshed_and_persisted(tokens, fake_drive):
+    tokens("old", 60)                  # inside TOKEN_REFRESH_SKEW_S
+    cm = CredentialManager(token_url=f"{fake_drive.url}/token")
+    new = cm.get_access_token("u")
+    assert new.startswith("fake-access-")
+    with open(tokens_path("u")) as f:
+        saved = json.load(f)
+    assert saved["access_token"] == new and saved["refresh_token"] == "refresh-u"
+
+
+def test_concurrent_expiry_refreshes_once(tokens, fake_drive):
+    tokens("old", 60)
+    cm = CredentialManager(token_url=f"{fake_drive.url}/token")
+    got, start = [], threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        got.append(cm.get_access_token("u"))
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert fake_drive.stats["token_refreshes"] == 1
+    assert len(set(got)) == 1
+
+
+def test_concurrent_401s_trigger_one_refresh(tokens, fake_drive):
+    # the stored token looks valid, but Drive no longer accepts it
+    tokens("revoked", 3600)
+    fake_drive.strict_auth = True
+    cm = CredentialManager(token_url=f"{fake_drive.url}/token")
+    client = DriveClient(base=f"{fake_drive.url}/drive/v3")
+    client.on_unauthorized = cm.force_refresh
+    stale = cm.get_access_token("u")
+
+    codes, start = [], threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        codes.append(client.get("/files", stale, user_id="u").status_code)
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert codes == [200] * 8
+    assert fake_drive.stats["token_refreshes"] == 1
+    assert client.stats["reauths"] == 8
+
+
+def test_failed_refresh_keeps_old_token_until_expiry(tokens, fake_drive):
+    tokens("old", 60, refresh_token="")   # nothing to refresh with
+    cm = CredentialManager(token_url=f"{fake_drive.url}/token")
+    assert cm.get_access_token("u") == "old"
+    tokens("gone", -1, refresh_token="")
+    cm.forget("u")
+    assert cm.get_access_token("u") is None
@@ -0,0 +1,101 @@
+import os
+import threading
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("sentence_transformers")    # response imports the embedding model
+import response
+from response import MB, download_file, parse_budgets
+
+
+@pytest.fixture
+def drive_at(fake_drive, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(response.drive, "base", f"{fake_drive.url}/drive/v3")
+    yield fake_drive
+    # background cache writes use relative paths: finish them before leaving tmp_path
+    response._persist_pool.submit(lambda: None).result()
+
+
+def body_of(server, file_id):
+    return server._body(server.by_id[file_id], None)
+
+
+def downloads(uid="u"):
+    d = f"user_data/{uid}/downloads"
+    return sorted(os.listdir(d)) if os.path.isdir(d) else []
+
+
+def test_range_head_is_cut_to_last_full_line(drive_at):
+    body = body_of(drive_at, "csv1")
+    assert len(body) > 300
+    src = download_file("csv1", "u", "tok", max_bytes=300, head=True)
+    data = src.getvalue()
+    assert isinstance(src, BytesIO)
+    assert drive_at.stats["range_requests"] == 1
+    assert 0 < len(data) <= 300 and data.endswith(b"\n")
+    assert body.startswith(data)
+
+
+def test_head_when_server_ignores_range(fake_drive, drive_at):
+    fake_drive.honour_range = False
+    body = body_of(fake_drive, "csv1")
+    data = download_file("csv1", "u", "tok", max_bytes=300, head=True).getvalue()
+    assert fake_drive.stats["range_requests"] == 0
+    assert 0 < len(data) <= 300 and data.endswith(b"\n")
+    assert body.startswith(data)
+
+
+def test_over_budget_stream_is_abandoned(drive_at):
+    assert download_file("txt1", "u", "tok", max_bytes=100) is None
+    assert downloads() == []                     # no .part left behind
+
+
+def test_within_budget_lands_on_disk(drive_at):
+    path = download_file("txt1", "u", "tok", max_bytes=1 * MB)
+    with open(path, "rb") as f:
+        assert f.read() == body_of(drive_at, "txt1")
+    assert downloads() == ["txt1"]
+
+
+def test_budget_overrides_skip_malformed_items():
+    assert parse_budgets("pdf=100, csv=0.5") == {"pdf": 100 * MB, "csv": MB // 2}
+    assert parse_budgets("pdf,docx=,xlsx=1=2,pptx=abc,text=-1,=3,csv=inf") == {}
+
+
+def _counter(name, **labels):
+    from tracing import _counters
+    return _counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def test_cache_hits_are_not_counted_as_transfer(drive_at):
+    before = _counter("fetched_bytes_total", type="text", via="download")
+    cached = _counter("cache_read_bytes_total", type="text")
+    path = download_file("txt1", "u", "tok", md5="abc", kind="text")
+    size = os.path.getsize(path)
+    # a copy with the same md5 is served from the content-addressed cache
+    assert download_file("txt1-copy", "u", "tok", md5="abc", kind="text") == path
+    assert _counter("fetched_bytes_total", type="text", via="download") - before == size
+    assert _counter("cache_read_bytes_total", type="text") - cached == size
+
+
+def test_concurrent_copies_of_one_content(drive_at):
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(download_file("txt1", "u", "tok", md5="same")))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert out == ["user_data/u/downloads/md5-same"] * 8
+    with open(out[0], "rb") as f:
+        assert f.read() == body_of(drive_at, "txt1")
+    assert downloads() == ["md5-same"]           # every temp file renamed or gone
+
+
+@pytest.mark.parametrize("size", [None, 10 * MB])      # streamed to disk / kept in memory
+def test_connection_dropped_mid_stream(drive_at, size):
+    drive_at.drop_media_after = 10
+    assert download_file("txt1", "u", "tok", size=size) is None
+    assert downloads() == []
@@ -0,0 +1,74 @@
+import pytest
+import requests
+
+import drive_client
+from drive_client import DriveClient, TokenBucket
+
+
+@pytest.fixture
+def client(fake_drive, monkeypatch):
+    # keep the backoff real but tiny, record what was slept
+    slept = []
+    monkeypatch.setattr(drive_client, "DRIVE_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(drive_client.time, "sleep", slept.append)
+    c = DriveClient(base=f"{fake_drive.url}/drive/v3")
+    c.slept = slept
+    return c
+
+
+def test_retries_429_until_success(client, fake_drive):
+    fake_drive.fail_next(429, times=2, reason="rateLimitExceeded")
+    r = client.get("/files", "tok", user_id="u")
+    assert r.status_code == 200
+    assert client.stats["retries"] == 2 and client.stats["throttled"] == 2
+
+
+def test_retries_5xx_and_quota_403(client, fake_drive):
+    fake_drive.fail_next(503)
+    fake_drive.fail_next(403, reason="userRateLimitExceeded")
+    r = client.get("/files", "tok", user_id="u")
+    assert r.status_code == 200
+    assert client.stats["retries"] == 2
+
+
+def test_other_403_is_returned_not_retried(client, fake_drive):
+    fake_drive.fail_next(403, reason="insufficientFilePermissions")
+    r = client.get("/files", "tok", user_id="u")
+    assert r.status_code == 403
+    assert client.stats["retries"] == 0
+
+
+def test_honours_retry_after(client, fake_drive):
+    fake_drive.fail_next(429, reason="rateLimitExceeded", retry_after="7")
+    assert client.get("/files", "tok", user_id="u").status_code == 200
+    assert client.slept == [7.0]
+
+
+def test_retry_after_is_capped(client, fake_drive, monkeypatch):
+    monkeypatch.setattr(drive_client, "DRIVE_BACKOFF_CAP", 2.0)
+    fake_drive.fail_next(503, retry_after="120")
+    client.get("/files", "tok", user_id="u")
+    assert client.slept == [2.0]
+
+
+def test_gives_up_after_max_retries(client, fake_drive, monkeypatch):
+    monkeypatch.setattr(drive_client, "DRIVE_MAX_RETRIES", 2)
+    fake_drive.fail_next(503, times=10)
+    r = client.get("/files", "tok", user_id="u")
+    assert r.status_code == 503
+    assert client.stats["requests"] == 3 and client.stats["errors"] == 1
+
+
+def test_connection_errors_raise_after_max_retries(monkeypatch):
+    monkeypatch.setattr(drive_client, "DRIVE_MAX_RETRIES", 1)
+    monkeypatch.setattr(drive_client.time, "sleep", lambda s: None)
+    c = DriveClient(base="http://127.0.0.1:9/drive/v3")     # nothing listens on discard
+    with pytest.raises(requests.ConnectionError):
+        c.get("/files", "tok", user_id="u")
+    assert c.stats["retries"] == 1
+
+
+def test_token_bucket_waits_once_burst_is_spent():
+    bucket = TokenBucket(rate=100, burst=2)
+    assert bucket.take() == 0 and bucket.take() == 0
+    assert bucket.take() > 0
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import numpy as np
+
+from embedding_service import EmbeddingBatcher
+
+
+class FakeModel:
+    """Embeds "7" as [7.0]; the first forward pass waits for `gate`."""
+
+    def __init__(self):
+        self.calls = []
+        self.gate  = threading.Event()
+
+    def get_sentence_embedding_dimension(self):
+        return 1
+
+    def encode(self, texts, batch_size, convert_to_numpy):
+        self.calls.append(len(texts))
+        if len(self.calls) == 1:
+            self.gate.wait(5)
+        return np.array([[float(t)] for t in texts])
+
+
+def wait_until(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_small_request_is_not_stuck_behind_a_bulk_encode():
+    model = FakeModel()
+    b = EmbeddingBatcher(model, max_batch=4, max_wait_ms=1)
+    out = {}
+    bulk = threading.Thread(target=lambda: out.update(bulk=b.encode([str(i) for i in range(10)])))
+    bulk.start()
+    wait_until(lambda: model.calls)        # first bulk slice is in the model
+    small = threading.Thread(target=lambda: out.update(small=b.encode(["42"])))
+    small.start()
+    wait_until(lambda: b._small)
+    model.gate.set()
+    bulk.join(5)
+    small.join(5)
+    # the query runs after one bulk slice, not after all of them
+    assert model.calls == [4, 1, 4, 2]
+    assert out["small"].tolist() == [[42.0]]
+    assert out["bulk"][:, 0].tolist() == list(range(10))
+
+
+def test_concurrent_small_requests_share_a_pass():
+    model = FakeModel()
+    model.gate.set()
+    b = EmbeddingBatcher(model, max_batch=8, max_wait_ms=200)
+    out = [None] * 3
+    threads = [threading.Thread(target=lambda i=i: out.__setitem__(i, b.encode([str(i), str(i)])))
+               for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert model.calls == [6]
+    assert [o[:, 0].tolist() for o in out] == [[0, 0], [1, 1], [2, 2]]
@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from llm_cache import LLMCache
+
+
+class CountingCache(LLMCache):
+    """Counts cache reads, so a test knows when a caller is past its cache check."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads = 0
+
+    def get(self, key):
+        hit = super().get(key)
+        with self._lock:
+            self.reads += 1
+        return hit
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CountingCache(path=str(tmp_path / "llm.sqlite"))
+
+
+def wait_until(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def run(fn):
+    """Run *fn* in a thread; returns (thread, outcomes) with its result or exception."""
+    out = []
+
+    def body():
+        try:
+            out.append(fn())
+        except Exception as e:
+            out.append(e)
+    t = threading.Thread(target=body)
+    t.start()
+    return t, out
+
+
+def test_identical_prompts_share_one_call(cache):
+    calls, release = [], threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    ask = lambda: cache.get_or_compute("q", "m", "p", {}, compute)
+    runs = [run(ask)]
+    wait_until(lambda: calls)
+    runs += [run(ask) for _ in range(3)]
+    # all three missed the cache while the leader is still computing
+    wait_until(lambda: cache.reads == 4)
+    release.set()
+    for t, _ in runs:
+        t.join(5)
+    assert [out for _, out in runs] == [["answer"]] * 4 and len(calls) == 1
+    assert cache.stats[("q", "coalesced")] == 3
+    # now served from sqlite
+    assert cache.get_or_compute("q", "m", "p", {}, lambda: "other") == "answer"
+
+
+def test_follower_recomputes_when_the_leader_fails(cache):
+    def failing():
+        # fail once a follower has missed the cache and joined this flight
+        wait_until(lambda: cache.reads == 2)
+        time.sleep(0.05)
+        raise RuntimeError("llm queue is full")
+
+    leader, leader_out = run(lambda: cache.get_or_compute("q", "m", "p", {}, failing))
+    wait_until(lambda: cache.reads == 1)
+    follower, follower_out = run(lambda: cache.get_or_compute("q", "m", "p", {}, lambda: "answer"))
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(leader_out[0], RuntimeError)
+    # the follower ran compute itself instead of returning an empty completion
+    assert follower_out == ["answer"]
+    assert cache.get_or_compute("q", "m", "p", {}, lambda: "other") == "answer"
+
+
+def test_user_completions_are_private_and_forgotten(cache):
+    ask = lambda uid, value: cache.get_or_compute("answer", "m", "p", {}, lambda: value, user_id=uid)
+    assert ask("alice", "a1") == "a1"
+    assert ask("bob", "b1") == "b1"              # same prompt, not shared across users
+    assert cache.get_or_compute("keywords", "m", "p", {}, lambda: "k") == "k"
+
+    cache.forget_user("alice")
+    assert ask("alice", "a2") == "a2"
+    assert ask("bob", "b2") == "b1"
+    assert cache.get_or_compute("keywords", "m", "p", {}, lambda: "other") == "k"
+
+
+def test_cache_files_without_user_column_are_upgraded(tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE llm_cache (key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL,"
+               " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+    db.close()
+    cache = LLMCache(path=path)
+    assert cache.get_or_compute("answer", "m", "p", {}, lambda: "a", user_id="alice") == "a"
+    cache.forget_user("alice")
+    assert cache.get_or_compute("answer", "m", "p", {}, lambda: "b", user_id="alice") == "b"
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+import scheduler as sched_mod
+from prefetch import Prefetcher
+from scheduler import scheduler
+
+
+@pytest.fixture
+def knobs(monkeypatch):
+    monkeypatch.setattr(sched_mod, "SCHED_ENABLED", True)
+    monkeypatch.setattr(sched_mod, "SCHED_PER_USER", 1)
+    monkeypatch.setattr(sched_mod, "SCHED_MAX_WAIT_S", 5.0)
+    monkeypatch.setattr(sched_mod, "SCHED_CANCEL_STALE", True)
+
+
+def wait_until(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def doc(i):
+    return {"id": f"f{i}", "name": f"f{i}", "raw": {"modifiedTime": "2024-01-01T00:00:00Z"}}
+
+
+class Fetcher:
+    """Downloads under the scheduler like fetch_doc_text; each waits for `gate`."""
+
+    def __init__(self):
+        self.running = []
+        self.gate    = threading.Event()
+
+    def __call__(self, d, user_id, token, prefix):
+        with scheduler.slot("download"):
+            self.running.append(d["id"])
+            self.gate.wait(5)
+        return f"text of {d['id']}"
+
+
+def test_prefetch_downloads_take_the_users_slots(knobs):
+    fetch, stage = Fetcher(), scheduler.stages["download"]
+    p = Prefetcher(fetch, workers=4, per_user=4)
+    token = scheduler.begin("a")
+    try:
+        assert p.prefetch("a", [doc(i) for i in range(3)], "tok") == 3
+        # SCHED_PER_USER=1: one prefetch downloads, the others queue
+        wait_until(lambda: len(stage.waiting) == 2)
+        assert fetch.running == ["f0"] and stage.by_user == {"a": 1}
+        fetch.gate.set()
+        assert [p.get("a", doc(i), "tok") for i in range(3)] == [f"text of f{i}" for i in range(3)]
+    finally:
+        scheduler.end(token)
+    assert p.stats["misses"] == 0 and stage.running == 0 and not stage.waiting
+
+
+def test_speculative_prefetch_is_cancelled_with_its_query(knobs):
+    fetch, stage = Fetcher(), scheduler.stages["download"]
+    p = Prefetcher(fetch, workers=4, per_user=4)
+    old = scheduler.begin("a")
+    try:
+        p.speculate("a", lambda: [doc(0), doc(1)], "tok")
+        wait_until(lambda: len(stage.waiting) == 1)
+        new = scheduler.begin("a")          # the user asked again
+        try:
+            wait_until(lambda: not stage.waiting)
+            fetch.gate.set()
+            # the cancelled prefetch left nothing behind: fetched inline for the new query
+            assert p.get("a", doc(1), "tok") == "text of f1"
+            assert p.stats["misses"] == 1
+        finally:
+            scheduler.end(new)
+    finally:
+        scheduler.end(old)
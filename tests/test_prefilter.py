@@ -0,0 +1,29 @@
+from folder_tree import build_folder_tree
+from prefilter import build_filter_columns, build_mask
+
+
+def rec(fid, ftype, modified, parents=()):
+    return {"id": fid, "name": fid, "type": ftype,
+            "raw": {"modifiedTime": modified, "parents": list(parents)}}
+
+
+MAPPING = [
+    rec("reports", "folder", "2024-01-01T00:00:00Z"),
+    rec("q1", "pdf", "2024-03-01T00:00:00Z", ["reports"]),
+    rec("old", "pdf", "2019-05-01T00:00:00Z"),
+]
+
+
+def test_filters_narrow_the_rows():
+    tree = build_folder_tree(MAPPING)
+    cols = build_filter_columns(MAPPING, tree)
+    assert build_mask(cols, tree, date="2024", folder="reports").tolist() == [True, True, False]
+    assert build_mask(cols, tree, ftype="pdf", date="2019").tolist() == [False, False, True]
+
+
+def test_non_string_filters_from_the_llm_are_ignored():
+    tree = build_folder_tree(MAPPING)
+    cols = build_filter_columns(MAPPING, tree)
+    for junk in (["reports"], 3, {"name": "reports"}, True):
+        assert build_mask(cols, tree, date=junk, folder=junk) is None
+    assert tree.find_folders(["reports"]) == []
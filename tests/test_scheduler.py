@@ -0,0 +1,200 @@
+import time
+import threading
+
+import pytest
+
+import scheduler as sched_mod
+from scheduler import Cancelled, Overloaded, Scheduler, parse_weights
+
+
+@pytest.fixture
+def knobs(monkeypatch):
+    monkeypatch.setattr(sched_mod, "SCHED_ENABLED", True)
+    monkeypatch.setattr(sched_mod, "SCHED_PER_USER", 2)
+    monkeypatch.setattr(sched_mod, "SCHED_MAX_QUEUE", 64)
+    monkeypatch.setattr(sched_mod, "SCHED_MAX_WAIT_S", 5.0)
+    monkeypatch.setattr(sched_mod, "SCHED_CANCEL_STALE", False)
+    return monkeypatch
+
+
+def wait_until(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def request(s, user, out, hold=None):
+    """A request thread: begin, take the llm slot, record who ran (or the error)."""
+    def body():
+        token = s.begin(user)
+        try:
+            with s.slot("llm"):
+                out.append(user)
+                if hold:
+                    hold.wait(5)
+        except (Overloaded, Cancelled) as e:
+            out.append(e)
+        finally:
+            s.end(token)
+    t = threading.Thread(target=body)
+    t.start()
+    return t
+
+
+def test_slots_go_to_users_in_fair_order(knobs):
+    s, out, hold = Scheduler({"llm": 1}), [], threading.Event()
+    stage = s.stages["llm"]
+    threads = [request(s, "blocker", out, hold)]
+    wait_until(lambda: stage.running == 1)
+    # three queued calls from one user, then two from another
+    for user in ["heavy"] * 3 + ["light"] * 2:
+        n = len(stage.waiting)
+        threads.append(request(s, user, out))
+        wait_until(lambda: len(stage.waiting) == n + 1)
+    hold.set()
+    for t in threads:
+        t.join()
+    assert out == ["blocker", "heavy", "light", "heavy", "light", "heavy"]
+
+
+def test_weights_scale_the_share(knobs):
+    knobs.setattr(sched_mod, "SCHED_WEIGHTS", {"heavy": 2.0})
+    s, out, hold = Scheduler({"llm": 1}), [], threading.Event()
+    stage = s.stages["llm"]
+    threads = [request(s, "blocker", out, hold)]
+    wait_until(lambda: stage.running == 1)
+    for user in ["heavy"] * 4 + ["light"] * 2:
+        n = len(stage.waiting)
+        threads.append(request(s, user, out))
+        wait_until(lambda: len(stage.waiting) == n + 1)
+    hold.set()
+    for t in threads:
+        t.join()
+    assert out[1:] == ["heavy", "light", "heavy", "heavy", "light", "heavy"]
+
+
+def test_user_at_the_cap_is_passed_over(knobs):
+    knobs.setattr(sched_mod, "SCHED_PER_USER", 1)
+    s, out, hold = Scheduler({"llm": 3}), [], threading.Event()
+    stage = s.stages["llm"]
+    threads = [request(s, "a", out, hold)]
+    wait_until(lambda: stage.running == 1)
+    threads.append(request(s, "a", out, hold))
+    wait_until(lambda: len(stage.waiting) == 1)
+    # a free slot, but "a" already runs one: "b" goes ahead of it
+    threads.append(request(s, "b", out, hold))
+    wait_until(lambda: stage.running == 2)
+    assert out == ["a", "b"] and stage.by_user == {"a": 1, "b": 1}
+    hold.set()
+    for t in threads:
+        t.join()
+    assert out == ["a", "b", "a"] and stage.running == 0 and not stage.by_user
+
+
+def test_full_queue_is_rejected_at_once(knobs):
+    knobs.setattr(sched_mod, "SCHED_MAX_QUEUE", 1)
+    s, out, hold = Scheduler({"llm": 1}), [], threading.Event()
+    stage = s.stages["llm"]
+    threads = [request(s, "a", out, hold)]
+    wait_until(lambda: stage.running == 1)
+    threads.append(request(s, "b", out))
+    wait_until(lambda: len(stage.waiting) == 1)
+    t0 = time.monotonic()
+    threads.append(request(s, "c", out))
+    threads[-1].join()
+    assert time.monotonic() - t0 < 1
+    assert isinstance(out[-1], Overloaded) and out[-1].stage == "llm"
+    hold.set()
+    for t in threads:
+        t.join()
+    assert out[-1] == "b"
+
+
+def test_wait_timeout_is_rejected(knobs):
+    knobs.setattr(sched_mod, "SCHED_MAX_WAIT_S", 0.05)
+    s, out, hold = Scheduler({"llm": 1}), [], threading.Event()
+    stage = s.stages["llm"]
+    holder = request(s, "a", out, hold)
+    wait_until(lambda: stage.running == 1)
+    request(s, "b", out).join()
+    assert isinstance(out[-1], Overloaded)
+    assert stage.waiting == []
+    hold.set()
+    holder.join()
+
+
+def test_newer_query_cancels_the_older_one(knobs):
+    knobs.setattr(sched_mod, "SCHED_CANCEL_STALE", True)
+    s, out, hold = Scheduler({"llm": 1}), [], threading.Event()
+    stage = s.stages["llm"]
+    holder = request(s, "a", out, hold)
+    wait_until(lambda: stage.running == 1)
+    waiter = request(s, "x", out)
+    wait_until(lambda: len(stage.waiting) == 1)
+
+    token = s.begin("x")
+    try:
+        # the queued request gives up its place ...
+        waiter.join(5)
+        assert isinstance(out[-1], Cancelled) and stage.waiting == []
+    finally:
+        s.end(token)
+
+    # ... and one between stages fails at its next slot without queueing
+    started, newer = threading.Event(), threading.Event()
+    result = []
+
+    def older():
+        token = s.begin("y")
+        started.set()
+        newer.wait(5)
+        try:
+            with s.slot("llm"):
+                result.append("ran")
+        except Cancelled as e:
+            result.append(e)
+        finally:
+            s.end(token)
+
+    t = threading.Thread(target=older)
+    t.start()
+    started.wait(5)
+    token = s.begin("y")
+    newer.set()
+    t.join()
+    s.end(token)
+    assert isinstance(result[0], Cancelled) and stage.waiting == []
+    hold.set()
+    holder.join()
+    assert s._active == {}
+
+
+def test_slot_is_a_no_op_outside_a_request(knobs):
+    s = Scheduler({"llm": 1})
+    with s.slot("llm"), s.slot("llm"):
+        assert s.stages["llm"].running == 0
+
+
+def test_weights_skip_malformed_items():
+    assert parse_weights("alice=2, bot=0.5") == {"alice": 2.0, "bot": 0.5}
+    assert parse_weights("alice,bob=,carol=1=2,dan=abc,eve=0,fay=-1,=3,gus=inf,hal=nan") == {}
+
+
+def test_batch_requests_neither_cancel_nor_get_cancelled(knobs):
+    knobs.setattr(sched_mod, "SCHED_CANCEL_STALE", True)
+    s = Scheduler({"llm": 1})
+    batch = s.begin("x", supersede=False)
+    try:
+        query = s.begin("x")
+        try:
+            newer = s.begin("x")
+            s.end(newer)
+        finally:
+            s.end(query)
+        # a second query cancelled the first, the batch still runs
+        with s.slot("llm"):
+            assert s.stages["llm"].running == 1
+    finally:
+        s.end(batch)
+    assert s._active == {}
@@ -0,0 +1,34 @@
+import os
+import threading
+
+import numpy as np
+
+from shared_index import get_shared_index, publish_index, shared_dir
+
+
+def test_concurrent_publishes_take_distinct_generations(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("user_data/u")
+    gens, errors = [], []
+
+    def build(n):
+        try:
+            embs = np.full((n, 4), n, dtype=np.float32)
+            mapping = [{"id": f"{n}-{i}"} for i in range(n)]
+            gens.append(publish_index("u", embs, mapping, {"tok": [0]}))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=build, args=(n,)) for n in range(1, 7)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert errors == []
+    assert sorted(gens) == list(range(1, 7))
+
+    # the live generation is whole: arrays and mapping from one writer
+    index = get_shared_index("u")
+    n = index.ntotal
+    assert index.gen == 6 and index.embs[0, 0] == n and index.record(n - 1) == {"id": f"{n}-{n - 1}"}
+    assert sorted(os.listdir(shared_dir("u"))) == [".lock", "CURRENT", "gen-5", "gen-6"]